@@ -1,11 +1,16 @@
 import requests
 import json
-import base64
 import socket
 import time
 import subprocess
 import os
+import gzip
+import shutil
+import tempfile
 import sys
+import threading
+import random
+import hashlib
 
 # ==========================================
 #              CONFIGURATION
@@ -13,6 +18,10 @@ import sys
 SERVER_IP = "127.0.0.1"
 PORT = 3753
 
+# Several server nodes sharing one campaign (server.py --nodes): list their base URLs
+# here instead, e.g. ["http://10.0.0.1:3753", "http://10.0.0.2:3753"].
+SERVER_URLS = []
+
 # Path to your executable (e.g., "bin/simulation.exe" or "./algo")
 EXE_PATH = "python dummy_work.py" 
 
@@ -23,11 +32,84 @@ OUTPUT_FILE_PATTERN = "output_{id}.txt"
 
 # Should we delete the output file after uploading?
 DELETE_AFTER_UPLOAD = True
+
+# Ask the server for several jobs at once (/lease) and upload their results
+# together (/completeBatch). Worth it for short jobs where round trips dominate.
+BATCH_MODE = True
+
+# Seconds between /heartbeat calls for the jobs in hand until the server has
+# said what its --lease-timeout is (lease_seconds); from then on a third of that.
+HEARTBEAT_INTERVAL = 30
+
+# Results bigger than UPLOAD_CHUNK_SIZE bytes are sent in pieces of that size
+# through a resumable upload. A failed upload is retried UPLOAD_RETRIES times.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+
+# Seconds an upload or /completeBatch may stall without the server sending or
+# taking any data before it is given up (and retried, or left to the lease timeout).
+REQUEST_TIMEOUT = 60
+
+# When the queue is empty but other runners still hold jobs that may come
+# back, wait on the server up to LONG_POLL_SECONDS per request instead of exiting.
+LONG_POLL_SECONDS = 30
+
+# A failed request is retried after a random delay of up to RETRY_BASE_DELAY * 2^n
+# seconds (n = failures so far, capped at RETRY_MAX_DELAY), so runners that lost
+# the server do not all come back at the same moment.
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+# gzip results before sending them. Pays off for text outputs, not for files
+# that are already compressed (.mat, .png, .zip, ...).
+COMPRESS_UPLOADS = False
+
+# What this machine offers, sent with every job request. The server only hands
+# out jobs whose job_requirements it meets. None = detect it; TAGS are free-form
+# labels matched against the jobs' "tags" (e.g. ["gpu", "matlab"]).
+CORES = None
+MEMORY_GB = None
+TAGS = []
 # ==========================================
 
 SERVER_URL = f"http://{SERVER_IP}:{PORT}"
 HOSTNAME = socket.gethostname()
 
+
+def node_order():
+    """Servers to get work from, in order. With SERVER_URLS each machine ranks the nodes by a hash
+    of its name (rendezvous hashing), so runners spread evenly and the same machine always starts
+    on the same node."""
+    if not SERVER_URLS:
+        return [SERVER_URL]
+    return sorted((url.rstrip("/") for url in SERVER_URLS),
+                  key=lambda url: hashlib.sha1(f"{HOSTNAME} {url}".encode()).digest(), reverse=True)
+
+
+def capability_headers():
+    """Cores, Memory (GB) and Tags headers describing this runner."""
+    cores = CORES or os.cpu_count() or 1
+    memory = MEMORY_GB
+    if memory is None and hasattr(os, "sysconf"):
+        try:
+            memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+        except (ValueError, OSError):
+            pass
+    headers = {"Cores": str(cores), "Tags": ",".join(TAGS)}
+    if memory is not None:
+        headers["Memory"] = f"{memory:.1f}"
+    return headers
+
+
+def new_session():
+    """Pooled keep-alive connections to the server, instead of a new TCP connection per request."""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+    return session
+
+# Used by the main loop; the heartbeat thread has its own, so it never waits for a free connection
+http = new_session()
+
 def construct_command_line(job_params):
     """
     Converts JSON parameters into command line arguments.
@@ -40,92 +122,287 @@ def construct_command_line(job_params):
         args.append(str(value))
     return args
 
+class Heartbeat:
+    """Background thread that keeps the server-side leases of the jobs in hand alive."""
+
+    def __init__(self):
+        self.held = set() # (campaign, job id): ids only identify a job within its campaign
+        self.lock = threading.Lock()
+        self.session = new_session()
+        self.interval = HEARTBEAT_INTERVAL
+        self.known = False # Whether the server has told us its lease timeout yet
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def lease_seconds(self, seconds):
+        """The server requeues a job after `seconds` without a heartbeat (0: never). Beat three times in that span."""
+        if seconds is None:
+            return
+        self.known = True
+        self.interval = seconds / 3 if seconds > 0 else HEARTBEAT_INTERVAL
+
+    def hold(self, job_ids, campaign=None):
+        with self.lock:
+            self.held.update((campaign, job_id) for job_id in job_ids)
+
+    def release(self, job_ids, campaign=None):
+        with self.lock:
+            self.held.difference_update((campaign, job_id) for job_id in job_ids)
+
+    def _loop(self):
+        last = 0
+        while True:
+            # Wake up often enough to follow a shorter interval learnt from a /lease reply
+            time.sleep(min(1, self.interval))
+            if time.time() - last < self.interval:
+                continue
+            by_campaign = {}
+            with self.lock:
+                for campaign, job_id in self.held:
+                    by_campaign.setdefault(campaign, []).append(job_id)
+            if not by_campaign and not self.known:
+                by_campaign[None] = [] # Holding nothing yet, only ask for the lease timeout
+            if by_campaign:
+                last = time.time()
+            # One heartbeat per campaign, the server looks the ids up in the one named
+            for campaign, job_ids in by_campaign.items():
+                headers = {**runner_headers(campaign), "ID": ",".join(str(i) for i in sorted(job_ids))}
+                try:
+                    r = self.session.get(f"{SERVER_URL}/heartbeat", headers=headers, timeout=10)
+                    reply = r.json()
+                    self.lease_seconds(reply.get("lease_seconds"))
+                    lost = reply.get("lost", [])
+                    if lost:
+                        print(f"   [Heartbeat] Server has taken back jobs {', '.join(lost)}.")
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"   [Heartbeat] Failed: {e}")
+
+def runner_headers(campaign=None):
+    """ComputerName, plus the Campaign the jobs came from when the server runs several."""
+    headers = {"ComputerName": HOSTNAME}
+    if campaign:
+        headers["Campaign"] = campaign
+    return headers
+
+def backoff(failures):
+    """Sleep before retrying after `failures` failed attempts in a row."""
+    time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** failures)))
+
+def fetch_jobs(heartbeat):
+    """Returns a list of jobs, an empty list when the server is finished, or None if unreachable.
+    Keeps long-polling while the server has no job yet but may get one back."""
+    headers = {"ComputerName": HOSTNAME, "Wait": str(LONG_POLL_SECONDS), **capability_headers()}
+    try:
+        while True:
+            if BATCH_MODE:
+                r = http.get(f"{SERVER_URL}/lease", headers=headers, timeout=LONG_POLL_SECONDS + 10)
+            else:
+                r = http.get(SERVER_URL, headers=headers, timeout=LONG_POLL_SECONDS + 10)
+            r.raise_for_status()
+            reply = r.json()
+            if not reply.get("retry"):
+                break
+    except requests.exceptions.RequestException as e:
+        print(f"Server connection issue: {e}. Retrying...")
+        return None
+
+    # Check if finished
+    if "message" in reply:
+        return []
+    heartbeat.lease_seconds(reply.get("lease_seconds"))
+    return reply["jobs"] if BATCH_MODE else [reply]
+
+def run_job(job):
+    """Runs the executable for one job. Returns (output_filename, duration) or None on failure."""
+    job_id = job['id']
+    print(f"\n>> Processing Job ID: {job_id}")
+    print(f"   Params: {job}")
+
+    # 2. Construct Command
+    # Split EXE_PATH in case it contains spaces (e.g. "python script.py")
+    cmd = EXE_PATH.split() + construct_command_line(job)
+
+    print(f"   Executing: {' '.join(cmd)}")
+
+    # 3. Run Executable
+    start_time = time.time()
+    try:
+        # Run and wait for completion. Capture output if needed for debugging.
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # print("   Stdout:", result.stdout) # Uncomment for debug
+    except subprocess.CalledProcessError as e:
+        print(f"   [ERROR] Execution failed for ID {job_id}")
+        print(f"   Stderr: {e.stderr}")
+        # We skip uploading if the execution crashed
+        return None
+
+    duration = time.time() - start_time
+    print(f"   Execution finished in {duration:.2f}s")
+
+    # 4. Locate Output File
+    expected_filename = OUTPUT_FILE_PATTERN.format(id=job_id)
+
+    if not os.path.exists(expected_filename):
+        print(f"   [ERROR] Expected output file '{expected_filename}' not found!")
+        return None
+
+    return expected_filename, duration
+
+def upload_file(file_name, f, size, job_id=None, duration=None, campaign=None, finish=True):
+    """Sends one result. Files up to UPLOAD_CHUNK_SIZE go in a single /upload, larger ones through a
+    resumable session that carries on from the last byte the server has after a dropped connection.
+    With a job_id the server also marks that job finished, unless `finish` is False (batch mode)."""
+    base = runner_headers(campaign)
+    headers = dict(base)
+    if job_id is not None and finish:
+        headers["ID"] = str(job_id)
+        headers["Duration"] = f"{duration:.3f}"
+    elif job_id is not None:
+        headers["Job-ID"] = str(job_id) # Only stored; dropped if another copy already finished the job
+    encoding = {}
+    if COMPRESS_UPLOADS:
+        f, size = gzip_file(f)
+        encoding = {"Content-Encoding": "gzip"}
+
+    session = None
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            if size <= UPLOAD_CHUNK_SIZE:
+                f.seek(0)
+                r = http.post(f"{SERVER_URL}/upload", data=f.read(),
+                              headers={**headers, **encoding, "File-Name": file_name, "Content-Type": "application/octet-stream"},
+                              timeout=REQUEST_TIMEOUT)
+                r.raise_for_status()
+                return
+
+            if session is None:
+                r = http.post(f"{SERVER_URL}/uploads", headers={**base, "File-Name": file_name, **encoding},
+                              timeout=REQUEST_TIMEOUT)
+                r.raise_for_status()
+                session = r.json()["session"]
+
+            r = http.get(f"{SERVER_URL}/uploads/{session}", headers=base, timeout=10)
+            if r.status_code == 404:
+                session = None
+                continue
+            r.raise_for_status()
+            offset = r.json()["offset"]
+
+            while offset < size:
+                f.seek(offset)
+                r = http.put(f"{SERVER_URL}/uploads/{session}", data=f.read(UPLOAD_CHUNK_SIZE),
+                             headers={**base, "Offset": str(offset), "Content-Type": "application/octet-stream"},
+                             timeout=REQUEST_TIMEOUT)
+                if r.status_code != 409:
+                    r.raise_for_status()
+                offset = r.json()["offset"]
+
+            r = http.post(f"{SERVER_URL}/uploads/{session}/finish", headers={**headers, "Size": str(size)},
+                          timeout=REQUEST_TIMEOUT)
+            r.raise_for_status()
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"   [Upload] {file_name} interrupted ({e}), retrying...")
+            backoff(attempt)
+
+    raise RuntimeError(f"Upload of {file_name} failed after {UPLOAD_RETRIES} attempts")
+
+def gzip_file(f):
+    """Compressed copy of f in a temporary file. Returns (file, size)."""
+    f.seek(0)
+    out = tempfile.TemporaryFile()
+    with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+        shutil.copyfileobj(f, gz, UPLOAD_CHUNK_SIZE)
+    return out, out.tell()
+
+def upload_output(filename, job_id=None, duration=None, campaign=None, finish=True):
+    # 5. Upload
+    with open(filename, "rb") as f:
+        upload_file(os.path.basename(filename), f, os.path.getsize(filename), job_id, duration, campaign, finish)
+
+def cleanup(filename):
+    # 7. Cleanup
+    if DELETE_AFTER_UPLOAD:
+        os.remove(filename)
+        print(f"   [Cleanup] Deleted local file.")
+
 def main():
+    global SERVER_URL
+    nodes = node_order()
+    node = 0
+    SERVER_URL = nodes[node]
+    finished = set() # Nodes that said they have no more data since the last job came in
     print(f"--- Generic Runner Wrapper on {HOSTNAME} ---")
     print(f"Target EXE: {EXE_PATH}")
     print(f"Connecting to: {SERVER_URL}")
+    heartbeat = Heartbeat()
+    failures = 0
 
     while True:
         try:
             # 1. GET Request
-            headers = {"ComputerName": HOSTNAME}
-            try:
-                r = requests.get(SERVER_URL, headers=headers, timeout=10)
-                r.raise_for_status()
-                job = r.json()
-            except requests.exceptions.RequestException as e:
-                print(f"Server connection issue: {e}. Retrying in 5s...")
-                time.sleep(5)
+            jobs = fetch_jobs(heartbeat)
+            if jobs is None:
+                backoff(failures)
+                failures += 1
                 continue
+            failures = 0
 
-            # Check if finished
-            if "message" in job:
+            if not jobs:
+                # A node may get jobs back from the others, so go round until all of them are done
+                finished.add(SERVER_URL)
+                if len(finished) < len(nodes):
+                    node = (node + 1) % len(nodes)
+                    SERVER_URL = nodes[node]
+                    print(f">> {nodes[node - 1]} has no more data, moving to {SERVER_URL}")
+                    continue
                 print(">> Message from server: No more data. Stopping.")
                 break
+            finished.clear()
 
-            job_id = job['id']
-            print(f"\n>> Processing Job ID: {job_id}")
-            print(f"   Params: {job}")
+            campaign = jobs[0].get("Campaign") # All jobs of a lease come from the same campaign
+            heartbeat.hold((job['id'] for job in jobs), campaign)
+            try:
+                results = []
+                uploaded_files = []
+                for job in jobs:
+                    outcome = run_job(job)
+                    if outcome is None:
+                        continue
+                    expected_filename, duration = outcome
 
-            # 2. Construct Command
-            # Split EXE_PATH in case it contains spaces (e.g. "python script.py")
-            cmd = EXE_PATH.split() + construct_command_line(job)
-            
-            print(f"   Executing: {' '.join(cmd)}")
+                    if BATCH_MODE:
+                        # Store the file now, mark the whole batch finished below
+                        upload_output(expected_filename, job['id'], campaign=campaign, finish=False)
+                        results.append({
+                            "id": job['id'],
+                            "duration": duration
+                        })
+                        uploaded_files.append(expected_filename)
+                        continue
 
-            # 3. Run Executable
-            start_time = time.time()
-            try:
-                # Run and wait for completion. Capture output if needed for debugging.
-                result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-                # print("   Stdout:", result.stdout) # Uncomment for debug
-            except subprocess.CalledProcessError as e:
-                print(f"   [ERROR] Execution failed for ID {job_id}")
-                print(f"   Stderr: {e.stderr}")
-                # We skip uploading if the execution crashed
-                continue
-            
-            duration = time.time() - start_time
-            print(f"   Execution finished in {duration:.2f}s")
-
-            # 4. Locate Output File
-            expected_filename = OUTPUT_FILE_PATTERN.format(id=job_id)
-            
-            if not os.path.exists(expected_filename):
-                print(f"   [ERROR] Expected output file '{expected_filename}' not found!")
-                continue
+                    # 6. Upload
+                    upload_output(expected_filename, job['id'], duration, campaign)
+                    print(f"   [Success] Uploaded {expected_filename}")
+                    cleanup(expected_filename)
 
-            # 5. Read and Encode
-            with open(expected_filename, "rb") as f:
-                file_binary = f.read()
-                
-            b64_content = base64.b64encode(file_binary).decode('utf-8')
-
-            # 6. Upload
-            payload = {
-                "file_name": expected_filename,
-                "file": b64_content
-            }
-            
-            post_headers = {
-                "ComputerName": HOSTNAME,
-                "ID": str(job_id)
-            }
-            
-            requests.post(SERVER_URL, json=payload, headers=post_headers)
-            print(f"   [Success] Uploaded {expected_filename}")
-
-            # 7. Cleanup
-            if DELETE_AFTER_UPLOAD:
-                os.remove(expected_filename)
-                print(f"   [Cleanup] Deleted local file.")
+                if results:
+                    r = http.post(f"{SERVER_URL}/completeBatch", json={"results": results},
+                                  headers=runner_headers(campaign), timeout=REQUEST_TIMEOUT)
+                    r.raise_for_status()
+                    print(f"   [Success] Uploaded batch of {len(results)} results")
+                    for filename in uploaded_files:
+                        cleanup(filename)
+            finally:
+                # Also when something failed: the leases of unfinished jobs then run out and they are requeued
+                heartbeat.release((job['id'] for job in jobs), campaign)
 
         except KeyboardInterrupt:
             print("\nRunner stopped by user.")
             break
         except Exception as e:
             print(f"Critical error: {e}")
-            time.sleep(5)
+            backoff(failures)
+            failures += 1
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
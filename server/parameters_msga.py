@@ -87,6 +87,14 @@ empty_param = {
 
 
 
+# The four selection percentages are quarters that must add up to 1, so only
+# the combinations summing to 4 are generated, then scaled down to fractions.
+selection_keys = ["tournamentPer", "stocPer", "rankPer", "truncPer"]
+
+def to_fractions(obj):
+    for key in selection_keys:
+        obj[key] = obj[key] / 4
+
 data_one, id_counter = generate_combined_data(
     shared_one,
     id_counter,
@@ -96,7 +104,9 @@ data_one, id_counter = generate_combined_data(
     cec2010,
     cec2013,
     cec2017,
-    cec2020
+    cec2020,
+    constraints=[FixedSum(selection_keys, 4)],
+    transform=to_fractions
 )
 
 data_two, id_counter = generate_combined_data(
@@ -124,28 +134,12 @@ def norm(v):
         return v 
     return v / norm
 
-pruned_list = []
-id_counter = 1
 funcVal = None
 
 
 grouped_sets = {}
 
-data_array = data_one + data_two + data_three
-
-for obj in data_array:
-    
-    if obj['adaptive'] == 0:
-        resultVec = [obj['tournamentPer'], obj['stocPer'], obj['rankPer'], obj['truncPer']]
-
-        if(sum(resultVec) != 4):
-            continue
-    
-        obj['tournamentPer'], obj['stocPer'], obj['rankPer'], obj['truncPer'] = obj['tournamentPer'] / 4, obj['stocPer'] / 4, obj['rankPer'] / 4, obj['truncPer'] / 4
-    
-    obj['id'] = id_counter
-    id_counter += 1
-    pruned_list.append(obj)
+pruned_list = data_one + data_two + data_three
 
 
 totalFE = sum((item['maxFE'] * item['repeat']) for item in pruned_list)
@@ -193,4 +187,8 @@ calculateCompletion('2020', cutOffArea)
 # )
 
 # data_array = data_one + data_two
-data_array = pruned_list
\ No newline at end of file
+data_array = pruned_list
+
+# Hand out the most expensive jobs first (server.py --schedule lpt) so the
+# 1000-D CEC2008 runs do not end up as the last stragglers
+job_cost = "maxFE * repeat"
\ No newline at end of file
@@ -5,397 +5,4029 @@ import time
 import sys
 import threading
 import base64
+import heapq
+import queue
+import collections
+import itertools
+import math
+import bisect
+import array
+import tempfile
+import uuid
+import re
+import io
+import shutil
+import struct
+import zlib
+import gzip
 import numpy as np
 import socket
 import argparse
-from datetime import datetime
+import asyncio
+import http.client
+import email.utils
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import urllib.request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Server settings
 DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 3753
-STATE_FILE = "experiment_state.json"
+CAMPAIGN_DIR = "campaigns" # --campaign NAME=... keeps its state, logs and data/ in CAMPAIGN_DIR/NAME
+STATE_FILE = "experiment_state.npz"
+LEGACY_STATE_FILE = "experiment_state.json" # Older servers wrote plain JSON; still read by --cont
+JOURNAL_FILE = "experiment_state.journal"
+CHECKPOINT_INTERVAL = 15
+
+# Batch leasing: a lease is sized so that it keeps a runner busy for roughly
+# LEASE_TARGET_SECONDS, based on the measured duration of finished jobs.
+LEASE_TARGET_SECONDS = 60
+MAX_LEASE_SIZE = 256
+DURATION_SMOOTHING = 0.2
+
+# Lease expiry: a job whose runner has not sent a heartbeat for LEASE_TIMEOUT
+# seconds is put back in the queue. 0 disables expiry (runners without
+# heartbeats, e.g. the Matlab one, keep their jobs until they ask again).
+LEASE_TIMEOUT = 0
+REAPER_INTERVAL = 5
+
+# Long-poll dispatch: a request with a Wait header that finds the queue empty while jobs
+# are still running waits up to that many seconds (at most MAX_DISPATCH_WAIT) for one
+# to be requeued, and gets RETRY_REPLY if none was
+MAX_DISPATCH_WAIT = 60
+RETRY_REPLY = {"retry": True}
+
+# Speculative execution (--speculate): once nothing is queued, an idle runner gets a copy of
+# the running job that has run longest, if that is over SPECULATE_FACTOR times the median
+# job duration, up to MAX_BACKUPS copies per job. The first result counts, later ones are ignored.
+SPECULATE_FACTOR = 2.0
+MAX_BACKUPS = 1
+
+# Several nodes (--nodes): a node with fewer jobs queued than running checks its peers every
+# NODE_POLL_INTERVAL seconds and takes over half the difference to the longest queue, if that
+# is at least NODE_MIN_STEAL jobs. See Node.
+NODE_POLL_INTERVAL = 2
+NODE_MIN_STEAL = 2
+NODE_TIMEOUT = 10
+NODE_HANDOVER_TIMEOUT = 3 * NODE_TIMEOUT # Seconds a node waits for /node/confirm before taking handed over jobs back
+NODE_FILE = "node.json" # Which node of which --nodes list a directory belongs to
+
+# Relay (--relay): a server for the runners of one site that leases from an upstream server
+RELAY_BATCH = 100                    # Jobs kept queued for the local runners (--relay-batch); refilled at half
+RELAY_POLL_INTERVAL = 0.5            # Seconds between checks of the local queue
+RELAY_WAIT = 20                      # Seconds a lease request long-polls upstream
+RELAY_FORWARD_INTERVAL = 2           # Seconds between sending finished jobs upstream
+RELAY_INLINE_SIZE = 256 * 1024       # Results up to this size travel inside the /completeBatch body, larger ones through /upload
+RELAY_BATCH_BYTES = 16 * 1024 * 1024 # Results inside one /completeBatch body at most
+RELAY_TIMEOUT = 60
+
+# Event logs (/logs, /status): newest entries kept in memory, everything spilled to LOG_DIR
+LOG_DIR = "logs"
+EVENT_BUFFER_SIZE = 10_000
+EVENT_SEGMENT_SIZE = 100_000
+STATUS_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10_000
+
+# /timeStats throughput is averaged over roughly this many seconds
+THROUGHPUT_WINDOW = 300
+
+# /upload bodies are read and written in pieces of this many bytes
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Partial files of resumable uploads (/uploads), dropped if not finished within UPLOAD_SESSION_TTL seconds
+UPLOAD_SESSION_DIR = os.path.join("data", ".partial")
+UPLOAD_SESSION_TTL = 7 * 24 * 3600
+
+# Responses of at least this many bytes are compressed for clients that send Accept-Encoding
+COMPRESS_MIN_SIZE = 1024
+
+# Results are stored in data/ as received (None) or compressed, "gzip" or "zstd" (--compress-results)
+RESULT_COMPRESSION = None
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Results are kept flat in data/ (shard size 0) or in subdirectories of --shard-size ids each.
+# The choice is recorded in data/.layout.json; utility/migrate_layout.py converts between the two.
+LAYOUT_FILE = ".layout.json"
+
+# --store packed appends results to segment files of about SEGMENT_SIZE bytes in PACKED_DIR
+# instead of writing one file each (see SegmentStore)
+RESULT_STORE = "files"
+PACKED_DIR = os.path.join("data", ".packed")
+SEGMENT_SIZE = 1024 * 1024 * 1024
+
+# Bitmap of the job ids whose result is stored, see CompletionIndex
+COMPLETION_INDEX = os.path.join("data", ".completed")
+COMPLETION_DIRTY = ".dirty" # Next to the index while a server has it open, see CompletionIndex
+
+# Connections are kept open between requests (HTTP/1.1 keep-alive) and closed
+# once the client has sent nothing for IDLE_TIMEOUT seconds (--idle-timeout)
+IDLE_TIMEOUT = 60
+
+# --backend asyncio: connections are served by one event loop, blocking work by these thread pools
+ASYNC_WORKERS = 32
+ASYNC_UPLOAD_WORKERS = 16
+ASYNC_BACKLOG = 1024
+
+# /metrics histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOCK_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10)
+
+# Job status codes kept in JobStatusStore.status
+JOB_PENDING = 0   # Never handed out
+JOB_RUNNING = 1   # Handed out, not finished yet
+JOB_FINISHED = 2  # Result received
+JOB_RESET = 3     # Taken back (terminal, webpage, lost lease) and waiting to be handed out again
+JOB_PRE = 4       # Finished before this server started (--index / files already on disk)
+JOB_ELSEWHERE = 5 # Owned by another node (--nodes), see Node
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+METRICS = [] # Every Metric, in the order /metrics lists them
+
+
+def metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """A metric family for /metrics (Prometheus text format): one value per combination of label values.
+
+    Updating one takes its own lock for a moment and nothing else; the text
+    is only put together when /metrics is read.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {} # label values -> value
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def _labels(self, values, extra=()):
+        pairs = [*zip(self.labels, values), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{metric_label(value)}"' for key, value in pairs) + "}"
+
+    def _snapshot(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._snapshot():
+            lines += self._samples(labels, value)
+        return lines
+
+    def _samples(self, labels, value):
+        return [f"{self.name}{self._labels(labels)} {value}"]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Counter(Gauge):
+    kind = "counter"
+
+
+class Histogram(Metric):
+    """Counts of observations per bucket (upper bounds `buckets`, plus +Inf) and their sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # One count per bucket and +Inf, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+    def _snapshot(self):
+        with self.lock:
+            return sorted((labels, list(counts)) for labels, counts in self.values.items())
+
+    def _samples(self, labels, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f"{self.name}_bucket{self._labels(labels, [('le', le)])} {total}")
+        lines.append(f"{self.name}_sum{self._labels(labels)} {counts[-1]}")
+        lines.append(f"{self.name}_count{self._labels(labels)} {total}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("experiment_server_request_seconds", "Time from reading a request to having its response ready (long-polls included)", ("method", "path"))
+REQUESTS_IN_FLIGHT = Gauge("experiment_server_requests_in_flight", "Requests being handled")
+LOCK_WAIT_SECONDS = Histogram("experiment_server_lock_wait_seconds", "Time spent waiting to acquire a lock", ("lock", "campaign"), LOCK_BUCKETS)
+LOCK_HOLD_SECONDS = Histogram("experiment_server_lock_hold_seconds", "Time a lock was held per acquisition", ("lock", "campaign"), LOCK_BUCKETS)
+RESULT_BYTES = Counter("experiment_server_result_bytes_total", "Bytes of results written to data/", ("campaign",))
+RESULT_WRITE_SECONDS = Histogram("experiment_server_result_write_seconds", "Time spent writing and syncing one result to disk", ("campaign",))
+STATE_WRITE_SECONDS = Histogram("experiment_server_state_write_seconds", "Time to append to the journal or write a checkpoint", ("campaign", "kind"))
+
+
+def render_metrics():
+    """Text of /metrics: every Metric, then the job counts and journal backlog read from each campaign."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    gauges = {"experiment_server_jobs": ("Jobs by state", []),
+              "experiment_server_journal_backlog": ("State transitions waiting to be written to the journal", [])}
+    for campaign in campaigns:
+        experimenter = campaign.experimenter
+        name = metric_label(campaign.name)
+        with experimenter.lock:
+            jobs = experimenter.jobs
+            counts = {"queued": len(experimenter.data_array) - jobs.running - jobs.done - jobs.elsewhere,
+                      "running": jobs.running, "finished": jobs.done, "elsewhere": jobs.elsewhere}
+        for state, count in counts.items():
+            gauges["experiment_server_jobs"][1].append(f'experiment_server_jobs{{campaign="{name}",state="{state}"}} {count}')
+        gauges["experiment_server_journal_backlog"][1].append(f'experiment_server_journal_backlog{{campaign="{name}"}} {experimenter.journal.qsize()}')
+    for metric, (help, samples) in gauges.items():
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} gauge", *samples]
+    return "\n".join(lines) + "\n"
+
+
+def request_started():
+    REQUESTS_IN_FLIGHT.inc()
+    return time.perf_counter()
+
+
+def request_finished(method, path, started):
+    REQUEST_SECONDS.observe(time.perf_counter() - started, method, metrics_path(path))
+    REQUESTS_IN_FLIGHT.inc(amount=-1)
+
+
+class TimedLock:
+    """threading.Lock that records into /metrics how long each acquisition waited and held it.
+
+    Works under threading.Condition, which releases and re-acquires it through
+    the same methods while waiting.
+    """
+
+    def __init__(self, name, campaign=""):
+        self.labels = (name, campaign)
+        self.inner = threading.Lock()
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        if not self.inner.acquire(blocking, timeout):
+            return False
+        self.acquired_at = now = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(now - start, *self.labels)
+        return True
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        self.inner.release()
+        LOCK_HOLD_SECONDS.observe(held, *self.labels)
+
+    def locked(self):
+        return self.inner.locked()
+
+    def _is_owned(self):
+        # threading.Condition's own check would acquire the lock and count as a use
+        return self.inner.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class JobStatusStore:
+    """Compact per-job tracking: one status byte, an interned worker id and two
+    float64 timestamps (seconds since `epoch`) per job, 19 bytes a job. float64
+    keeps durations exact to well under a microsecond however long a campaign
+    runs; float32 would be down to whole seconds after about three months.
+    Running jobs also cost a lease deadline (a dict and a heap entry, about 170
+    bytes while --lease-timeout is set) and speculated ones their backups
+    entry, both kept by the Experimenter.
+
+    Updates are O(1) array writes and counts are vectorised numpy reductions,
+    so nothing here walks Python lists. The number of running and finished
+    jobs is also kept as running counters for constant-time reads.
+    """
+
+    def __init__(self, size=0, epoch=None):
+        self.epoch = time.time() if epoch is None else epoch
+        self.size = size
+        self.status = np.zeros(size, dtype=np.uint8)
+        self.worker = np.zeros(size, dtype=np.uint16) # 0 = nobody, else index into worker_names
+        self.taken = np.full(size, np.nan, dtype=np.float64)
+        self.completed = np.full(size, np.nan, dtype=np.float64)
+        self.worker_names = [None]
+        self.worker_ids = {}
+        self.running = 0
+        self.done = 0 # JOB_FINISHED + JOB_PRE
+        self.elsewhere = 0 # JOB_ELSEWHERE
+
+    def __len__(self):
+        return self.size
+
+    def ensure(self, index):
+        """Grow the arrays (geometrically) so that `index` is addressable."""
+        if index < self.size:
+            return
+        capacity = len(self.status)
+        if index >= capacity:
+            capacity = max(index + 1, capacity * 2, 1024)
+            self.status = self._grown(self.status, capacity, 0)
+            self.worker = self._grown(self.worker, capacity, 0)
+            self.taken = self._grown(self.taken, capacity, np.nan)
+            self.completed = self._grown(self.completed, capacity, np.nan)
+        self.size = index + 1
+
+    @staticmethod
+    def _grown(array, capacity, fill):
+        grown = np.full(capacity, fill, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def intern(self, computer_name):
+        worker_id = self.worker_ids.get(computer_name)
+        if worker_id is None:
+            worker_id = len(self.worker_names)
+            if worker_id > np.iinfo(self.worker.dtype).max:
+                self.worker = self.worker.astype(np.uint32)
+            self.worker_names.append(computer_name)
+            self.worker_ids[computer_name] = worker_id
+        return worker_id
+
+    def clock(self, now=None):
+        return np.float64((time.time() if now is None else now) - self.epoch)
+
+    def _leave(self, index):
+        """Update the counters for a job about to change status."""
+        status = self.status[index]
+        if status == JOB_RUNNING:
+            self.running -= 1
+        elif status == JOB_FINISHED or status == JOB_PRE:
+            self.done -= 1
+        elif status == JOB_ELSEWHERE:
+            self.elsewhere -= 1
+
+    def recount(self):
+        self.running = self.count(JOB_RUNNING)
+        self.done = self.count(JOB_FINISHED, JOB_PRE)
+        self.elsewhere = self.count(JOB_ELSEWHERE)
+
+    def take(self, index, computer_name, now=None):
+        self.ensure(index)
+        self._leave(index)
+        self.running += 1
+        self.status[index] = JOB_RUNNING
+        self.worker[index] = self.intern(computer_name)
+        self.taken[index] = self.clock(now)
+
+    def finish(self, index, now=None):
+        self.ensure(index)
+        self._leave(index)
+        self.done += 1
+        self.status[index] = JOB_FINISHED
+        self.completed[index] = self.clock(now)
+
+    def reset(self, index):
+        self.ensure(index)
+        self._leave(index)
+        self.status[index] = JOB_RESET
+
+    def hand_over(self, index):
+        """The job now belongs to another node."""
+        self.ensure(index)
+        self._leave(index)
+        self.elsewhere += 1
+        self.status[index] = JOB_ELSEWHERE
+
+    def adopt(self, index):
+        """A job taken over from another node, waiting to be handed out here."""
+        self.ensure(index)
+        self._leave(index)
+        self.status[index] = JOB_PENDING
+
+    def mark_pre(self, start, stop):
+        """Mark [start, stop) as finished before the server started."""
+        if stop > start:
+            self.ensure(stop - 1)
+            self.status[start:stop] = JOB_PRE
+            self.recount()
+
+    def mark_elsewhere(self, start, stop):
+        """Mark [start, stop) as belonging to another server (see Relay)."""
+        if stop > start:
+            self.ensure(stop - 1)
+            self.status[start:stop] = JOB_ELSEWHERE
+            self.recount()
+
+    def is_finished(self, index):
+        return index < self.size and self.status[index] in (JOB_FINISHED, JOB_PRE)
+
+    def is_running(self, index):
+        return index < self.size and self.status[index] == JOB_RUNNING
+
+    def is_queued(self, index):
+        """Waiting to be handed out: never run, or reset."""
+        return index < self.size and self.status[index] in (JOB_PENDING, JOB_RESET)
+
+    def owner(self, index):
+        """Name of the worker holding/that finished the job, using the legacy givenToPC labels otherwise."""
+        if index >= self.size:
+            return "Null"
+        status = self.status[index]
+        if status == JOB_PRE:
+            return "PRE"
+        if status == JOB_RESET:
+            return "Reset"
+        if status == JOB_ELSEWHERE:
+            return "Elsewhere"
+        return self.worker_names[self.worker[index]] or "Null"
+
+    def started_at(self, index):
+        """Absolute time.time() the job was last handed out, or None."""
+        if index >= self.size or np.isnan(self.taken[index]):
+            return None
+        return self.epoch + float(self.taken[index])
+
+    def time_string(self, index, column):
+        value = column[index] if index < self.size else np.nan
+        if np.isnan(value):
+            return None
+        return time.strftime(TIME_FORMAT, time.localtime(self.epoch + float(value)))
+
+    def timing(self, index):
+        """'Taken At' / 'Completed At' entries for /info and the terminal."""
+        info = {}
+        taken = self.time_string(index, self.taken)
+        if taken:
+            info['Taken At'] = taken
+        if index < self.size and self.status[index] == JOB_FINISHED:
+            completed = self.time_string(index, self.completed)
+            if completed:
+                info['Completed At'] = completed
+        return info
+
+    def count(self, *statuses):
+        return int(np.isin(self.status[:self.size], statuses).sum())
+
+    def indices(self, status):
+        return np.flatnonzero(self.status[:self.size] == status)
+
+    def durations(self):
+        """Durations of every finished job that has both timestamps, as a numpy array."""
+        status = self.status[:self.size]
+        spans = self.completed[:self.size] - self.taken[:self.size]
+        return spans[(status == JOB_FINISHED) & (spans > 0)]
+
+    def copy(self):
+        """Independent snapshot, e.g. for writing a checkpoint outside the lock."""
+        other = JobStatusStore(0, self.epoch)
+        other.size = self.size
+        other.status = self.status[:self.size].copy()
+        other.worker = self.worker[:self.size].copy()
+        other.taken = self.taken[:self.size].copy()
+        other.completed = self.completed[:self.size].copy()
+        other.worker_names = list(self.worker_names)
+        other.worker_ids = dict(self.worker_ids)
+        other.running, other.done, other.elsewhere = self.running, self.done, self.elsewhere
+        return other
+
+    def save(self, f, meta):
+        """Write the arrays plus a JSON metadata blob into an .npz file object."""
+        meta = dict(meta, epoch=self.epoch, worker_names=self.worker_names[1:])
+        np.savez(f, status=self.status[:self.size], worker=self.worker[:self.size],
+                 taken=self.taken[:self.size], completed=self.completed[:self.size],
+                 meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        """Returns (store, meta) read from a file written by save()."""
+        with np.load(path) as f:
+            meta = json.loads(str(f['meta']))
+            store = cls(0, meta['epoch'])
+            store.status = f['status'].copy()
+            store.worker = f['worker'].copy()
+            # Checkpoints written before the switch to float64 hold float32
+            store.taken = f['taken'].astype(np.float64)
+            store.completed = f['completed'].astype(np.float64)
+        store.size = len(store.status)
+        for name in meta['worker_names']:
+            store.intern(name)
+        store.recount()
+        return store, meta
+
+    @classmethod
+    def from_legacy(cls, state):
+        """Build a store from the old JSON state (completed_array/givenToPC/timing_info)."""
+        completed_array = state.get("completed_array", [])
+        givenToPC = state.get("givenToPC", [])
+        store = cls(0)
+        size = max(len(completed_array), len(givenToPC))
+        if size:
+            store.ensure(size - 1)
+        for i in range(size):
+            pc = givenToPC[i] if i < len(givenToPC) else "Null"
+            done = completed_array[i] if i < len(completed_array) else False
+            if pc == "PRE":
+                store.status[i] = JOB_PRE
+            elif pc == "Reset" and not done:
+                store.status[i] = JOB_RESET
+            elif pc != "Null" or done:
+                store.status[i] = JOB_FINISHED if done else JOB_RUNNING
+                if pc not in ("Null", "Reset"):
+                    store.worker[i] = store.intern(pc)
+        for idx_str, info in state.get("timing_info", {}).items():
+            try:
+                idx = int(idx_str)
+                if idx >= size:
+                    continue
+                if 'Taken At' in info:
+                    store.taken[idx] = store.clock(time.mktime(time.strptime(info['Taken At'], TIME_FORMAT)))
+                if 'Completed At' in info:
+                    store.completed[idx] = store.clock(time.mktime(time.strptime(info['Completed At'], TIME_FORMAT)))
+            except ValueError:
+                pass
+        store.recount()
+        return store
+
+class QuantileSketch:
+    """Streaming quantile estimate with bounded relative error (DDSketch style).
+
+    Values are counted in logarithmic buckets of width `gamma`, so a quantile
+    is off by at most `relative_accuracy` and memory is bounded by the range
+    of the values, not their number.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = collections.Counter()
+        self.count = 0
+
+    def add(self, value, count=1):
+        self.buckets[math.ceil(math.log(value) / self.log_gamma)] += count
+        self.count += count
+
+    def extend(self, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] += count
+        self.count += int(counts.sum())
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+class DurationStats:
+    """Running aggregates over finished jobs, updated once per completion so reads are O(1).
+
+    Keeps count/mean/variance (Welford), an exponentially decayed completion
+    rate over THROUGHPUT_WINDOW seconds and a quantile sketch of durations.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.rate = 0.0 # Decayed completions per second, as of self.last_completion
+        self.last_completion = None
+        self.sketch = QuantileSketch()
+
+    def add(self, duration, now):
+        self.count += 1
+        delta = duration - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (duration - self.mean)
+        self.sketch.add(duration)
+        self.completed(now)
+
+    def completed(self, now):
+        """Count a completion towards the throughput, with or without a usable duration."""
+        self.rate = self.throughput(now) + 1 / THROUGHPUT_WINDOW
+        self.last_completion = now
+
+    def extend(self, durations):
+        """Fold in a batch of historical durations (used once when state is restored)."""
+        if not len(durations):
+            return
+        durations = durations.astype(np.float64)
+        count = self.count + len(durations)
+        mean = float(durations.mean())
+        delta = mean - self.mean
+        self.m2 += float(((durations - mean) ** 2).sum()) + delta * delta * self.count * len(durations) / count
+        self.mean += delta * len(durations) / count
+        self.count = count
+        self.sketch.extend(durations)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def throughput(self, now):
+        if self.last_completion is None:
+            return 0.0
+        return self.rate * math.exp(-(now - self.last_completion) / THROUGHPUT_WINDOW)
+
+class FifoScheduler:
+    """Queue of the jobs waiting to be handed out, in index order (how the server always worked).
+
+    The interface Experimenter uses, always with its lock held: load(indices)
+    replaces the queue, push(index) requeues a job, peek(runner) and
+    pop(runner) give the next index for a runner (Capabilities, ignored
+    here), None once empty. Entries can go stale (the job was reset twice,
+    or finished from the terminal); Experimenter skips those when it pops.
+
+    Jobs waiting for their first run are kept in one array sorted by key and
+    walked with a cursor; requeued ones go in a heap of (key, index). pop()
+    takes the smaller of the two heads, so both are O(log n). Subclasses only
+    change key() and keys().
+    """
 
-class Experimenter:
     def __init__(self):
+        self.order = np.zeros(0, dtype=np.int64)
+        self.order_keys = np.zeros(0)
+        self.cursor = 0
+        self.heap = []
+
+    def key(self, index):
+        """Sort key of a job; the smallest is handed out first, equal keys in index order."""
+        return float(index)
+
+    def keys(self, indices):
+        """key() of every index in a numpy array."""
+        return indices.astype(np.float64)
+
+    def load(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        keys = self.keys(indices)
+        order = np.lexsort((indices, keys))
+        self.order, self.order_keys = indices[order], keys[order]
+        self.cursor = 0
+        self.heap = []
+
+    def push(self, index):
+        heapq.heappush(self.heap, (self.key(index), index))
+
+    def allows(self, index, runner):
+        """Whether `runner` (Capabilities) may run job `index`; see RoutedScheduler."""
+        return True
+
+    def _heap_first(self):
+        if not self.heap:
+            return False
+        if self.cursor >= len(self.order):
+            return True
+        return self.heap[0] < (float(self.order_keys[self.cursor]), int(self.order[self.cursor]))
+
+    def head(self):
+        """(key, index) handed out next, or None."""
+        if self._heap_first():
+            return self.heap[0]
+        if self.cursor < len(self.order):
+            return float(self.order_keys[self.cursor]), int(self.order[self.cursor])
+        return None
+
+    def peek(self, runner=None):
+        head = self.head()
+        return None if head is None else head[1]
+
+    def pop(self, runner=None):
+        if self._heap_first():
+            return heapq.heappop(self.heap)[1]
+        if self.cursor < len(self.order):
+            self.cursor += 1
+            return int(self.order[self.cursor - 1])
+        return None
+
+    def __len__(self):
+        """Entries left, stale ones included."""
+        return len(self.order) - self.cursor + len(self.heap)
+
+
+class LPTScheduler(FifoScheduler):
+    """Longest processing time first: the most expensive queued job goes out first.
+
+    Long jobs then start early instead of being the last stragglers of a
+    campaign. costs[i] is the cost of job i in any unit (see job_costs); jobs
+    without one count as 0. Without costs this is the same as FifoScheduler.
+    """
+
+    def __init__(self, costs=()):
+        super().__init__()
+        self.costs = np.asarray(costs, dtype=np.float64)
+
+    def key(self, index):
+        return -float(self.costs[index]) if index < len(self.costs) else 0.0
+
+    def keys(self, indices):
+        keys = np.zeros(len(indices))
+        inside = indices < len(self.costs)
+        keys[inside] = -self.costs[indices[inside]]
+        return keys
+
+
+# --schedule choices, each built from the job costs (None if the campaign has none)
+SCHEDULERS = {
+    "lpt": lambda costs: LPTScheduler(() if costs is None else costs),
+    "fifo": lambda costs: FifoScheduler(),
+}
+
+
+EXPRESSION_GLOBALS = {"np": np, "math": math} # What cost and requirement expressions can use besides the parameters
+
+
+def evaluate_jobs(data_array, code):
+    """A compiled expression over the job parameters for every job, as a float array.
+
+    Branches of a lazy ParameterSpace are evaluated without building their
+    jobs (ParameterBranch.evaluate), once per combination of the values the
+    expression actually uses, and checked against a few jobs built the usual
+    way. A plain list, a branch with a transform, or an expression using
+    "id" that numpy cannot apply elementwise falls back to building every
+    job dict, which for a space of millions of jobs takes a while at startup.
+    """
+    parts = data_array.parts if isinstance(data_array, ParameterSpace) else [data_array]
+    return np.concatenate([_evaluate_part(part, code) for part in parts] or [np.zeros(0)])
+
+
+def _evaluate_part(part, code):
+    if isinstance(part, ParameterBranch) and part.transform is None and len(part):
+        try:
+            values = part.evaluate(code)
+            if all(values[i] == float(eval(code, dict(EXPRESSION_GLOBALS), part[i]))
+                   for i in {0, len(part) // 2, len(part) - 1}):
+                return values
+        except Exception:
+            pass # Build the jobs instead
+    return np.fromiter((eval(code, dict(EXPRESSION_GLOBALS), job) for job in part), dtype=np.float64, count=len(part))
+
+
+def job_costs(data_array, cost):
+    """Cost of every job as a float array.
+
+    `cost` is an expression over the job's parameters ("maxFE * repeat", or
+    just the name of a field), evaluated as in evaluate_jobs, or a function
+    of the job dict, which is called with every job.
+    """
+    if not callable(cost):
+        return evaluate_jobs(data_array, compile(cost, "<cost>", "eval"))
+    return np.fromiter((cost(job) for job in data_array), dtype=np.float64, count=len(data_array))
+
+
+# What a runner offers (Cores, Memory and Tags headers) and what a job needs, see requirement_classes.
+# Memory is in GB. A runner that sends nothing only gets jobs without requirements.
+Capabilities = collections.namedtuple("Capabilities", ["cores", "memory", "tags"])
+NO_CAPABILITIES = Capabilities(0, 0, frozenset())
+
+
+def runner_capabilities(headers):
+    tags = headers.get('Tags', '')
+    return Capabilities(float(headers.get('Cores', 0)), float(headers.get('Memory', 0)),
+                        frozenset(tag.strip() for tag in tags.split(',') if tag.strip()))
+
+
+def satisfies(runner, requirement):
+    return (runner.cores >= requirement.cores and runner.memory >= requirement.memory
+            and requirement.tags <= runner.tags)
+
+
+class RoutedScheduler:
+    """Capability-aware queue: one scheduler per requirement class, same interface as FifoScheduler.
+
+    job_class[i] is the class of job i, classes[c] its Capabilities
+    requirement. peek() and pop() take the runner's Capabilities and look
+    only at the classes it satisfies (worked out once per distinct runner),
+    taking the best head among them, so dispatch stays O(classes + log n).
+    """
+
+    def __init__(self, make_scheduler, job_class, classes):
+        self.job_class = job_class
+        self.classes = classes
+        self.queues = [make_scheduler() for _ in classes]
+        self.eligible = {} # Capabilities -> classes it satisfies
+
+    def _class(self, index):
+        return int(self.job_class[index]) if index < len(self.job_class) else 0
+
+    def _queues(self, runner):
+        runner = runner or NO_CAPABILITIES
+        classes = self.eligible.get(runner)
+        if classes is None:
+            classes = self.eligible[runner] = [c for c, need in enumerate(self.classes) if satisfies(runner, need)]
+        return [self.queues[c] for c in classes]
+
+    def allows(self, index, runner):
+        return satisfies(runner or NO_CAPABILITIES, self.classes[self._class(index)])
+
+    def load(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        classes = self.job_class[indices]
+        for c, queue in enumerate(self.queues):
+            queue.load(indices[classes == c])
+
+    def push(self, index):
+        self.queues[self._class(index)].push(index)
+
+    def _best(self, runner):
+        best = None
+        for queue in self._queues(runner):
+            head = queue.head()
+            if head is not None and (best is None or head < best[0]):
+                best = (head, queue)
+        return best
+
+    def peek(self, runner=None):
+        best = self._best(runner)
+        return None if best is None else best[0][1]
+
+    def pop(self, runner=None):
+        best = self._best(runner)
+        return None if best is None else best[1].pop()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+
+def requirement_classes(data_array, spec):
+    """(class of every job as an int array, requirement Capabilities of each class).
+
+    `spec` is a function of the job dict returning {"cores": ..., "memory": ...,
+    "tags": [...]} (any of them may be left out), which is called with every
+    job, or such a dict where cores and memory are numbers or expressions
+    over the job's parameters (evaluated as in evaluate_jobs) and tags a
+    list. Class 0 is always "no requirements".
+    """
+    classes = {NO_CAPABILITIES: 0}
+    if not callable(spec):
+        tags = spec.get("tags") or ()
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        tags = frozenset(tag.strip() for tag in tags if tag.strip())
+        distinct = {} # Field -> (its distinct values, index of every job's value in them)
+        for key in ("cores", "memory"):
+            value = spec.get(key, 0)
+            if isinstance(value, str):
+                distinct[key] = np.unique(evaluate_jobs(data_array, compile(value, "<requirements>", "eval")), return_inverse=True)
+            else:
+                distinct[key] = (np.array([float(value)]), np.zeros(len(data_array), dtype=np.int64))
+        (cores, core_index), (memory, memory_index) = distinct["cores"], distinct["memory"]
+        pairs, inverse = np.unique(core_index.reshape(-1) * len(memory) + memory_index.reshape(-1), return_inverse=True)
+        lookup = np.array([classes.setdefault(Capabilities(float(cores[pair // len(memory)]), float(memory[pair % len(memory)]), tags),
+                                              len(classes)) for pair in pairs], dtype=np.uint16)
+        return lookup[inverse.reshape(-1)] if len(data_array) else np.zeros(0, dtype=np.uint16), list(classes)
+
+    job_class = np.zeros(len(data_array), dtype=np.uint16)
+    for i, job in enumerate(data_array):
+        need = spec(job) or {}
+        tags = need.get("tags") or ()
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        requirement = Capabilities(float(need.get("cores", 0)), float(need.get("memory", 0)),
+                                   frozenset(tag.strip() for tag in tags if tag.strip()))
+        job_class[i] = classes.setdefault(requirement, len(classes))
+    return job_class, list(classes)
+
+
+class EventLog:
+    """Append-only event stream with a bounded memory footprint.
+
+    The newest `capacity` entries stay in a ring buffer; every entry is also
+    spilled by a background thread to `<directory>/<name>-<first id>.jsonl`
+    segments of `segment_size` lines, so older pages are read back from disk.
+    Entries get consecutive IDs starting at 0, which double as paging cursors.
+    """
+
+    def __init__(self, directory, name, capacity=EVENT_BUFFER_SIZE, segment_size=EVENT_SEGMENT_SIZE):
+        self.directory = directory
+        self.name = name
+        self.segment_size = segment_size
+        self.entries = collections.deque(maxlen=capacity)
+        self.next_id = 0
+        self.flushed = 0 # Entries with a lower ID are on disk
+        self.pending = [] # Not yet handed to the writer
+        self.writing = [] # Being written by the flush thread
+        self.lock = threading.Lock()
+        self.started = False
+
+    def __len__(self):
+        return self.next_id
+
+    def start(self, resume=False):
+        """Prepare the segment directory. With resume, continue numbering after what is on disk, otherwise start over."""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if resume and segments:
+            with open(self._segment_path(segments[-1]), 'r') as f:
+                self.next_id = self.flushed = segments[-1] + sum(1 for _ in f)
+        else:
+            for first in segments:
+                os.remove(self._segment_path(first))
+        self.started = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _segments(self):
+        prefix = self.name + "-"
+        return sorted(int(f[len(prefix):-len(".jsonl")]) for f in os.listdir(self.directory)
+                      if f.startswith(prefix) and f.endswith(".jsonl"))
+
+    def _segment_path(self, first):
+        return os.path.join(self.directory, f"{self.name}-{first:012d}.jsonl")
+
+    def append(self, entry):
+        with self.lock:
+            entry["ID"] = self.next_id
+            self.next_id += 1
+            self.entries.append(entry)
+            self.pending.append(entry)
+        return entry["ID"]
+
+    def tail(self, count):
+        with self.lock:
+            return list(self.entries)[-count:]
+
+    def page(self, since, limit):
+        """Up to `limit` entries with an ID greater than `since`, oldest first."""
+        start = max(since + 1, 0)
+        with self.lock:
+            end = min(self.next_id, start + limit)
+            ring_first = self.next_id - len(self.entries)
+            flushed = self.flushed
+            if start >= ring_first:
+                offset = start - ring_first
+                return list(itertools.islice(self.entries, offset, offset + end - start))
+            unflushed = self.writing + self.pending
+
+        result = []
+        if start < flushed:
+            result = self._read(start, min(end, flushed))
+        if end > flushed:
+            result += unflushed[max(start - flushed, 0):end - flushed]
+        return result
+
+    def _read(self, start, end):
+        """Read IDs [start, end) back from the segment files."""
+        result = []
+        first = start - start % self.segment_size
+        while first < end:
+            try:
+                with open(self._segment_path(first), 'r') as f:
+                    for line_id, line in enumerate(f, first):
+                        if line_id >= end:
+                            break
+                        if line_id >= start:
+                            result.append(json.loads(line))
+            except FileNotFoundError:
+                pass
+            first += self.segment_size
+        return result
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(1)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending or self.writing:
+                return
+            batch = self.writing = self.pending
+            self.pending = []
+            first_id = self.flushed
+
+        try:
+            position = 0
+            while position < len(batch):
+                entry_id = first_id + position
+                segment = entry_id - entry_id % self.segment_size
+                count = min(len(batch) - position, segment + self.segment_size - entry_id)
+                with open(self._segment_path(segment), 'a') as f:
+                    f.writelines(json.dumps(entry) + "\n" for entry in batch[position:position + count])
+                position += count
+        except Exception as e:
+            print(f"Error writing {self.name} log: {e}")
+
+        with self.lock:
+            self.flushed += len(batch)
+            self.writing = []
+
+class Experimenter:
+    def __init__(self, directory="", name=None):
+        # State, journal and logs live in `directory`; `name` is the campaign, see Campaign
+        self.directory = directory
+        self.name = name
+        self.state_file = os.path.join(directory, STATE_FILE)
+        self.legacy_state_file = os.path.join(directory, LEGACY_STATE_FILE)
+        self.journal_file = os.path.join(directory, JOURNAL_FILE)
+
         self.data_array = []
-        self.completed_array = []
-        self.givenToPC = []
-        self.data_index = []
-        self.logs = []
-        self.stateLogs = []
-        self.lock = threading.Lock() # Thread lock for safety
+        self.jobs = JobStatusStore()
+        self.scheduler = FifoScheduler() # Jobs waiting to be handed out, see start_queue
+        self.extra_requests = 0 # Requests answered with "No more data left."
+        self.runners_seen = {} # Runner name -> when it last asked for work, see active_runners
+        # Jobs may still arrive from upstream (Relay): an empty queue then asks runners to retry instead of ending
+        self.more_coming = False
+
+        # Speculative execution: index -> names of the runners holding a backup copy
+        self.speculate = False
+        self.backups = {}
+        self.logs = EventLog(os.path.join(directory, LOG_DIR), "log")
+        self.stateLogs = EventLog(os.path.join(directory, LOG_DIR), "state")
+        # Guards the job states, the scheduler, leases and backups. Nothing is printed or logged
+        # while it is held: log entries are queued with _later and written by _emit afterwards,
+        # lines for the terminal go through _print.
+        self.lock = TimedLock("jobs", name or "")
+        self.output = collections.deque()
+        self.output_lock = threading.Lock() # Held by the one thread running the calls in self.output
+        self.console = queue.SimpleQueue()
+
+        # Long-poll dispatch: notified when a job is requeued or the last running one finishes.
+        # Listeners are called for the same events once the lock is released (see AsyncServer).
+        self.job_available = threading.Condition(self.lock)
+        self.listeners = []
+
+        # Duration statistics have a lock of their own, so /timeStats never waits behind dispatch
+        self.stats = DurationStats()
+        self.stats_lock = threading.Lock()
+
+        # Lease sizing
+        self.job_seconds = None # Smoothed wall-clock seconds per job
+        self.lease_target = LEASE_TARGET_SECONDS
+        self.max_lease = MAX_LEASE_SIZE
+
+        # Lease expiry: index -> current deadline, plus a min-heap of (deadline, index).
+        # Heartbeats push a fresh heap entry; outdated entries are skipped when popped.
+        self.lease_timeout = LEASE_TIMEOUT
+        self.lease_deadlines = {}
+        self.lease_heap = []
+
+        # State transitions are queued here while the lock is held and written
+        # to the journal by a background thread, so dispatch never waits on disk.
+        self.journal = queue.SimpleQueue()
+        self.journal_seq = 0
+        self.journal_lock = TimedLock("journal", name or "") # Serialises journal/checkpoint writers
+
+        self.auto_save_thread = threading.Thread(target=self._auto_save_loop, daemon=True)
+        self.auto_save_thread.start()
+
+        self.reaper_thread = threading.Thread(target=self._reaper_loop, daemon=True)
+        self.reaper_thread.start()
+
+        self.console_thread = threading.Thread(target=self._console_loop, daemon=True)
+        self.console_thread.start()
+
+    def load_data(self, data_array):
+        """Install the parameter space and size the status store for it."""
+        self.data_array = data_array
+        if len(data_array):
+            self.jobs.ensure(len(data_array) - 1)
+
+    def job_info(self, index):
+        """Parameters of a job together with its timing, as shown by /info and `print`."""
+        info = dict(self.data_array[index])
+        info.update(self.jobs.timing(index))
+        if index in self.backups:
+            info["Backups"] = sorted(self.backups[index])
+        return info
+
+    def _auto_save_loop(self):
+        """Runs in the background, appends queued transitions to the journal and checkpoints every CHECKPOINT_INTERVAL seconds."""
+        next_checkpoint = time.time() + CHECKPOINT_INTERVAL
+        while True:
+            try:
+                first = self.journal.get(timeout=1)
+            except queue.Empty:
+                first = None
+
+            with self.journal_lock:
+                if first is not None:
+                    self._write_journal([first])
+
+                if time.time() >= next_checkpoint:
+                    self._checkpoint()
+                    next_checkpoint = time.time() + CHECKPOINT_INTERVAL
+
+    def _reaper_loop(self):
+        """Runs in the background and requeues jobs whose lease ran out."""
+        while True:
+            time.sleep(REAPER_INTERVAL)
+            with self.lock:
+                self.reap_expired()
+            self._emit()
+
+    def reap_expired(self, now=None):
+        """Requeue every job whose lease deadline has passed. Caller must hold the lock."""
+        now = time.time() if now is None else now
+        while self.lease_heap and self.lease_heap[0][0] <= now:
+            deadline, index = heapq.heappop(self.lease_heap)
+            if self.lease_deadlines.get(index) != deadline:
+                continue # Superseded by a heartbeat, or the job already finished
+
+            del self.lease_deadlines[index]
+            owner = self.jobs.owner(index)
+            self.record("reset", index)
+            self._later(self.stateLog, "Reset", index + 1)
+            self._later(self.log, f"Lease on index {index + 1} held by {owner} expired")
+            self._print(f"Lease on data {index + 1} held by {owner} expired, requeueing.")
+            self.scheduler.push(index)
+            self.backups.pop(index, None)
+            self.jobs.reset(index)
+            self._notify()
+
+    def heartbeat(self, IDs, computer_name):
+        """Extend the leases a runner still holds. Returns the IDs it no longer owns."""
+        lost = []
+        with self.lock:
+            deadline = time.time() + self.lease_timeout
+            for ID in IDs:
+                index = int(ID) - 1
+                owned = (0 <= index
+                         and self.jobs.is_running(index)
+                         and (self.jobs.owner(index) == computer_name
+                              or computer_name in self.backups.get(index, ())))
+                if not owned:
+                    lost.append(ID)
+                    continue
+                if self.lease_timeout > 0:
+                    self.lease_deadlines[index] = deadline
+                    heapq.heappush(self.lease_heap, (deadline, index))
+        return lost
+
+    def _start_lease(self, index, now):
+        if self.lease_timeout > 0:
+            deadline = now + self.lease_timeout
+            self.lease_deadlines[index] = deadline
+            heapq.heappush(self.lease_heap, (deadline, index))
+
+    def record(self, op, index, **fields):
+        """Queue a state transition for the journal. Called with the lock held; never touches disk."""
+        self.journal_seq += 1
+        fields.update(seq=self.journal_seq, op=op, index=index)
+        self.journal.put(fields)
+
+    def _write_journal(self, records):
+        """Append the given records and everything else queued to the journal file."""
+        try:
+            while True:
+                records.append(self.journal.get_nowait())
+        except queue.Empty:
+            pass
+        if not records:
+            return
+
+        start = time.perf_counter()
+        try:
+            with open(self.journal_file, 'a') as f:
+                for item in records:
+                    f.write(json.dumps(item) + "\n")
+        except Exception as e:
+            print(f"Error writing journal: {e}")
+        STATE_WRITE_SECONDS.observe(time.perf_counter() - start, self.name or "", "journal")
+
+    def _checkpoint(self):
+        """Write a compacted snapshot and truncate the journal. Caller must hold journal_lock."""
+        # Everything already in the journal file is covered by the snapshot below.
+        self._write_journal([])
+        start = time.perf_counter()
+
+        with self.lock:
+            seq = self.journal_seq
+            jobs = self.jobs.copy()
+
+        try:
+            with open(self.state_file + ".tmp", 'wb') as f:
+                jobs.save(f, {"seq": seq})
+            os.replace(self.state_file + ".tmp", self.state_file)
+
+            # Records that are still queued have seq > the checkpoint's seq or are skipped on replay.
+            open(self.journal_file, 'w').close()
+        except Exception as e:
+            print(f"Error saving state: {e}")
+        STATE_WRITE_SECONDS.observe(time.perf_counter() - start, self.name or "", "checkpoint")
+
+    def save_state(self):
+        """Persist current state to disk. Must not be called while holding the lock."""
+        with self.journal_lock:
+            self._checkpoint()
+
+    def load_state(self):
+        """Load the last checkpoint from disk and replay the journal written after it."""
+        if not any(os.path.exists(f) for f in (self.state_file, self.legacy_state_file, self.journal_file)):
+            return False
+        
+        try:
+            meta = {}
+            if os.path.exists(self.state_file):
+                self.jobs, meta = JobStatusStore.load(self.state_file)
+                source = self.state_file
+            elif os.path.exists(self.legacy_state_file):
+                with open(self.legacy_state_file, 'r') as f:
+                    meta = json.load(f)
+                self.jobs = JobStatusStore.from_legacy(meta)
+                source = self.legacy_state_file
+            else:
+                source = self.journal_file
+            if len(self.data_array):
+                self.jobs.ensure(len(self.data_array) - 1)
+
+            seq = meta.get("seq", 0)
+            replayed = 0
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r') as f:
+                    for line in f:
+                        try:
+                            item = json.loads(line)
+                        except ValueError:
+                            break # Torn write at the end of the journal
+                        if item["seq"] <= seq:
+                            continue
+                        self._apply(item)
+                        seq = item["seq"]
+                        replayed += 1
+            self.journal_seq = seq
+
+            self.stats.extend(self.jobs.durations())
+
+            # Rebuild the dashboard view from the restored state
+            now = time.time()
+            for i in np.flatnonzero(np.isin(self.jobs.status[:len(self.jobs)], (JOB_FINISHED, JOB_PRE, JOB_RUNNING))):
+                i = int(i)
+                if self.jobs.is_finished(i):
+                    self.stateLog("Finished", i + 1, self.jobs.owner(i))
+                else:
+                    self.stateLog("Running", i + 1, self.jobs.owner(i))
+                    self._start_lease(i, now)
+
+            print(f"State loaded from {source} ({replayed} journal entries replayed)")
+            return True
+        except Exception as e:
+            print(f"Error loading state: {e}")
+            return False
+
+    def _apply(self, item):
+        """Replay one journal record."""
+        index = item["index"]
+        if item["op"] == "taken":
+            self.jobs.take(index, item["pc"], item["t"])
+        elif item["op"] == "finished":
+            self.jobs.finish(index, item["t"])
+        elif item["op"] == "reset":
+            self.jobs.reset(index)
+        elif item["op"] == "elsewhere":
+            for i in index:
+                self.jobs.hand_over(i)
+        elif item["op"] == "adopted":
+            for i in index:
+                self.jobs.adopt(i)
+
+    def _later(self, function, *args):
+        """Queue a call (log, stateLog, a listener) to run once the lock is released. Caller must hold the lock."""
+        self.output.append((function, args))
+
+    def _emit(self):
+        """Run the calls queued by _later, in order. Call without the lock, after any method that takes it.
+
+        One thread at a time runs them; a thread that finds another one busy
+        leaves its calls to it, and that thread looks again before leaving.
+        """
+        while self.output:
+            if not self.output_lock.acquire(blocking=False):
+                return
+            try:
+                while self.output:
+                    function, args = self.output.popleft()
+                    function(*args)
+            finally:
+                self.output_lock.release()
+
+    def _print(self, *args):
+        """print() for dispatch: queues the line for _console_loop, so it is safe with the lock held."""
+        self.console.put(" ".join(map(str, args)))
+
+    def _console_loop(self):
+        """Runs in the background and prints the lines queued by _print, everything waiting in one write."""
+        while True:
+            lines = [self.console.get()]
+            while not self.console.empty():
+                lines.append(self.console.get_nowait())
+            print("\n".join(lines))
+
+    def log(self, text):
+        current_time = time.strftime('%Y-%m-%d %H:%M:%S')
+        # Logs are append-only, thread safe enough for this purpose
+        self.logs.append({"Text": text, "time": current_time})
+
+    def stateLog(self, newState, index, sentTo="Null"):
+        self.stateLogs.append({"state": newState, "index": index, "sentTo": sentTo})
+    
+    def getExperiment(self, ID, computer_name, wait=None, runner=None):
+        """Hand out the next job, or {"message": ...} when there is none.
+
+        With `wait` (long-poll), an empty queue while other jobs are still
+        running is waited on for up to `wait` seconds, and None is returned if
+        no job was requeued in that time. wait=0 returns None right away.
+        `runner` (Capabilities) limits the choice to jobs it can run.
+        """
+        with self.lock:
+            self.runners_seen[computer_name] = time.time()
+            if wait is None and self.more_coming:
+                wait = 0
+            timed_out = wait is not None and not self._wait_for_job(time.time() + wait, computer_name, runner)
+            taken = None if timed_out else self._take(computer_name, runner=runner)
+
+            if(ID != '-1'):
+                self._reset_unfinished(ID, computer_name)
+        self._emit()
+
+        if timed_out:
+            return None
+        if taken is None:
+            return {"message": "No more data left."}
+        return self._job_data(*taken)
+
+    def leaseExperiments(self, ID, computer_name, count=None, wait=None, runner=None):
+        """Hand out up to `count` jobs in one go. Without a count the lease is sized from measured job durations.
+
+        `wait` and `runner` as for getExperiment: None is returned if no job turned up in time.
+        """
+        taken = []
+        with self.lock:
+            self.runners_seen[computer_name] = time.time()
+            if wait is None and self.more_coming:
+                wait = 0
+            timed_out = wait is not None and not self._wait_for_job(time.time() + wait, computer_name, runner)
+            if count is None or count <= 0:
+                count = self.lease_size()
+            count = min(count, self.max_lease)
+            while not timed_out and len(taken) < count:
+                # A backup copy only goes out alone, stragglers should not wait behind each other
+                job = self._take(computer_name, backup=not taken, runner=runner)
+                if job is None:
+                    break
+                taken.append(job)
+                if not self._has_queued(runner):
+                    break
+
+            if(ID != '-1'):
+                self._reset_unfinished(ID, computer_name)
+
+            if taken:
+                self._later(self.log, f"Leased {len(taken)} jobs to {computer_name}")
+        self._emit()
+
+        if timed_out:
+            return None
+        return [self._job_data(*job) for job in taken]
+
+    def start_queue(self):
+        """Queue every job that is not running or finished, in the order of the scheduler."""
+        with self.lock:
+            status = self.jobs.status[:len(self.data_array)]
+            self.scheduler.load(np.flatnonzero((status == JOB_PENDING) | (status == JOB_RESET)))
+
+    def _next_queued(self, runner=None):
+        """Index of the job the scheduler hands `runner` next, None if there is none. Caller must hold the lock."""
+        while True:
+            index = self.scheduler.peek(runner)
+            if index is None or (index < len(self.data_array) and self.jobs.is_queued(index)):
+                return index
+            self.scheduler.pop(runner) # Stale entry
+
+    def _has_queued(self, runner=None):
+        return self._next_queued(runner) is not None
+
+    def _wait_for_job(self, deadline, computer_name, runner=None):
+        """Block until a job is queued (or a backup copy is due) or none is running or coming any more.
+
+        Returns False if the deadline passed first. Caller must hold the lock.
+        """
+        while (not self._has_queued(runner) and (self.jobs.running > 0 or self.more_coming)
+               and self._pick_backup(computer_name, time.time(), runner) is None):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.job_available.wait(remaining)
+        return True
+
+    def _pick_backup(self, computer_name, now, runner=None):
+        """Index of the straggler `computer_name` should run a backup copy of, or None. Caller must hold the lock."""
+        if not self.speculate or self.stats.count == 0:
+            return None
+        with self.stats_lock:
+            median = self.stats.sketch.quantile(0.5)
+        running = self.jobs.indices(JOB_RUNNING)
+        elapsed = self.jobs.clock(now) - self.jobs.taken[running]
+        slow = elapsed > SPECULATE_FACTOR * median
+        for index in running[slow][np.argsort(-elapsed[slow], kind='stable')].tolist():
+            holders = self.backups.get(index, ())
+            if (len(holders) < MAX_BACKUPS and computer_name not in holders
+                    and self.jobs.owner(index) != computer_name and self.scheduler.allows(index, runner)):
+                return index
+        return None
+
+    def _backup(self, computer_name, runner=None):
+        """Hand out a backup copy of a straggler: (index, time), or None. Caller must hold the lock."""
+        now = time.time()
+        index = self._pick_backup(computer_name, now, runner)
+        if index is None:
+            return None
+        self.backups.setdefault(index, set()).add(computer_name)
+
+        owner = self.jobs.owner(index)
+        self._later(self.log, f"Sent backup of index {index + 1} (held by {owner}) to {computer_name}")
+        self._print(f"Data {index + 1} is running long on {owner}, sent a backup copy to {computer_name}")
+        return index, now
+
+    def _job_data(self, index, now):
+        """What a runner gets for job `index`: its parameters, when it was taken and, with several campaigns, which one.
+
+        Needs no lock, the parameters of a job are neither changed nor dropped while it is running.
+        """
+        response_data = dict(self.data_array[index])
+        response_data['Taken At'] = time.strftime(TIME_FORMAT, time.localtime(now))
+        if self.name:
+            response_data['Campaign'] = self.name
+        return response_data
+
+    def has_work(self, computer_name, runner=None):
+        """What this runner could get: "queued" (a job or backup copy right now),
+        "running" (nothing now, but running jobs may come back) or None."""
+        with self.lock:
+            if self._has_queued(runner) or self._pick_backup(computer_name, time.time(), runner) is not None:
+                return "queued"
+            return "running" if self.jobs.running > 0 or self.more_coming else None
+
+    def release(self, ID, computer_name):
+        """Requeue job ID (1-based) if `computer_name` is still running it; the runner has given it up."""
+        with self.lock:
+            self._reset_unfinished(ID, computer_name)
+        self._emit()
+
+    def queued_count(self):
+        """Jobs waiting to be handed out. Caller must hold the lock."""
+        return self.jobs.size - self.jobs.running - self.jobs.done - self.jobs.elsewhere
+
+    def active_runners(self):
+        """Runners that asked for work in the last 2 * lease_target seconds. Caller must hold the lock.
+
+        A runner holding a lease sized by lease_size comes back within about
+        lease_target seconds, so this also counts runners busy with one.
+        """
+        cutoff = time.time() - 2 * self.lease_target
+        self.runners_seen = {name: seen for name, seen in self.runners_seen.items() if seen >= cutoff}
+        return len(self.runners_seen)
+
+    def claim_range(self, start, stop):
+        """Hand every queued job outside [start, stop) over to the other nodes, at the start of a campaign."""
+        with self.lock:
+            queued = np.flatnonzero(np.isin(self.jobs.status[:len(self.data_array)], (JOB_PENDING, JOB_RESET)))
+            for index in queued[(queued < start) | (queued >= stop)].tolist():
+                self.jobs.hand_over(index)
+
+    def hand_over(self, count, node):
+        """Give up to `count` queued jobs, the highest ids, to another node. Returns their 0-based indices.
+
+        At most half of the queue goes while runners are asking here, all of it once none are.
+        """
+        with self.lock:
+            queued = np.flatnonzero(np.isin(self.jobs.status[:len(self.data_array)], (JOB_PENDING, JOB_RESET)))
+            share = len(queued) // 2 if self.active_runners() else len(queued)
+            indices = queued[len(queued) - min(count, share):].tolist()
+            for index in indices:
+                self.jobs.hand_over(index) # Still in the scheduler, skipped there as stale
+            if indices:
+                self.record("elsewhere", indices)
+                self._later(self.log, f"Handed over {len(indices)} jobs to node {node}")
+        self._emit()
+        return indices
+
+    def adopt(self, indices, source, parameters=None):
+        """Queue jobs taken over from another node or server. Returns the indices adopted.
+
+        Jobs that are no longer marked as being elsewhere (upstream handed one
+        out again after its lease ran out) are skipped. `parameters`, one dict
+        per index, replaces the job's entry in data_array (see Relay).
+        """
+        adopted = []
+        with self.lock:
+            for position, index in enumerate(indices):
+                if index >= len(self.jobs) or self.jobs.status[index] != JOB_ELSEWHERE:
+                    continue
+                if parameters is not None:
+                    self.data_array[index] = parameters[position]
+                self.jobs.adopt(index)
+                self.scheduler.push(index)
+                adopted.append(index)
+            if adopted:
+                self.record("adopted", adopted)
+                self._later(self.log, f"Took over {len(adopted)} jobs from {source}")
+                self._notify()
+        self._emit()
+        return adopted
+
+    def hand_back(self, indices, *statuses):
+        """Return the jobs among `indices` that are in one of `statuses` to the server they came from (see Relay)."""
+        with self.lock:
+            indices = [index for index in indices if self.jobs.status[index] in statuses]
+            for index in indices:
+                self.jobs.hand_over(index)
+                self.lease_deadlines.pop(index, None)
+            if indices:
+                self.record("elsewhere", indices)
+        return indices
+
+    def expect_more(self, more):
+        """Whether jobs may still arrive from upstream, see more_coming."""
+        with self.lock:
+            if more != self.more_coming:
+                self.more_coming = more
+                self._notify()
+        self._emit()
+
+    def _notify(self):
+        """Wake long-polling requests. Caller must hold the lock."""
+        self.job_available.notify_all()
+        for listener in self.listeners:
+            self._later(listener)
+
+    def lease_size(self):
+        """Number of jobs that keeps a runner busy for about `lease_target` seconds. Caller must hold the lock.
+
+        Never more than an even share of the queue among the runners asking
+        for work (active_runners), so that with short jobs the first runner
+        to ask does not take the whole queue while the others sit idle.
+        """
+        if not self.job_seconds:
+            return 1
+        size = min(self.max_lease, int(round(self.lease_target / self.job_seconds)))
+        share = math.ceil(self.queued_count() / max(1, self.active_runners()))
+        return max(1, min(size, share))
+
+    def _reset_unfinished(self, ID, computer_name):
+        """Requeue job ID (1-based) if `computer_name` is running it. Caller must hold the lock.
+
+        Finished jobs, jobs with another server and jobs held by another
+        runner are left alone; a backup copy given up only drops that copy.
+        """
+        index = int(ID) - 1
+        if index < 0 or not self.jobs.is_running(index):
+            return
+        if self.jobs.owner(index) != computer_name:
+            holders = self.backups.get(index)
+            if holders is not None and computer_name in holders:
+                holders.discard(computer_name)
+                if not holders:
+                    del self.backups[index]
+            return
+        self._later(self.stateLog, "Reset", index + 1)
+        self._print(f"Resetting data {index + 1} for {computer_name} due to new request.")
+        self._later(self.log, f"Reset index {index + 1} by {computer_name}")
+        self.scheduler.push(index)
+        self.backups.pop(index, None)
+        self.lease_deadlines.pop(index, None)
+        self.record("reset", index)
+        self.jobs.reset(index)
+        self._notify()
+
+    def _take(self, computer_name, backup=True, runner=None):
+        """Pop the next index off the queue and mark it as running. Caller must hold the lock.
+
+        Returns (index, time taken), from which _job_data builds the runner's
+        job after the lock is released, or None. With an empty queue, hands
+        out a backup copy of a straggler instead if speculation is on and
+        `backup` allows it.
+        """
+        if self._next_queued(runner) is None:
+            taken = self._backup(computer_name, runner) if backup else None
+            if taken is not None:
+                return taken
+            self._later(self.log, f"Shutting down {computer_name}")
+            self._print(f'Data Distribution is finished. Extra connections : ', self.extra_requests)
+            self.extra_requests += 1
+            return None
+        last = self.scheduler.pop(runner)
+
+        now = time.time()
+        self.jobs.take(last, computer_name, now)
+        self._start_lease(last, now)
+        self.record("taken", last, pc=computer_name, t=now)
+
+        self._later(self.stateLog, "Running", last + 1, computer_name)
+        self._later(display_colored_array, self.data_array)
+        self._later(self.log, f"Sent Data on index {last + 1} to {computer_name}")
+        self._print(f"Data {last+1} has been sent to {computer_name}")
+        return last, now
+
+    def complete(self, ID, computer_name, duration=None):
+        with self.lock:
+            finished = self._complete(ID, computer_name, duration)
+        self._emit()
+        self._add_stats([finished])
+
+    def completeBatch(self, IDs, computer_name, durations=None):
+        """Mark several jobs as finished under a single lock acquisition."""
+        with self.lock:
+            if durations is None:
+                # Jobs of a lease run one after another, so share the elapsed time between them.
+                started = [self.jobs.started_at(int(ID) - 1) for ID in IDs if self.jobs.is_running(int(ID) - 1)]
+                if started:
+                    per_job = (time.time() - min(started)) / len(IDs)
+                    durations = [per_job] * len(IDs)
+                else:
+                    durations = [None] * len(IDs)
+
+            finished = [self._complete(str(ID), computer_name, duration) for ID, duration in zip(IDs, durations)]
+        self._emit()
+        self._add_stats(finished)
+
+    def finished(self, ID):
+        """Whether job ID (1-based) is finished already; the result of a later copy is then not stored."""
+        return self.jobs.is_finished(int(ID) - 1)
+
+    def _complete(self, ID, computer_name, duration=None):
+        """Mark job ID finished. Returns (duration, time) for _add_stats, None if the result was ignored. Caller must hold the lock."""
+        index = int(ID) - 1
+        if self.jobs.is_finished(index):
+            # The first completion wins, e.g. one of the copies of a speculated job
+            self._later(self.log, f"Ignored later result of index {index + 1} from {computer_name}")
+            return None
+        holders = self.backups.pop(index, None)
+        if holders is not None and computer_name in holders:
+            self._later(self.log, f"Backup copy of index {index + 1} on {computer_name} finished first")
+
+        self._later(self.stateLog, "Finished", int(ID), computer_name)
+        self._print("ID " + ID + " is finished.")
+
+        now = time.time()
+        if duration is None and self.jobs.is_running(index):
+            duration = now - self.jobs.started_at(index)
+
+        self.jobs.finish(index, now)
+        self.record("finished", index, pc=computer_name, t=now)
+        if self.jobs.running == 0:
+            self._notify() # Waiting requests can be told the campaign is over
+
+        self.lease_deadlines.pop(index, None)
+        return duration, now
+
+    def _add_stats(self, finished):
+        """Add the (duration, time) pairs returned by _complete to the statistics. Call without the lock."""
+        with self.stats_lock:
+            for item in finished:
+                if item is None:
+                    continue
+                duration, now = item
+                if duration is not None and duration > 0:
+                    self._record_duration(duration)
+                    self.stats.add(duration, now)
+                else:
+                    self.stats.completed(now)
+
+    def _record_duration(self, duration):
+        if self.job_seconds is None:
+            self.job_seconds = duration
+        else:
+            self.job_seconds += DURATION_SMOOTHING * (duration - self.job_seconds)
+
+    def reset(self, index):
+        with self.lock:
+            self._later(self.stateLog, "Reset", index + 1)
+            self._later(self.log, f"Reset index {index + 1} from terminal.")
+            self.scheduler.push(index)
+            self.backups.pop(index, None)
+            
+            self.jobs.reset(index)
+            self.lease_deadlines.pop(index, None)
+            self.record("reset", index)
+            self._notify()
+        self._emit()
+            
+    def calculate_time_stats(self):
+        """Constant-time read of the running aggregates, without the job lock: the counters are read as they are."""
+        active_workers = self.jobs.running
+        finished_tasks = self.jobs.done
+        with self.stats_lock:
+            stats = self.stats
+            count, mean, variance = stats.count, stats.mean, stats.variance()
+            throughput = stats.throughput(time.time())
+            p50, p90, p99 = (stats.sketch.quantile(q) for q in (0.5, 0.9, 0.99))
+
+        total_tasks = len(self.data_array) - self.jobs.elsewhere
+        remaining = total_tasks - finished_tasks
+
+        eta_seconds = 0
+
+        # We need at least one finished task to calculate average, 
+        # and at least one active worker to process the remaining ones.
+        if count > 0 and active_workers > 0:
+            # System throughput: How many seconds does the SYSTEM take to finish one task?
+            # If 1 task takes 100s, but we have 10 workers, the system finishes a task every 10s.
+            system_seconds_per_task = mean / active_workers
+
+            eta_seconds = remaining * system_seconds_per_task
+
+        return {
+            "eta_seconds": eta_seconds,
+            "remaining": remaining,
+            "window_tasks": count, # Using this to tell UI we have N samples
+            "active_workers": active_workers,
+            "in_flight": active_workers,
+            "mean_seconds": mean,
+            "stddev_seconds": math.sqrt(variance),
+            "p50_seconds": p50,
+            "p90_seconds": p90,
+            "p99_seconds": p99,
+            "throughput_per_minute": throughput * 60
+        }
+
+
+class SegmentStore:
+    """Packs results into large append-only segment files instead of one file each (--store packed).
+
+    A record is a header (magic, name length, data length, CRC32), the stored
+    file name and the data. index.bin lists (segment, data offset, length,
+    name) for every record, so a result is read with a single seek. The index
+    is only a shortcut: records it is missing after a crash are found again by
+    scanning the segments past its last entry. A name written twice resolves
+    to the newest record; compact() drops the older ones.
+    """
+
+    RECORD = struct.Struct("<4sHQI")
+    ENTRY = struct.Struct("<IQQH")
+    MAGIC = b"PRS1"
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.entries = {}   # stored name -> (segment, data offset, length)
+        self.by_id = {}     # job id -> stored name
+        self.segment = 0
+        self.out = None
+        self.index = None
+
+    @property
+    def is_open(self):
+        return self.out is not None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"seg-{segment:06d}.pack")
+
+    def _segments(self):
+        return sorted(int(name[4:10]) for name in os.listdir(self.directory)
+                      if name.startswith("seg-") and name.endswith(".pack"))
+
+    def _remember(self, name, segment, offset, length):
+        self.entries[name] = (segment, offset, length)
+        ident = result_id(name)
+        if ident is not None:
+            self.by_id[ident] = name
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, "index.bin")
+        covered = collections.defaultdict(int)
+
+        valid = 0
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            while valid + self.ENTRY.size <= len(data):
+                segment, offset, length, name_len = self.ENTRY.unpack_from(data, valid)
+                end = valid + self.ENTRY.size + name_len
+                if end > len(data):
+                    break
+                self._remember(data[valid + self.ENTRY.size:end].decode(), segment, offset, length)
+                covered[segment] = max(covered[segment], offset + length)
+                valid = end
+        self.index = open(index_path, 'ab')
+        self.index.truncate(valid)
+
+        # Pick up records written after the last index entry, drop a torn one at the very end
+        segments = self._segments()
+        for segment in segments:
+            if covered[segment] < os.path.getsize(self._segment_path(segment)):
+                self._recover(segment, covered[segment])
+
+        self.segment = segments[-1] if segments else 1
+        self.out = open(self._segment_path(self.segment), 'ab')
+
+    def _recover(self, segment, position):
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            while position + self.RECORD.size <= size:
+                f.seek(position)
+                magic, name_len, length, crc = self.RECORD.unpack(f.read(self.RECORD.size))
+                offset = position + self.RECORD.size + name_len
+                if magic != self.MAGIC or offset + length > size:
+                    break
+                name = f.read(name_len).decode()
+                if zlib.crc32(f.read(length)) != crc:
+                    break
+                self._remember(name, segment, offset, length)
+                self._write_entry(name, segment, offset, length)
+                position = offset + length
+        if position < size:
+            with open(path, 'r+b') as f:
+                f.truncate(position)
+        self.index.flush()
+
+    def _write_entry(self, name, segment, offset, length):
+        encoded = name.encode()
+        self.index.write(self.ENTRY.pack(segment, offset, length, len(encoded)) + encoded)
+
+    def _append(self, name, f, length, crc):
+        """Write one record to the current segment, rolling over to a new one when it is full."""
+        encoded = name.encode()
+        if self.out.tell() > 0 and self.out.tell() + self.RECORD.size + len(encoded) + length > self.segment_size:
+            self.out.flush()
+            os.fsync(self.out.fileno())
+            self.out.close()
+            self.segment += 1
+            self.out = open(self._segment_path(self.segment), 'ab')
+        self.out.write(self.RECORD.pack(self.MAGIC, len(encoded), length, crc) + encoded)
+        offset = self.out.tell()
+        shutil.copyfileobj(f, self.out, UPLOAD_CHUNK_SIZE)
+        return offset
+
+    def add(self, name, f):
+        """Append the contents of the binary file object f as result `name`."""
+        crc = 0
+        f.seek(0)
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+        length = f.tell()
+        f.seek(0)
+
+        with self.lock:
+            offset = self._append(name, f, length, crc)
+            self.out.flush()
+            os.fsync(self.out.fileno())
+            self._write_entry(name, self.segment, offset, length)
+            self.index.flush()
+            self._remember(name, self.segment, offset, length)
+        return length
+
+    def contains(self, name):
+        return name in self.entries
+
+    def read(self, name):
+        """Data of result `name`, KeyError if it is not in the store."""
+        segment, offset, length = self.entries[name]
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read_id(self, ident):
+        """(stored name, data) of the result of job `ident`, KeyError if there is none."""
+        name = self.by_id[ident]
+        return name, self.read(name)
+
+    def compact(self):
+        """Rewrite the newest record of every name into fresh segments and delete the old ones.
+
+        The new segments and index are synced, and the index renamed into
+        place durably, before any old segment is deleted, so after a crash
+        the index points either at the old segments or at complete new ones.
+        Returns (bytes before, bytes after). Uploads wait while it runs.
+        """
+        with self.lock:
+            old_segments = self._segments()
+            before = sum(os.path.getsize(self._segment_path(s)) for s in old_segments)
+            self.out.close()
+            self.index.close()
+
+            live = sorted(self.entries.items(), key=lambda item: item[1])
+            index_path = os.path.join(self.directory, "index.bin")
+            self.entries, self.by_id = {}, {}
+            self.segment += 1
+            self.out = open(self._segment_path(self.segment), 'ab')
+            self.index = open(index_path + ".tmp", 'wb')
+            for name, (segment, offset, length) in live:
+                data = self._read_at(segment, offset, length)
+                new_offset = self._append(name, io.BytesIO(data), length, zlib.crc32(data))
+                self._write_entry(name, self.segment, new_offset, length)
+                self._remember(name, self.segment, new_offset, length)
+            self.out.flush()
+            os.fsync(self.out.fileno())
+            self.index.flush()
+            os.fsync(self.index.fileno())
+            self.index.close()
+            fsync_directory(self.directory) # The new segment files themselves
+            os.replace(index_path + ".tmp", index_path)
+            fsync_directory(self.directory)
+            self.index = open(index_path, 'ab')
+
+            for segment in old_segments:
+                os.remove(self._segment_path(segment))
+            fsync_directory(self.directory)
+            after = sum(os.path.getsize(self._segment_path(s)) for s in self._segments())
+            return before, after
+
+    def _read_at(self, segment, offset, length):
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def close(self):
+        with self.lock:
+            if self.out is not None:
+                self.out.close()
+                self.index.close()
+                self.out = None
+
+
+class CompletionIndex:
+    """One bit per job id, set once a result for that id is safely stored (data/.completed).
+
+    --cont and utility/check.py read it instead of looking for every file.
+    If it is missing it is rebuilt with a single scan of data/.
+
+    A bit is written after its result is stored, without syncing either,
+    so after a crash the two may disagree. The index is therefore marked
+    dirty (a .dirty file next to it) while it is open and only unmarked by
+    close() once it is synced; a dirty index is rebuilt by the same scan.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty_path = path + COMPLETION_DIRTY
+        self.bits = bytearray()
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def open(self, segment_store=None):
+        """Load the index, or build it from data/ and the (open) segment store if it is missing or dirty."""
+        if os.path.exists(self.path) and not os.path.exists(self.dirty_path):
+            with open(self.path, 'rb') as f:
+                self.bits = bytearray(f.read())
+        else:
+            if os.path.exists(self.path):
+                print(f"Completion index was not closed cleanly, scanning {os.path.dirname(self.path)}/ ...")
+            else:
+                print(f"No completion index, scanning {os.path.dirname(self.path)}/ ...")
+            self.bits = bytearray()
+            ids = scan_result_ids(os.path.dirname(self.path))
+            if segment_store is not None and segment_store.is_open:
+                ids = itertools.chain(ids, segment_store.by_id)
+            for ident in ids:
+                self._set(ident)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(self.bits)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        with open(self.dirty_path, 'wb') as f:
+            os.fsync(f.fileno())
+        fsync_directory(os.path.dirname(self.path))
+        self.fd = os.open(self.path, os.O_RDWR)
+
+    def _set(self, ident):
+        byte = ident >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (ident & 7)
+        return byte
+
+    def add(self, ident):
+        if ident is None or self.fd is None:
+            return
+        with self.lock:
+            byte = self._set(ident)
+            os.pwrite(self.fd, self.bits[byte:byte + 1], byte)
+
+    def __contains__(self, ident):
+        byte = ident >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (ident & 7)))
+
+    def completed(self, max_id):
+        """Boolean array, True at position i if job id i (0 < i <= max_id) has a result."""
+        flags = np.unpackbits(np.frombuffer(bytes(self.bits), dtype=np.uint8), bitorder='little').astype(bool)
+        result = np.zeros(max_id + 1, dtype=bool)
+        count = min(len(flags), max_id + 1)
+        result[:count] = flags[:count]
+        return result
+
+    def close(self):
+        if self.fd is not None:
+            with self.lock:
+                os.fsync(self.fd)
+                os.close(self.fd)
+                self.fd = None
+            # Every stored result has its bit on disk now
+            os.remove(self.dirty_path)
+            fsync_directory(os.path.dirname(self.path))
+
+
+class UploadSessions:
+    """Resumable uploads. A session is <id>.part (the bytes received so far) and <id>.json
+    in `directory`, so a dropped connection or a server restart loses nothing already written.
+    Finished uploads are stored as results of `campaign`."""
+
+    def __init__(self, directory, campaign):
+        self.directory = directory
+        self.campaign = campaign
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def _paths(self, session):
+        if not session.isalnum():
+            raise KeyError(session)
+        base = os.path.join(self.directory, session)
+        return base + ".part", base + ".json"
+
+    def _lock(self, session):
+        with self.locks_lock:
+            return self.locks.setdefault(session, threading.Lock())
+
+    def open(self, file_name, computer_name, encoding=None):
+        """`encoding` is the Content-Encoding of the whole file; offsets count the encoded bytes."""
+        os.makedirs(self.directory, exist_ok=True)
+        session = uuid.uuid4().hex
+        part_path, meta_path = self._paths(session)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w') as f:
+            json.dump({"file_name": file_name, "computer": computer_name, "encoding": encoding, "created": time.time()}, f)
+        return session
+
+    def info(self, session):
+        """{"session", "file_name", "offset"}, or None for an unknown session."""
+        try:
+            part_path, meta_path = self._paths(session)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            return {"session": session, "file_name": meta["file_name"], "offset": os.path.getsize(part_path)}
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def append(self, session, offset, chunks):
+        """Write `chunks` at `offset`. Returns (offset now, accepted); a wrong offset writes nothing.
+
+        Whatever arrives before a dropped connection is kept, the client asks for the offset and resends the rest.
+        """
+        part_path, _ = self._paths(session)
+        with self._lock(session):
+            current = os.path.getsize(part_path)
+            if offset != current:
+                return current, False
+            with open(part_path, 'ab') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return os.path.getsize(part_path), True
+
+    def finish(self, session, ID=None):
+        """Move the received file into data/ and drop the session. Returns its file name.
+
+        With the ID of its job, the file is dropped instead if that job is finished already (see Campaign.stream_result).
+        """
+        campaign = self.campaign
+        part_path, meta_path = self._paths(session)
+        with self._lock(session):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            file_name = meta["file_name"]
+            encoding = meta.get("encoding")
+            if ID is not None and campaign.experimenter.finished(ID):
+                os.remove(part_path)
+                campaign.dropped(file_name, ID)
+            elif encoding == RESULT_COMPRESSION:
+                size = os.path.getsize(part_path)
+                start = time.perf_counter()
+                with open(part_path, 'rb') as f:
+                    if encoding is not None:
+                        # Stored as received, only check that it decompresses
+                        collections.deque(transcode(iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""),
+                                                    decompressor(encoding), None, keep_input=True), maxlen=0)
+                    if RESULT_STORE == "packed":
+                        campaign.segment_store.add(stored_name(file_name), f)
+                    else:
+                        os.fsync(f.fileno())
+                if RESULT_STORE == "packed":
+                    os.remove(part_path)
+                else:
+                    os.replace(part_path, campaign.result_target(file_name))
+                campaign.stored(file_name, size, time.perf_counter() - start)
+            else:
+                with open(part_path, 'rb') as f:
+                    campaign.stream_result(file_name, iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""), encoding, ID)
+                os.remove(part_path)
+            os.remove(meta_path)
+        with self.locks_lock:
+            self.locks.pop(session, None)
+        return file_name
+
+    def purge(self, max_age):
+        """Delete sessions that were opened more than max_age seconds ago and never finished."""
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                for path in self._paths(entry.name[:-len(".json")]):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+class Node:
+    """This server as one of several nodes sharing a campaign (--nodes), each owning part of the job ids.
+
+    Node k of N starts out owning the k-th of N contiguous id ranges; the
+    jobs of the other ranges are JOB_ELSEWHERE here. Whenever fewer jobs
+    are queued than running, the node asks its peers how much they have
+    queued (GET /node) and takes over the top half of the difference from
+    the longest queue (POST /node/steal), so the ranges even out as nodes
+    run dry. Only a node with runners of its own takes jobs over, so jobs
+    do not drift to a node nobody asks for work, and it takes the whole
+    queue of a node that has no runners left.
+
+    A node tells its runners the campaign is finished only once no node has
+    jobs queued, running or being handed over; until then a runner finding
+    the queue here empty is asked to retry (more_coming), as jobs may still
+    arrive by a handover. Runners pick their node by hashing their name over
+    the same list (see runner_py.py) and move on to the next once it has
+    nothing left, until every node has said so.
+
+    A handover has two steps. /node/steal sets the jobs aside on the giving
+    node and returns them with a token; once the taking node has queued
+    them it sends the token to /node/confirm. Jobs not confirmed within
+    NODE_HANDOVER_TIMEOUT are taken back, so a lost reply or a failed
+    node can at worst have a job run twice, never leave it with nobody.
+    """
+
+    def __init__(self, campaign, index, urls):
+        self.campaign = campaign
+        self.index = index
+        self.urls = urls
+        self.peers = [url for i, url in enumerate(urls) if i != index]
+        self.handovers = {} # token -> (indices, deadline, node), waiting for /node/confirm
+        self.handovers_lock = threading.Lock()
+
+    def id_range(self, total):
+        """[start, stop) of the 0-based indices this node owns at the start of a campaign of `total` jobs."""
+        return total * self.index // len(self.urls), total * (self.index + 1) // len(self.urls)
+
+    def status(self):
+        experimenter = self.campaign.experimenter
+        with experimenter.lock:
+            queued = experimenter.queued_count()
+            running, done = experimenter.jobs.running, experimenter.jobs.done
+            runners = experimenter.active_runners()
+        with self.handovers_lock:
+            handing_over = sum(len(indices) for indices, _, _ in self.handovers.values())
+        return {"node": self.index, "queued": queued, "running": running, "finished": done,
+                "handing_over": handing_over, "runners": runners}
+
+    def claim(self, directory):
+        """Record in `directory` that it belongs to this node, refusing one that belongs to another node.
+
+        Every node journals and stores results in its own directory; two
+        nodes started in the same one would overwrite each other's state.
+        """
+        path = os.path.join(directory, NODE_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                owner = json.load(f)
+            if owner.get("index") != self.index or owner.get("nodes") != self.urls:
+                raise ValueError(f"{os.path.abspath(directory)} belongs to node {owner.get('index')} of "
+                                 f"{','.join(owner.get('nodes', []))}; start every node in its own directory")
+            return
+        with open(path, "w") as f:
+            json.dump({"index": self.index, "nodes": self.urls}, f)
+
+    def start(self):
+        # Until the first round of asking the peers, assume they may still have work
+        self.campaign.experimenter.expect_more(True)
+        threading.Thread(target=self._rebalance_loop, daemon=True).start()
+
+    def _rebalance_loop(self):
+        while True:
+            time.sleep(NODE_POLL_INTERVAL)
+            try:
+                self.reclaim()
+                self.rebalance()
+            except Exception as e:
+                print(f"Rebalancing failed: {e}")
+
+    def give(self, count, node):
+        """Set up to `count` queued jobs aside for another node (POST /node/steal). Returns (token, 1-based ids)."""
+        indices = self.campaign.experimenter.hand_over(count, node)
+        if not indices:
+            return None, []
+        token = uuid.uuid4().hex
+        with self.handovers_lock:
+            self.handovers[token] = (indices, time.time() + NODE_HANDOVER_TIMEOUT, node)
+        return token, [index + 1 for index in indices]
+
+    def confirm(self, token):
+        """The other node has queued the jobs of handover `token` (POST /node/confirm). False if it was unknown or had expired."""
+        with self.handovers_lock:
+            return self.handovers.pop(token, None) is not None
+
+    def reclaim(self):
+        """Queue the jobs of handovers that were not confirmed in time here again."""
+        now = time.time()
+        with self.handovers_lock:
+            expired = [token for token, (_, deadline, _) in self.handovers.items() if deadline <= now]
+            expired = [self.handovers.pop(token) for token in expired]
+        for indices, _, node in expired:
+            taken = self.campaign.experimenter.adopt(indices, f"node {node} (handover not confirmed)")
+            print(f"Node {node} did not confirm taking over {len(indices)} jobs, took {len(taken)} back")
+
+    def _call(self, url, path, method="GET", headers=None):
+        request = urllib.request.Request(url + path, method=method, headers=headers or {})
+        with urllib.request.urlopen(request, timeout=NODE_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def rebalance(self):
+        """Ask the peers how far they are, and take jobs over from the longest queue if this node is running low."""
+        mine = self.status()
+        peers = []
+        for url in self.peers:
+            try:
+                status = self._call(url, "/node")
+                peers.append((status["queued"], status["running"] + status.get("handing_over", 0), status.get("runners", 1), url))
+            except (OSError, ValueError, KeyError):
+                pass # Down or not a node, ask the others
+        # Jobs queued, running or on the way anywhere may still end up here
+        self.campaign.experimenter.expect_more(mine["handing_over"] > 0 or any(queued or busy for queued, busy, _, _ in peers))
+        if not peers or mine["runners"] == 0 or mine["queued"] >= max(1, mine["running"]):
+            return
+        queued, _, runners, url = max(peers)
+        if runners == 0:
+            count = queued # Nobody is asking for them there
+        else:
+            count = (queued - mine["queued"]) // 2
+            if count < NODE_MIN_STEAL:
+                return
+        if count == 0:
+            return
+        reply = self._call(url, "/node/steal", "POST", {"Count": str(count), "Node": str(self.index)})
+        ids = reply["ids"]
+        if ids:
+            self.campaign.experimenter.adopt([i - 1 for i in ids], url)
+            # Unconfirmed, the other node queues them again after NODE_HANDOVER_TIMEOUT
+            if self._call(url, "/node/confirm", "POST", {"Token": reply["token"]})["confirmed"]:
+                print(f"Took over {len(ids)} jobs ({ids[0]}..{ids[-1]}) from {url}")
+            else:
+                print(f"{url} had already taken back jobs {ids[0]}..{ids[-1]}, they may run twice")
+
+
+class RelayedJobs:
+    """data_array of a relayed campaign: the parameters of the jobs leased from upstream so far.
+
+    Has the length of the upstream campaign; jobs not held here read as {"id": ...}.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.jobs = {}
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.total:
+            raise IndexError("data_array index out of range")
+        return self.jobs.get(index) or {"id": index + 1}
+
+    def __setitem__(self, index, job):
+        self.jobs[index] = job
+
+    def __iter__(self):
+        for index in range(self.total):
+            yield self[index]
+
+    def forget(self, indices):
+        for index in indices:
+            self.jobs.pop(index, None)
+
+
+class Relay:
+    """This server as a relay (--relay URL) for the runners of one site, in front of the upstream server.
+
+    Every upstream campaign is mirrored by a local Campaign of the same name
+    whose jobs are all JOB_ELSEWHERE to begin with. Whenever fewer than half
+    a batch is queued here, the relay leases a batch upstream (one long-poll
+    /lease) and adopts it, and the local runners get those jobs over the
+    usual API. Every RELAY_FORWARD_INTERVAL seconds the finished jobs go
+    upstream together: one /completeBatch carrying the small results, the
+    large ones streamed through /upload before it. Forwarded jobs are
+    JOB_ELSEWHERE again and their files leave the local data/, which is
+    only a spool. One /heartbeat keeps all upstream leases of the relay alive.
+
+    Upstream sees a single runner per relay, so its load grows with the
+    number of sites rather than machines.
+    """
+
+    def __init__(self, upstream, name, batch=RELAY_BATCH):
+        self.upstream = upstream
+        self.name = name
+        self.batch = batch
+        self.lease_seconds = 0 # Upstream's lease timeout, 0 when it needs no heartbeats
+        self.outbox = {} # Campaign -> names of the results stored here and not forwarded yet
+        self.outbox_lock = threading.Lock()
+
+    def _headers(self, campaign, headers=None):
+        headers = dict(headers or {}, ComputerName=self.name)
+        if campaign is not None and campaign.name:
+            headers["Campaign"] = campaign.name
+        return headers
+
+    def _call(self, path, method="GET", headers=None, data=None):
+        request = urllib.request.Request(self.upstream + path, data=data, method=method, headers=headers or {})
+        with urllib.request.urlopen(request, timeout=RELAY_TIMEOUT + RELAY_WAIT) as response:
+            return response.read()
+
+    def mirror(self):
+        """Yield a local Campaign for every upstream one."""
+        statuses = json.loads(self._call("/campaigns"))
+        for status in statuses:
+            name = status["name"]
+            campaign = Campaign(name, os.path.join(CAMPAIGN_DIR, name) if len(statuses) > 1 else "", status["weight"])
+            experimenter = campaign.experimenter
+            experimenter.load_data(RelayedJobs(status["total"]))
+            experimenter.jobs.mark_elsewhere(0, status["total"])
+            experimenter.more_coming = True
+            os.makedirs(campaign.data_dir, exist_ok=True)
+            experimenter.logs.start()
+            experimenter.stateLogs.start()
+            campaign.upload_sessions.purge(UPLOAD_SESSION_TTL)
+            campaign.result_listeners.append(self._stored)
+            yield campaign
+
+    def _stored(self, campaign, file_name):
+        with self.outbox_lock:
+            self.outbox.setdefault(campaign, set()).add(file_name)
+
+    def start(self):
+        threading.Thread(target=self._fill_loop, daemon=True).start()
+        threading.Thread(target=self._forward_loop, daemon=True).start()
+
+    def _fill_loop(self):
+        while True:
+            try:
+                more = self.fill()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Leasing from {self.upstream} failed: {e}")
+                more = True
+            time.sleep(RELAY_POLL_INTERVAL if more else RELAY_WAIT)
+
+    def _forward_loop(self):
+        next_heartbeat = 0
+        while True:
+            time.sleep(RELAY_FORWARD_INTERVAL)
+            try:
+                self.forward()
+                if self.lease_seconds > 0 and time.time() >= next_heartbeat:
+                    self.heartbeat()
+                    next_heartbeat = time.time() + self.lease_seconds / 3
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Forwarding to {self.upstream} failed: {e}")
+
+    def fill(self):
+        """Lease a batch upstream if the local queue is down to half a batch. False once upstream has nothing left."""
+        queued = 0
+        for campaign in campaigns:
+            with campaign.experimenter.lock:
+                queued += campaign.experimenter.queued_count()
+        if queued > self.batch // 2:
+            return True
+
+        headers = self._headers(None, {"Count": str(self.batch - queued), "Wait": str(RELAY_WAIT)})
+        reply = json.loads(self._call("/lease", headers=headers))
+        if reply.get("retry"):
+            return True
+        jobs = reply.get("jobs")
+        if not jobs:
+            for campaign in campaigns:
+                campaign.experimenter.expect_more(False)
+            return False
+        self.lease_seconds = reply.get("lease_seconds", 0)
+
+        # All jobs of a lease come from the same campaign
+        campaign = campaigns.get(jobs[0].get("Campaign"))
+        if campaign is None:
+            print(f"{self.upstream} sent jobs of campaign {jobs[0].get('Campaign')}, which it did not have at the start")
+            return True
+        experimenter = campaign.experimenter
+        indices = experimenter.adopt(
+            [int(job["id"]) - 1 for job in jobs], self.upstream,
+            [{key: value for key, value in job.items() if key not in ("Taken At", "Campaign")} for job in jobs])
+        if indices:
+            print(f"Leased {len(indices)} jobs ({indices[0] + 1}..{indices[-1] + 1}) from {self.upstream}")
+        experimenter.expect_more(True)
+        return True
+
+    def forward(self):
+        """Send every finished job and every stored result upstream."""
+        for campaign in campaigns:
+            self._forward(campaign)
+
+    def _forward(self, campaign):
+        experimenter = campaign.experimenter
+        with experimenter.lock:
+            finished = experimenter.jobs.indices(JOB_FINISHED)
+            durations = (experimenter.jobs.completed[finished] - experimenter.jobs.taken[finished]).tolist()
+        # Results are stored before their job is marked finished, so read these second
+        with self.outbox_lock:
+            pending = set(self.outbox.get(campaign, ()))
+        by_id = {}
+        for file_name in pending:
+            by_id.setdefault(result_id(file_name), []).append(file_name)
+
+        items, sent = [], []
+        budget = RELAY_BATCH_BYTES
+        for index, duration in zip(finished.tolist(), durations):
+            item = {"id": index + 1, "duration": None if math.isnan(duration) else duration}
+            for file_name in by_id.pop(index + 1, ()):
+                path = campaign.result_target(file_name)
+                if os.path.exists(path):
+                    size = os.path.getsize(path)
+                    if "file" not in item and size <= min(RELAY_INLINE_SIZE, budget):
+                        item["file_name"], item["file"] = file_name, base64.b64encode(self._read(path)).decode('ascii')
+                        budget -= size
+                    else:
+                        self._upload(campaign, file_name, path)
+                sent.append((file_name, path))
+            items.append(item)
+
+        # Results without a finished job here (stored without an ID, or a late backup copy) go on their own,
+        # unless their job is still queued or running here and its completion is yet to come
+        for ident, names in by_id.items():
+            if ident is not None and (experimenter.jobs.is_running(ident - 1) or experimenter.jobs.is_queued(ident - 1)):
+                continue
+            for file_name in names:
+                path = campaign.result_target(file_name)
+                if os.path.exists(path):
+                    self._upload(campaign, file_name, path)
+                sent.append((file_name, path))
+
+        if items:
+            body = compress(json.dumps({"results": items}).encode('utf-8'), "gzip")
+            headers = self._headers(campaign, {"Content-Type": "application/json", "Content-Encoding": "gzip"})
+            self._call("/completeBatch", "POST", headers, body)
+            experimenter.hand_back(finished.tolist(), JOB_FINISHED)
+            experimenter.data_array.forget(finished.tolist())
+            experimenter.log(f"Forwarded {len(items)} finished jobs to {self.upstream}")
+        for file_name, path in sent:
+            if os.path.exists(path):
+                os.remove(path)
+        if sent:
+            with self.outbox_lock:
+                self.outbox[campaign] -= {file_name for file_name, _ in sent}
+
+    def _read(self, path):
+        """A stored result as uploaded, undoing --compress-results."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if RESULT_COMPRESSION is not None:
+            data = b"".join(transcode([data], decompressor(RESULT_COMPRESSION), None))
+        return data
+
+    def _upload(self, campaign, file_name, path):
+        """Stream a stored result upstream as it is, without marking any job finished."""
+        headers = {"File-Name": file_name, "Content-Length": str(os.path.getsize(path))}
+        if RESULT_COMPRESSION is not None:
+            headers["Content-Encoding"] = RESULT_COMPRESSION
+        with open(path, 'rb') as f:
+            self._call("/upload", "POST", self._headers(campaign, headers), f)
+
+    def heartbeat(self):
+        """Keep the upstream leases of every job held here alive; drop queued jobs upstream has taken back."""
+        for campaign in campaigns:
+            experimenter = campaign.experimenter
+            with experimenter.lock:
+                held = (np.flatnonzero(experimenter.jobs.status[:len(experimenter.jobs)] != JOB_ELSEWHERE) + 1).tolist()
+            if not held:
+                continue
+            reply = json.loads(self._call("/heartbeat", headers=self._headers(campaign, {"ID": ",".join(map(str, held))})))
+            dropped = experimenter.hand_back([int(ID) - 1 for ID in reply.get("lost", [])], JOB_PENDING, JOB_RESET)
+            if dropped:
+                experimenter.data_array.forget(dropped)
+                print(f"{self.upstream} took back {len(dropped)} queued jobs")
+
+
+class Campaign:
+    """One parameter file with its own Experimenter, data/ directory, logs and state.
+
+    A server normally runs a single campaign in the current directory. With
+    --campaign every campaign gets a directory of its own (campaigns/<name>)
+    and they share the runners, see Campaigns.
+    """
+
+    def __init__(self, name="", directory="", weight=1.0):
+        self.name = name
+        self.directory = directory
+        self.weight = weight
+        self.data_dir = os.path.join(directory, "data")
+        self.shard_size = 0 # Layout of data_dir, see read_layout
+        self.experimenter = Experimenter(directory, name or None)
+        self.upload_sessions = UploadSessions(os.path.join(directory, UPLOAD_SESSION_DIR), self)
+        self.segment_store = SegmentStore(os.path.join(directory, PACKED_DIR))
+        self.completion_index = CompletionIndex(os.path.join(directory, COMPLETION_INDEX))
+        self.result_listeners = [] # Called with (campaign, file name) for every result stored, see Relay
+
+    def save_result(self, file_name, file_content, ID=None):
+        return self.stream_result(file_name, [file_content], ID=ID)
+
+    def stream_result(self, file_name, chunks, encoding=None, ID=None):
+        """Write an upload into data/ through a temp file, so a half-received file never shows up under its real name.
+
+        `encoding` is how the chunks are compressed; they are recompressed only if that differs from RESULT_COMPRESSION.
+        With the ID of the job the result belongs to, it is dropped if that job is finished already
+        (checked before and after receiving it), so the first result stays. Returns whether it was stored.
+        """
+        if ID is not None and self.experimenter.finished(ID):
+            collections.deque(chunks, maxlen=0) # Still read the body off the connection
+            return self.dropped(file_name, ID)
+        if encoding != RESULT_COMPRESSION:
+            chunks = transcode(chunks, decompressor(encoding), compressor(RESULT_COMPRESSION))
+        elif encoding is not None:
+            chunks = transcode(chunks, decompressor(encoding), None, keep_input=True)
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        if RESULT_STORE == "packed":
+            # Small results never touch the disk outside their segment
+            with tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE, dir=self.data_dir) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                if ID is not None and self.experimenter.finished(ID):
+                    return self.dropped(file_name, ID)
+                start = time.perf_counter()
+                size = self.segment_store.add(stored_name(file_name), f)
+            self.stored(file_name, size, time.perf_counter() - start)
+            return True
+
+        # Only the time spent in writes counts, not waiting for the next chunk from the network
+        size, spent = 0, 0.0
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix=".upload-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    start = time.perf_counter()
+                    f.write(chunk)
+                    spent += time.perf_counter() - start
+                    size += len(chunk)
+                # On disk before the rename, so a crash can't leave a short file under the real name
+                start = time.perf_counter()
+                f.flush()
+                os.fsync(f.fileno())
+            if ID is not None and self.experimenter.finished(ID):
+                os.unlink(tmp_path)
+                return self.dropped(file_name, ID)
+            os.replace(tmp_path, self.result_target(file_name))
+            spent += time.perf_counter() - start
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.stored(file_name, size, spent)
+        return True
+
+    def dropped(self, file_name, ID):
+        """Record a result that was not stored because job ID was finished already. Returns False."""
+        self.experimenter.log(f"Dropped {file_name}, job {ID} was already finished")
+        return False
+
+    def stored(self, file_name, size, seconds):
+        """Record a result that is now safely in data/: `size` bytes, written in `seconds`."""
+        RESULT_BYTES.inc(self.name, amount=size)
+        RESULT_WRITE_SECONDS.observe(seconds, self.name)
+        self.completion_index.add(result_id(file_name))
+        for listener in self.result_listeners:
+            listener(self, file_name)
+
+    def result_target(self, file_name):
+        """Final path of an upload in data/, creating its shard directory if needed."""
+        directory = result_dir(self.data_dir, file_name, self.shard_size)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, stored_name(file_name))
+
+    def status(self):
+        """Summary for /campaigns and the `campaigns` command."""
+        jobs = self.experimenter.jobs
+        return {"name": self.name, "weight": self.weight, "total": len(self.experimenter.data_array),
+                "finished": jobs.done, "running": jobs.running}
+
+
+class Campaigns:
+    """The campaigns a server runs, and the weighted fair share of runners between them.
+
+    A runner asking for work gets it from the campaign with the fewest
+    running jobs per unit of weight among those that have a job for it, so
+    the runners split between campaigns in proportion to their weights and a
+    campaign that runs dry leaves its share to the others. Requests about a
+    job (uploads, heartbeats, /info ...) name its campaign in a Campaign
+    header or ?campaign= parameter; without one they go to the first.
+    """
+
+    def __init__(self):
+        self.campaigns = {} # name -> Campaign, in the order they were given
+        # Long-poll across campaigns: bumped and notified whenever any of them has a job requeued
+        self.changed = threading.Condition()
+        self.generation = 0
+
+    def add(self, campaign):
+        self.campaigns[campaign.name] = campaign
+        campaign.experimenter.listeners.append(self._changed)
+
+    def __iter__(self):
+        return iter(self.campaigns.values())
+
+    def __len__(self):
+        return len(self.campaigns)
+
+    def get(self, name=None):
+        """Campaign called `name`, the first one if no name is given, None for an unknown name."""
+        if not name:
+            return next(iter(self.campaigns.values()), None)
+        return self.campaigns.get(name)
+
+    def _changed(self):
+        """Experimenter listener."""
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+    def by_share(self):
+        """Campaigns in the order they should get the next runner, the most underserved first."""
+        return sorted(self, key=lambda campaign: campaign.experimenter.jobs.running / campaign.weight)
+
+    def dispatch(self, lease, computer_name, count, wait, runner):
+        """Hand out one job (or a lease of `count`) from the campaign whose turn it is.
+
+        Returns (campaign, job or list of jobs). (None, None) means nothing
+        turned up within `wait` seconds, (None, []) that no campaign has
+        anything left for this runner; without `wait` an empty queue
+        everywhere counts as that, as with a single campaign.
+        """
+        if wait is None and any(campaign.experimenter.more_coming for campaign in self):
+            wait = 0
+        deadline = None if wait is None else time.time() + wait
+        while True:
+            with self.changed:
+                generation = self.generation
+            busy = False
+            for campaign in self.by_share():
+                state = campaign.experimenter.has_work(computer_name, runner)
+                busy = busy or state == "running"
+                if state != "queued":
+                    continue
+                if lease:
+                    data = campaign.experimenter.leaseExperiments('-1', computer_name, count, 0, runner)
+                else:
+                    data = campaign.experimenter.getExperiment('-1', computer_name, 0, runner)
+                if data and "message" not in data:
+                    return campaign, data
+                busy = busy or data is None # Taken by another runner in the meantime
+
+            if not busy or deadline is None:
+                return None, []
+            with self.changed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None, None
+                if self.generation == generation:
+                    self.changed.wait(remaining)
+
+
+campaigns = Campaigns()
+node = None # This server's Node with --nodes
+relay = None # This server's Relay with --relay
+
+
+
+
+
+
+RED = "\033[31m"
+GREEN = "\033[32m"
+YELLOW = "\033[33m"
+Blue = "\033[34m"
+Magenta = "\033[35m"
+Cyan = "\033[36m"
+RESET = "\033[0m"
+
+
+ROWS_PER_COLUMN = 20  # Number of rows that fit into a single terminal column
+COLUMN_DIST = 30
+
+# The HTTP API, independent of the server backend. Every api_* function
+# returns (status, body, content type, extra headers), or None when the
+# client went away mid-request and there is nobody to answer.
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, lastLog, index, Count, Wait, Cores, Memory, Tags, Campaign, Node',
+    'Access-Control-Expose-Headers': 'Next-Since',
+}
+
+# GET paths that do not hand out jobs; everything else is a dispatch request
+API_GET_PATHS = {"/getNum", "/timeStats", "/logs", "/status", "/info", "/reset", "/heartbeat", "/campaigns", "/node", "/metrics"}
+# Paths /metrics labels separately; any other is a dispatch request (GET) or a single base64 result (POST), see metrics_path
+METRICS_PATHS = API_GET_PATHS | {"/lease", "/upload", "/uploads", "/completeBatch", "/node/steal", "/node/confirm"}
+
+
+def json_response(code, data, indent=None, headers=None):
+    return code, json.dumps(data, indent=indent).encode('utf-8'), 'application/json', headers or {}
+
+
+def text_response(code, text):
+    return code, text.encode('utf-8'), 'text/plain', {}
+
+
+def page_response(entries):
+    """A page of event log entries; Next-Since is the cursor for the following request."""
+    return json_response(200, entries, headers={"Next-Since": str(entries[-1]["ID"])} if entries else {})
+
+
+def is_dispatch(path):
+    return path not in API_GET_PATHS and not path.startswith("/uploads/")
+
+
+def metrics_path(path):
+    """Path label of a request in /metrics, from a fixed set so that arbitrary paths cannot add series."""
+    if path.startswith("/uploads/"):
+        return "/uploads/{session}/finish" if path.endswith("/finish") else "/uploads/{session}"
+    return path if path in METRICS_PATHS else "/"
+
+
+def encode_body(body, accept_encoding):
+    """(body, encoding): compressed if the client accepts it and it is worth it."""
+    encoding = accepted_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding is not None:
+        body = compress(body, encoding)
+    return body, encoding
+
+
+def decoded_body(chunks, headers):
+    """Whole request body, decoded from its Content-Encoding. ValueError if that is unsupported or corrupt."""
+    decoder = decompressor(content_encoding(headers.get('Content-Encoding')))
+    return b"".join(transcode(chunks, decoder, None))
+
+
+def request_campaign(headers, query=None):
+    """Campaign a request is about (Campaign header or ?campaign=), None if there is no such campaign."""
+    name = headers.get('Campaign') or (query or {}).get('campaign', [None])[0]
+    return campaigns.get(name)
+
+
+UNKNOWN_CAMPAIGN = {"message": "Unknown campaign."}
+ALREADY_FINISHED = "Job already finished, result not stored"
+
+
+def api_get(path, query, headers):
+    if path == "/campaigns":
+        return json_response(200, [campaign.status() for campaign in campaigns], indent=2)
+
+    if path == "/node":
+        return json_response(200, node.status()) if node else json_response(404, {"message": "Not a node."})
+
+    if path == "/metrics":
+        return 200, render_metrics().encode('utf-8'), "text/plain; version=0.0.4", {}
+
+    campaign = request_campaign(headers, query)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    experimenter = campaign.experimenter
+
+    if path == "/getNum":
+        return 200, str(len(experimenter.data_array)).encode(), "text/plain", {}
+
+    if path == "/timeStats":
+        return json_response(200, experimenter.calculate_time_stats())
+
+    if path == "/logs":
+        if 'since' in query:
+            relevant_logs = experimenter.logs.page(int(query['since'][0]), page_limit(query, MAX_PAGE_SIZE))
+        else:
+            last_log = int(headers.get('lastLog', len(experimenter.logs) - 6))
+            if(last_log <= len(experimenter.logs) - 6):
+                relevant_logs = experimenter.logs.tail(30)
+            else:
+                relevant_logs = experimenter.logs.page(last_log, 4)
+        return page_response(relevant_logs)
+
+    if path == "/status":
+        since = int(query['since'][0]) if 'since' in query else int(headers.get('lastLog', -1))
+        return page_response(experimenter.stateLogs.page(since, page_limit(query, STATUS_PAGE_SIZE)))
+
+    if path == "/info":
+        index = int(headers.get('index', 0)) - 1
+        response = experimenter.job_info(index) if 0 <= index < len(experimenter.data_array) else {"text": "Invalid ID"}
+        return json_response(200, response, indent=2)
+
+    if path == "/reset":
+        index = int(headers.get('index', 0)) - 1
+        response = {"text": "Reset Success"} if 0 <= index < len(experimenter.data_array) else {"text": "Invalid ID"}
+
+        # Use the thread-safe reset method instead of direct access
+        if 0 <= index < len(experimenter.data_array):
+            print(f"Resetting data {index + 1} because of webpage.")
+            experimenter.log(f"Reset index {index + 1} from webpage")
+            experimenter.reset(index)
+        return json_response(200, response, indent=2)
+
+    computer_name = headers.get('ComputerName', 'Admin')
+    ID = headers.get('ID', '-1')
+
+    if path == "/heartbeat":
+        IDs = [i for i in ID.split(',') if i and i != '-1']
+        lost = experimenter.heartbeat(IDs, computer_name)
+        return json_response(200, {"lease_seconds": experimenter.lease_timeout, "lost": lost})
+
+    if path.startswith("/uploads/"):
+        info = campaign.upload_sessions.info(path[len("/uploads/"):])
+        return json_response(200 if info else 404, info or {"message": "Unknown upload session."})
+
+    response = api_dispatch(path, ID, computer_name, int(headers.get('Count', 0)), dispatch_wait(headers),
+                            runner_capabilities(headers), campaign)
+    return response or json_response(200, RETRY_REPLY)
+
+
+def dispatch_wait(headers):
+    """Seconds a dispatch request may long-poll (Wait header), None if it did not ask to."""
+    wait = headers.get('Wait')
+    return None if wait is None else min(max(float(wait), 0), MAX_DISPATCH_WAIT)
+
+
+def api_dispatch(path, ID, computer_name, count, wait, runner, campaign):
+    """GET / (one job) or /lease (`count` jobs, 0 = sized by the server) for a runner with Capabilities `runner`.
+
+    None if `wait` ran out with no job available, see Experimenter.getExperiment.
+    `campaign` is the one job ID belongs to; with several campaigns the work
+    comes from whichever one's turn it is, see Campaigns.dispatch.
+    """
+    if len(campaigns) > 1:
+        owner, data = campaigns.dispatch(path == "/lease", computer_name, count, wait, runner)
+        if ID != '-1':
+            campaign.experimenter.release(ID, computer_name)
+        if data is None:
+            return None
+        if not data:
+            return json_response(200, {"message": "No more data left."})
+        if path == "/lease":
+            data = {"jobs": data, "lease_size": len(data), "lease_seconds": owner.experimenter.lease_timeout}
+        return json_response(200, data)
+
+    experimenter = campaign.experimenter
+    if path == "/lease":
+        jobs = experimenter.leaseExperiments(ID, computer_name, count, wait, runner)
+        if jobs is None:
+            return None
+        response_data = {"jobs": jobs, "lease_size": len(jobs), "lease_seconds": experimenter.lease_timeout} if jobs else {"message": "No more data left."}
+        return json_response(200, response_data)
+
+    response_data = experimenter.getExperiment(ID, computer_name, wait, runner)
+    return None if response_data is None else json_response(200, response_data)
+
+
+def api_post_json(path, headers, read_body):
+    """POST / (one base64 result), /completeBatch, /node/steal and /node/confirm. read_body() returns the decoded body."""
+    if path in ("/node/steal", "/node/confirm"):
+        if node is None:
+            return json_response(404, {"message": "Not a node."})
+        if path == "/node/confirm":
+            return json_response(200, {"confirmed": node.confirm(headers.get('Token', ''))})
+        token, ids = node.give(int(headers.get('Count', 0)), headers.get('Node', '?'))
+        return json_response(200, {"ids": ids, "token": token})
+
+    campaign = request_campaign(headers)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    computer_name = headers.get('ComputerName', 'Null')
+    if path == "/completeBatch":
+        return api_complete_batch(campaign, computer_name, read_body)
+
+    ID = headers.get('ID', '-1')
+    content_length = int(headers.get('Content-Length', 0))
+    if content_length <= 0:
+        if(ID != '-1'):
+            campaign.experimenter.complete(ID, computer_name)
+        return text_response(400, "No content received.")
+
+    try:
+        post_data = read_body().decode('utf-8')
+    except ValueError as e:
+        return text_response(400, str(e))
+    json_data = json.loads(post_data)
+
+    file_name = json_data.get('file_name')
+    file_content_base64 = json_data.get('file')
+
+    if not file_name or not file_content_base64:
+        return text_response(400, "Missing 'file_name' or 'file' in JSON payload")
+
+    try:
+        file_content = base64.b64decode(file_content_base64)
+    except Exception as e:
+        return text_response(400, "Invalid Base64 content in 'file'")
+
+    # Stored before the job is marked finished, so a later copy of it finds it finished and is dropped
+    stored = campaign.save_result(file_name, file_content, None if ID == '-1' else ID)
+    if(ID != '-1'):
+        campaign.experimenter.complete(ID, computer_name)
+
+    display_colored_array(campaign.experimenter.data_array)
+    if not stored:
+        return text_response(200, ALREADY_FINISHED)
+    return text_response(200, "File uploaded and saved successfully")
+
+
+def api_complete_batch(campaign, computer_name, read_body):
+    """Store every result of a lease and mark the jobs finished with one lock acquisition.
+
+    Body: {"results": [{"id": 5, "file_name": "...", "file": "<base64>", "duration": 1.2}, ...]}
+    """
+    try:
+        results = json.loads(read_body().decode('utf-8'))["results"]
+        decoded = [(item['id'], item.get('file_name'), base64.b64decode(item['file']) if item.get('file') else None)
+                   for item in results]
+    except Exception:
+        return text_response(400, "Invalid batch payload")
+
+    for ID, file_name, file_content in decoded:
+        if file_name and file_content is not None:
+            campaign.save_result(file_name, file_content, ID)
+
+    IDs = [str(item['id']) for item in results]
+    durations = [item.get('duration') for item in results]
+    campaign.experimenter.completeBatch(IDs, computer_name, None if None in durations else durations)
+    return json_response(200, {"completed": IDs})
+
+
+def api_upload(headers, chunks):
+    """Raw result upload: the body is the file itself and is streamed straight to disk.
+
+    Headers: File-Name (required), ID (job to mark finished, optional),
+    Duration (seconds the job took, optional). Without an ID the file is
+    only stored, e.g. before a /completeBatch that carries no files; Job-ID
+    then names its job. A result for a job that is finished already is not
+    stored, the first one stays.
+    """
+    campaign = request_campaign(headers)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    computer_name = headers.get('ComputerName', 'Null')
+    file_name = os.path.basename(headers.get('File-Name', ''))
+    if not file_name:
+        return text_response(400, "Missing 'File-Name' header")
+
+    try:
+        stored = campaign.stream_result(file_name, chunks, content_encoding(headers.get('Content-Encoding')), result_job(headers))
+    except ConnectionError as e:
+        # The runner is gone, nobody to answer
+        campaign.experimenter.log(f"Upload of {file_name} from {computer_name} failed: {e}")
+        return None
+    except ValueError as e:
+        return text_response(400, str(e))
+
+    finish_job(campaign, headers)
+    return text_response(200, "File uploaded and saved successfully" if stored else ALREADY_FINISHED)
+
+
+def result_job(headers):
+    """ID of the job an upload is the result of (ID or Job-ID header), None if it does not say."""
+    ID = headers.get('ID', '-1')
+    if ID == '-1':
+        ID = headers.get('Job-ID', '-1')
+    return None if ID == '-1' else ID
+
+
+def finish_job(campaign, headers):
+    """Mark the job in the ID header (if any) finished after its upload, with the Duration header."""
+    ID = headers.get('ID', '-1')
+    if ID != '-1':
+        duration = headers.get('Duration')
+        campaign.experimenter.complete(ID, headers.get('ComputerName', 'Null'), float(duration) if duration else None)
+
+
+def api_open_upload(headers):
+    """Start a resumable upload. Headers: File-Name, Content-Encoding of the whole file (optional).
+
+    Replies {"session": "<id>", "offset": 0}.
+    """
+    campaign = request_campaign(headers)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    file_name = os.path.basename(headers.get('File-Name', ''))
+    if not file_name:
+        return json_response(400, {"message": "Missing 'File-Name' header"})
+    try:
+        encoding = content_encoding(headers.get('Content-Encoding'))
+    except ValueError as e:
+        return json_response(400, {"message": str(e)})
+    session = campaign.upload_sessions.open(file_name, headers.get('ComputerName', 'Null'), encoding)
+    return json_response(200, {"session": session, "offset": 0})
+
+
+def api_append_upload(path, headers, chunks):
+    """Append a piece of a resumable upload: PUT /uploads/<session> with an Offset header.
+
+    Replies {"offset": n} with the bytes received so far, status 409 if Offset was not n.
+    """
+    campaign = request_campaign(headers)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    session = path[len("/uploads/"):] if path.startswith("/uploads/") else ""
+    if campaign.upload_sessions.info(session) is None:
+        return json_response(404, {"message": "Unknown upload session."})
+
+    try:
+        offset, accepted = campaign.upload_sessions.append(session, int(headers.get('Offset', 0)), chunks)
+    except ConnectionError:
+        return None
+    except ValueError as e:
+        return json_response(400, {"message": str(e)})
+    except OSError:
+        return json_response(404, {"message": "Unknown upload session."})
+    return json_response(200 if accepted else 409, {"offset": offset})
+
+
+def api_finish_upload(session, headers):
+    """Move a completed upload into data/. Headers: Size (optional check), ID and Duration as for /upload."""
+    campaign = request_campaign(headers)
+    if campaign is None:
+        return json_response(404, UNKNOWN_CAMPAIGN)
+    info = campaign.upload_sessions.info(session)
+    if info is None:
+        return json_response(404, {"message": "Unknown upload session."})
+    size = headers.get('Size')
+    if size is not None and int(size) != info["offset"]:
+        return json_response(409, {"offset": info["offset"]})
+
+    try:
+        campaign.upload_sessions.finish(session, result_job(headers))
+    except ValueError as e:
+        return json_response(400, {"message": str(e)})
+    except OSError:
+        # Finished by an earlier, retried request
+        return json_response(404, {"message": "Unknown upload session."})
+
+    finish_job(campaign, headers)
+    return text_response(200, "File uploaded and saved successfully")
+
+
+def finish_path(path):
+    """Session id of a POST /uploads/<session>/finish path, None for any other path."""
+    if path.startswith("/uploads/") and path.endswith("/finish"):
+        return path[len("/uploads/"):-len("/finish")]
+    return None
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """Threaded backend (the default): one thread per connection."""
+
+    # Keep-alive, every response carries a Content-Length
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT
+
+    def log_message(self, format, *args):
+        pass  # This disables the default logging
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        # Whether the connection is positioned at the next request, see body_chunks
+        self.body_done = ('chunked' not in self.headers.get('Transfer-Encoding', '').lower()
+                          and self.headers.get('Content-Length', '0') == '0')
+        return True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        started = request_started()
+        try:
+            response = api_get(url.path, parse_qs(url.query), self.headers)
+        finally:
+            request_finished("GET", url.path, started)
+        self.send(response)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        session = finish_path(path)
+        started = request_started()
+        try:
+            if path == "/upload":
+                response = api_upload(self.headers, self.body_chunks())
+            elif path == "/uploads":
+                response = api_open_upload(self.headers)
+            elif session is not None:
+                response = api_finish_upload(session, self.headers)
+            else:
+                response = api_post_json(path, self.headers, lambda: decoded_body(self.body_chunks(), self.headers))
+        finally:
+            request_finished("POST", path, started)
+        self.send(response)
+
+    def do_PUT(self):
+        path = urlsplit(self.path).path
+        started = request_started()
+        try:
+            response = api_append_upload(path, self.headers, self.body_chunks())
+        finally:
+            request_finished("PUT", path, started)
+        self.send(response)
+
+    def send(self, response):
+        if response is None:
+            self.close_connection = True
+            return
+        code, body, content_type, headers = response
+        body, encoding = encode_body(body, self.headers.get('Accept-Encoding', ''))
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        if not self.body_done:
+            # Body left unread, the next request cannot be found
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body_chunks(self):
+        """Yield the request body in pieces of at most UPLOAD_CHUNK_SIZE bytes (Content-Length or chunked)."""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                size_line = self.readline()
+                if not size_line:
+                    raise ConnectionError("Upload ended early")
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the blank line that ends the body
+                    while self.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                yield from self.read_exact(size)
+                self.readline()
+        else:
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                raise ValueError("Content-Length or chunked Transfer-Encoding required")
+            yield from self.read_exact(int(content_length))
+        self.body_done = True
+
+    def readline(self):
+        try:
+            return self.rfile.readline(65537)
+        except TimeoutError:
+            raise ConnectionError("Upload timed out")
+
+    def read_exact(self, remaining):
+        while remaining > 0:
+            try:
+                piece = self.rfile.read(min(remaining, UPLOAD_CHUNK_SIZE))
+            except TimeoutError:
+                raise ConnectionError("Upload timed out")
+            if not piece:
+                raise ConnectionError("Upload ended early")
+            remaining -= len(piece)
+            yield piece
+
+    def end_headers(self):
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        super().end_headers()
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class AsyncBody:
+    """Request body on an AsyncServer connection, read in pieces of at most UPLOAD_CHUNK_SIZE bytes."""
+
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.headers = headers
+        self.chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        # Whether the connection is positioned at the next request
+        self.done = not self.chunked and headers.get('Content-Length', '0') == '0'
+
+    async def chunks(self):
+        if self.chunked:
+            while True:
+                size_line = await self._read(self.reader.readline())
+                if not size_line:
+                    raise ConnectionError("Upload ended early")
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the blank line that ends the body
+                    while await self._read(self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                async for piece in self._exact(size):
+                    yield piece
+                await self._read(self.reader.readline())
+        else:
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                raise ValueError("Content-Length or chunked Transfer-Encoding required")
+            async for piece in self._exact(int(content_length)):
+                yield piece
+        self.done = True
+
+    async def _exact(self, remaining):
+        while remaining > 0:
+            piece = await self._read(self.reader.read(min(remaining, UPLOAD_CHUNK_SIZE)))
+            if not piece:
+                raise ConnectionError("Upload ended early")
+            remaining -= len(piece)
+            yield piece
+
+    async def _read(self, operation):
+        try:
+            return await asyncio.wait_for(operation, IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ConnectionError("Upload timed out")
+
+
+class AsyncServer:
+    """asyncio backend (--backend asyncio): every connection is a coroutine on one event loop.
+
+    Serves the same api_* functions as HTTPHandler. Dispatch requests (/ and
+    /lease) are put on an in-loop queue and answered in order by a single
+    task, so a burst of polling runners costs no threads. Uploads and
+    anything else that touches the disk run in thread pools.
+
+    Offers the part of the socketserver interface main uses: server_address,
+    serve_forever, shutdown and server_close.
+    """
+
+    def __init__(self, address):
+        self.socket = socket.create_server(address, backlog=ASYNC_BACKLOG)
+        self.server_address = self.socket.getsockname()
+        self.executor = ThreadPoolExecutor(ASYNC_WORKERS, thread_name_prefix="api")
+        self.upload_executor = ThreadPoolExecutor(ASYNC_UPLOAD_WORKERS, thread_name_prefix="upload")
+        self.connections = set()
+        self.loop = None
+        self.stopping = None
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.stopped.set()
+
+    def shutdown(self):
+        """Stop serve_forever from another thread and wait until it has returned."""
+        if self.loop is not None and not self.stopped.is_set():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+        self.upload_executor.shutdown(wait=False)
 
-        self.auto_save_thread = threading.Thread(target=self._auto_save_loop, daemon=True)
-        self.auto_save_thread.start()
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.dispatch_queue = asyncio.Queue()
+        self.waiting = {} # Parked long-poll requests: future -> api_dispatch arguments
+        for campaign in campaigns:
+            campaign.experimenter.listeners.append(self._job_available)
+        dispatcher = asyncio.create_task(self._dispatcher())
+        server = await asyncio.start_server(self._connection, sock=self.socket, limit=65537)
+        async with server:
+            await self.stopping.wait()
+            # Idle keep-alive connections would otherwise hold up the close
+            connections = list(self.connections)
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+        for campaign in campaigns:
+            campaign.experimenter.listeners.remove(self._job_available)
+        dispatcher.cancel()
 
-    def _auto_save_loop(self):
-        """Runs in the background and saves state every 15 seconds."""
+    async def _dispatcher(self):
+        """Answer dispatch requests one at a time, in arrival order.
+
+        A long-poll request (Wait header) that finds no job is parked in
+        self.waiting instead of holding anything, and answered by _wake or,
+        once its wait is over, by _expire.
+        """
         while True:
-            time.sleep(15)
-            with self.lock:
-                self.save_state()
+            path, headers, future = await self.dispatch_queue.get()
+            if future.done():
+                continue # Connection dropped while waiting
+            wait = dispatch_wait(headers)
+            computer_name = headers.get('ComputerName', 'Admin')
+            count = int(headers.get('Count', 0))
+            runner = runner_capabilities(headers)
+            campaign = request_campaign(headers)
+            if campaign is None:
+                future.set_result(json_response(404, UNKNOWN_CAMPAIGN))
+                continue
+            try:
+                response = api_dispatch(path, headers.get('ID', '-1'), computer_name, count, None if wait is None else 0, runner, campaign)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if response is None and wait is None:
+                response = json_response(200, RETRY_REPLY) # A relay waiting for its next batch
+            if response is not None:
+                future.set_result(response)
+                continue
+            # The runner's unfinished job (ID) was reset by the call above, not again on retries
+            self.waiting[future] = (path, '-1', computer_name, count, None, runner, campaign)
+            self.loop.call_later(wait, self._expire, future)
 
-    def save_state(self):
-        """Persist current state to disk."""
-        try:
-            # Extract timing info from data_array to persist it
-            timing_info = {}
-            for i, item in enumerate(self.data_array):
-                info = {}
-                if 'Taken At' in item:
-                    info['Taken At'] = item['Taken At']
-                if 'Completed At' in item:
-                    info['Completed At'] = item['Completed At']
-                if info:
-                    timing_info[str(i)] = info
-
-            state = {
-                "completed_array": self.completed_array,
-                "givenToPC": self.givenToPC,
-                "data_index": self.data_index,
-                "logs": self.logs,
-                "stateLogs": self.stateLogs,
-                "timing_info": timing_info
-            }
-            with open(STATE_FILE, 'w') as f:
-                json.dump(state, f)
-        except Exception as e:
-            print(f"Error saving state: {e}")
+    def _wake(self):
+        """Offer requeued jobs to the parked long-poll requests, oldest first."""
+        for future, request in list(self.waiting.items()):
+            if future.done():
+                del self.waiting[future]
+                continue
+            try:
+                response = api_dispatch(*request[:4], 0, *request[5:])
+            except Exception as e:
+                response = e
+            if response is None:
+                continue # Nothing for this one, a later runner may be able to take what there is
+            del self.waiting[future]
+            if isinstance(response, Exception):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
 
-    def load_state(self):
-        """Load state from disk."""
-        if not os.path.exists(STATE_FILE):
-            return False
-        
+    def _expire(self, future):
+        if self.waiting.pop(future, None) is not None and not future.done():
+            future.set_result(json_response(200, RETRY_REPLY))
+
+    def _job_available(self):
+        """Experimenter listener, called on any thread."""
+        self.loop.call_soon_threadsafe(self._wake)
+
+    async def _connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
         try:
-            with open(STATE_FILE, 'r') as f:
-                state = json.load(f)
-            
-            # validation to ensure loaded state matches loaded data size
-            if len(self.data_array) > 0:
-                # Basic validation
-                pass 
-
-            self.completed_array = state.get("completed_array", [])
-            self.givenToPC = state.get("givenToPC", [])
-            self.data_index = state.get("data_index", [0])
-            self.logs = state.get("logs", [])
-            self.stateLogs = state.get("stateLogs", [])
-
-            # Restore timing info to data_array
-            timing_info = state.get("timing_info", {})
-            for idx_str, info in timing_info.items():
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+
+                connection = headers.get('Connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                body = AsyncBody(reader, headers)
                 try:
-                    idx = int(idx_str)
-                    if 0 <= idx < len(self.data_array):
-                        self.data_array[idx].update(info)
-                except ValueError:
-                    pass
+                    response = await self._handle(method, target, headers, body)
+                except ConnectionError:
+                    break
+                except Exception as e:
+                    print(f"Error handling {method} {target}: {e!r}")
+                    response = text_response(500, "Internal server error")
+                    keep_alive = False
 
-            print(f"State loaded from {STATE_FILE}")
-            return True
-        except Exception as e:
-            print(f"Error loading state: {e}")
-            return False
+                if response is None:
+                    break
+                if not body.done:
+                    keep_alive = False # Body left unread, the next request cannot be found
+                await self._send(writer, response, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass # Server shutting down
+        finally:
+            self.connections.discard(task)
+            writer.close()
 
-    def stateLog(self, newState, index, sentTo="Null"):
-        self.stateLogs.append({"state": newState, "index": index, "ID": len(self.stateLogs), "sentTo": sentTo})
-    
-    def getExperiment(self, ID, computer_name):
-        with self.lock:
-            last = self.data_index.pop()
-            
-            if not self.data_index:
-                self.data_index.append(last + 1)
-            
-            if(ID != '-1'):
-                # Ensure array bounds
-                if int(ID) - 1 < len(self.completed_array):
-                    if(not self.completed_array[int(ID) - 1]):
-                        self.stateLog("Reset", int(ID))
-                        print(f"Resetting data {int(ID) + 1} for {computer_name} due to new request.")
-                        log(f"Reset index {int(ID) + 1} by {computer_name}")
-                        self.data_index.append(int(ID))
-                        self.givenToPC[int(ID)] = 'Reset'
-                        self.completed_array[int(ID)] = False
-                    
-            if last < len(self.data_array):
-                self.data_array[last]['Taken At'] = time.strftime('%Y-%m-%d %H:%M:%S')
-                response_data = self.data_array[last]
-                
-                # Expand tracking arrays if necessary
-                while len(self.givenToPC) <= last:
-                    self.givenToPC.append("Null")
-                while len(self.completed_array) <= last:
-                    self.completed_array.append(False)
-
-                self.givenToPC[last] = computer_name
-                self.completed_array[last] = False
-                
-                self.stateLog("Running", last + 1, computer_name)
-                display_colored_array(self.data_array)
-                log(f"Sent Data on index {last + 1} to {computer_name}")
-                print(f"Data {last+1} has been sent to {computer_name}")
-            else:
-                response_data = {"message": "No more data left."}
-                log(f"Shutting down {computer_name}")
-                print(f'Data Distribution is finished. Extra connections : ', (last - len(self.data_array)))
-            
-            return response_data
-    
-    def complete(self, ID, computer_name):
-        with self.lock:
-            self.stateLog("Finished", int(ID), computer_name)
-            print("ID " + ID + " is finished.")
-            
-            index = int(ID) - 1
-            
-            if 0 <= index < len(self.data_array):
-                self.data_array[index]['Completed At'] = time.strftime('%Y-%m-%d %H:%M:%S')
-            
-            if index >= len(self.completed_array):
-                self.completed_array.extend([False] * (index + 1 - len(self.completed_array)))
-            
-            self.completed_array[index] = True
+    async def _read_request(self, reader):
+        """(method, target, version, headers) of the next request, None once the client is done."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            while request_line in (b'\r\n', b'\n'):
+                request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if not request_line:
+                return None
+            method, target, version = request_line.decode('latin-1').split()
 
-    def reset(self, index):
-        with self.lock:
-            self.stateLog("Reset", index + 1)
-            log(f"Reset index {index + 1} from terminal.")
-            self.data_index.append(index)
-            
-            # Expand if necessary (though reset usually implies it existed)
-            while len(self.givenToPC) <= index:
-                self.givenToPC.append("Null")
-            while len(self.completed_array) <= index:
-                self.completed_array.append(False)
-
-            self.givenToPC[index] = 'Reset'
-            self.completed_array[index] = False
-            
-    def calculate_time_stats(self):
-        fmt = '%Y-%m-%d %H:%M:%S'
-        durations = []
-        
-        with self.lock:
-            # 1. Calculate Active Workers
-            active_workers = 0
-            for i, pc in enumerate(self.givenToPC):
-                if i < len(self.completed_array):
-                    is_working = (pc != "Null" and pc != "Reset" and pc != "PRE")
-                    is_not_done = not self.completed_array[i]
-                    if is_working and is_not_done:
-                        active_workers += 1
-
-            # 2. Collect durations from ALL completed tasks
-            # We look for tasks that have both a 'Taken At' and 'Completed At' timestamp
-            for i, completed in enumerate(self.completed_array):
-                if completed:
-                    item = self.data_array[i]
-                    if 'Taken At' in item and 'Completed At' in item:
-                        try:
-                            start_time = datetime.strptime(item['Taken At'], fmt)
-                            end_time = datetime.strptime(item['Completed At'], fmt)
-                            duration = (end_time - start_time).total_seconds()
-                            
-                            # Sanity check: ensure duration is positive
-                            if duration > 0:
-                                durations.append(duration)
-                        except Exception:
-                            continue
+            lines = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                lines.append(line)
+                if len(lines) > 100:
+                    return None
+        except asyncio.TimeoutError:
+            return None
+        return method, target, version, http.client.parse_headers(io.BytesIO(b''.join(lines) + b'\r\n'))
 
-            # 3. Calculate Stats
-            total_tasks = len(self.data_array)
-            finished_tasks = self.completed_array.count(True)
-            remaining = total_tasks - finished_tasks
-            
-            eta_seconds = 0
-            
-            # We need at least one finished task to calculate average, 
-            # and at least one active worker to process the remaining ones.
-            if len(durations) > 0 and active_workers > 0:
-                # Average wall-clock time it takes for a SINGLE worker to finish ONE task
-                avg_duration_per_task = sum(durations) / len(durations)
-                
-                # System throughput: How many seconds does the SYSTEM take to finish one task?
-                # If 1 task takes 100s, but we have 10 workers, the system finishes a task every 10s.
-                system_seconds_per_task = avg_duration_per_task / active_workers
-                
-                eta_seconds = remaining * system_seconds_per_task
+    async def _handle(self, method, target, headers, body):
+        if method == "OPTIONS":
+            return 200, b"", None, {}
+        path = urlsplit(target).path
+        started = request_started()
+        try:
+            return await self._respond(method, target, headers, body)
+        finally:
+            request_finished(method, path, started)
 
-            return {
-                "eta_seconds": eta_seconds,
-                "remaining": remaining,
-                "window_tasks": len(durations), # Using this to tell UI we have N samples
-                "active_workers": active_workers
-            }
+    async def _respond(self, method, target, headers, body):
+        url = urlsplit(target)
+        path = url.path
+        query = parse_qs(url.query)
 
+        if method == "GET":
+            if is_dispatch(path):
+                future = self.loop.create_future()
+                await self.dispatch_queue.put((path, headers, future))
+                return await future
+            if path in ("/logs", "/status", "/metrics") or path.startswith("/uploads/"):
+                # May read older pages or session files from disk, or take every campaign's lock
+                return await self._run(self.executor, api_get, path, query, headers)
+            return api_get(path, query, headers)
 
-experimenter = Experimenter()
+        chunks = self._sync_chunks(body)
+        if method == "PUT":
+            return await self._run(self.upload_executor, api_append_upload, path, headers, chunks)
 
+        if method == "POST":
+            session = finish_path(path)
+            if path == "/upload":
+                return await self._run(self.upload_executor, api_upload, headers, chunks)
+            if path == "/uploads":
+                return await self._run(self.executor, api_open_upload, headers)
+            if session is not None:
+                return await self._run(self.upload_executor, api_finish_upload, session, headers)
+            return await self._run(self.upload_executor, api_post_json, path, headers, lambda: decoded_body(chunks, headers))
 
+        return text_response(501, f"Unsupported method {method}")
 
+    def _run(self, executor, function, *args):
+        return self.loop.run_in_executor(executor, function, *args)
 
+    def _sync_chunks(self, body):
+        """The body's pieces as a plain iterator for api_* functions running in a pool thread."""
+        pieces = body.chunks()
 
+        async def next_piece():
+            try:
+                return await pieces.__anext__()
+            except StopAsyncIteration:
+                return None
 
-RED = "\033[31m"
-GREEN = "\033[32m"
-YELLOW = "\033[33m"
-Blue = "\033[34m"
-Magenta = "\033[35m"
-Cyan = "\033[36m"
-RESET = "\033[0m"
+        while True:
+            piece = asyncio.run_coroutine_threadsafe(next_piece(), self.loop).result()
+            if piece is None:
+                return
+            yield piece
 
+    async def _send(self, writer, response, request_headers, keep_alive):
+        code, body, content_type, headers = response
+        body, encoding = encode_body(body, request_headers.get('Accept-Encoding', ''))
 
-ROWS_PER_COLUMN = 20  # Number of rows that fit into a single terminal column
-COLUMN_DIST = 30
+        lines = [f"HTTP/1.1 {code} {HTTPStatus(code).phrase}",
+                 f"Date: {email.utils.formatdate(usegmt=True)}"]
+        if content_type is not None:
+            lines.append(f"Content-Type: {content_type}")
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if encoding is not None:
+            lines.append(f"Content-Encoding: {encoding}")
+        lines.append("Vary: Accept-Encoding")
+        lines.append(f"Content-Length: {len(body)}")
+        lines += [f"{name}: {value}" for name, value in CORS_HEADERS.items()]
+        lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
 
-def log(text):
-    current_time = time.strftime('%Y-%m-%d %H:%M:%S')
-    # Logs are append-only, thread safe enough for this purpose
-    experimenter.logs.append({"Text": text, "ID": len(experimenter.logs), "time": current_time})
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
 
-    
 
-class HTTPHandler(BaseHTTPRequestHandler):
-    global experimenter
-    
-    def log_message(self, format, *args):
-        pass  # This disables the default logging
-    
-    def do_GET(self):
-        global experimenter
-        
-        if self.path == "/getNum":
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-            self.wfile.write(str(len(experimenter.data_array)).encode())
-            return
-        
-        if self.path == "/timeStats":
-            stats = experimenter.calculate_time_stats()
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(stats).encode())
+def page_limit(query, default):
+    return max(1, min(int(query.get('limit', [default])[0]), MAX_PAGE_SIZE))
+
+
+def stored_name(file_name):
+    """Name of a result in data/ under the current --compress-results mode."""
+    return file_name + COMPRESSION_SUFFIXES.get(RESULT_COMPRESSION, "")
+
+
+def fsync_directory(directory):
+    """Make the renames, creations and deletions in `directory` survive a crash. Windows has no such call."""
+    if os.name == "nt":
+        return
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def scan_result_ids(directory):
+    """Job ids of every result file in `directory` and its shard directories."""
+    for entry in os.scandir(directory):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            yield from scan_result_ids(entry.path)
+        else:
+            ident = result_id(entry.name)
+            if ident is not None:
+                yield ident
+
+
+def read_layout(directory):
+    """Shard size recorded in `directory`/.layout.json, 0 (flat) if there is none."""
+    try:
+        with open(os.path.join(directory, LAYOUT_FILE)) as f:
+            return int(json.load(f).get("shard_size", 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def write_layout(directory, shard_size):
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, LAYOUT_FILE + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump({"shard_size": shard_size}, f)
+    os.replace(tmp_path, os.path.join(directory, LAYOUT_FILE))
+
+
+def result_id(file_name):
+    """Job id of a result file: the last number in its name (exp-12.mat -> 12), None if there is none."""
+    match = re.search(r'(\d+)\D*$', file_name)
+    return int(match.group(1)) if match else None
+
+
+def result_dir(directory, file_name, shard_size):
+    """Directory a result belongs in: `directory` when flat, else the shard of its id (data/000012 for ids 12000-12999 at 1000)."""
+    ident = result_id(file_name) if shard_size else None
+    if ident is None:
+        return directory
+    return os.path.join(directory, f"{ident // shard_size:06d}")
+
+
+def content_encoding(header):
+    """Normalise a Content-Encoding header to None, "gzip" or "zstd". ValueError for anything else."""
+    encoding = (header or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return "gzip"
+    if encoding == "zstd" and zstandard is not None:
+        return "zstd"
+    raise ValueError(f"Unsupported Content-Encoding '{encoding}'")
+
+
+def accepted_encoding(header):
+    """Best encoding the client lists in Accept-Encoding, or None."""
+    accepted = set()
+    for item in header.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip())
+    if "zstd" in accepted and zstandard is not None:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compressor(encoding):
+    """Streaming compressor for `encoding`, None for no compression."""
+    if encoding is None:
+        return None
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def decompressor(encoding):
+    """Streaming decompressor for `encoding`, None for no compression."""
+    if encoding is None:
+        return None
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+def transcode(chunks, decoder, encoder, keep_input=False):
+    """Decode and/or encode a stream of chunks. Corrupt or truncated input raises ValueError.
+
+    With keep_input the chunks come out unchanged and the decoder only checks them.
+    """
+    try:
+        for chunk in chunks:
+            if keep_input:
+                decoder.decompress(chunk)
+                yield chunk
+                continue
+            if decoder is not None:
+                chunk = decoder.decompress(chunk)
+            if encoder is not None:
+                chunk = encoder.compress(chunk)
+            if chunk:
+                yield chunk
+        tail = b""
+        if decoder is not None:
+            tail = decoder.flush()
+            if not getattr(decoder, "eof", True):
+                raise ValueError("Compressed body is truncated")
+        if keep_input:
             return
-        
-        
-        if self.path == "/logs":
-            last_log = int(self.headers.get('lastLog', len(experimenter.logs) - 6))
-            if(last_log <= len(experimenter.logs) - 6):
-                relevant_logs = experimenter.logs[-30:]
+        if encoder is not None:
+            tail = encoder.compress(tail) + encoder.flush()
+        if tail:
+            yield tail
+    except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+        raise ValueError(f"Invalid compressed body: {e}")
+
+
+class FixedSum:
+    """Constraint for generate_combined_data: keep only combinations whose `keys` add up to `total`.
+
+    The valid value tuples of those keys are enumerated directly (pruning on
+    the smallest and largest sums still reachable), so the rejected
+    combinations are never visited.
+    """
+
+    def __init__(self, keys, total):
+        self.keys = list(keys)
+        self.total = total
+
+    def applies_to(self, params):
+        return all(key in params for key in self.keys)
+
+    def accepts(self, job):
+        return sum(job[key] for key in self.keys) == self.total
+
+    def enumerate(self, value_lists):
+        """Valid tuples, in the order itertools.product would yield them."""
+        if not all(value_lists):
+            return []
+        lows = [min(values) for values in value_lists] + [0]
+        highs = [max(values) for values in value_lists] + [0]
+        # Smallest/largest sum reachable by the keys after position i
+        rest_low = list(itertools.accumulate(reversed(lows), initial=0))[::-1][1:]
+        rest_high = list(itertools.accumulate(reversed(highs), initial=0))[::-1][1:]
+
+        valid = []
+        def walk(i, partial, chosen):
+            if i == len(value_lists):
+                if partial == self.total:
+                    valid.append(tuple(chosen))
+                return
+            for value in value_lists[i]:
+                reached = partial + value
+                if reached + rest_low[i] <= self.total <= reached + rest_high[i]:
+                    chosen.append(value)
+                    walk(i + 1, reached, chosen)
+                    chosen.pop()
+        walk(0, 0, [])
+        return valid
+
+
+class ValueRange:
+    """Constraint for generate_combined_data: keep only values of `key` within [low, high]."""
+
+    def __init__(self, key, low=None, high=None):
+        self.key = key
+        self.low = low
+        self.high = high
+
+    def applies_to(self, params):
+        return self.key in params
+
+    def accepts(self, job):
+        value = job[self.key]
+        return (self.low is None or value >= self.low) and (self.high is None or value <= self.high)
+
+    def restrict(self, values):
+        return [value for value in values if self.accepts({self.key: value})]
+
+
+class ParameterJob(dict):
+    """The parameters of one job, as a ParameterBranch hands them out.
+
+    A plain dict, except that changing it in place makes the branch keep it
+    and return this very dict from then on instead of decoding the job
+    again, so parameter files that edit data_array after generating it work
+    as they did with a list. Only the jobs that were changed stay in memory.
+    """
+
+    __slots__ = ("branch", "offset")
+
+    def _changed(self):
+        self.branch.changed[self.offset] = self
+
+    def __reduce__(self):
+        return dict, (dict(self),) # Copies and pickles are plain dicts, not tied to the branch
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        super().__ior__(other)
+        self._changed()
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return super().__getitem__(key)
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+class ParameterBranch:
+    """Cartesian product of one parameter dict, decoded on demand.
+
+    Position -> parameters is mixed-radix arithmetic over the value lists,
+    with the last key varying fastest, which is the order the recursive
+    generate_combinations produces. Keys tied together by a FixedSum that sit
+    next to each other form a single dimension holding their valid value
+    tuples; any other constraint is checked like `where`. A `where` predicate
+    is evaluated once over the whole space, keeping only the positions it
+    accepts; `transform` is applied to each job as it is decoded. Either way
+    the jobs come out in the same order as filtering the full product would.
+    Jobs changed in place or assigned after generation are kept in `changed`
+    and returned instead of being decoded (see ParameterJob).
+    """
+
+    def __init__(self, params, first_id, constraints=(), where=None, transform=None):
+        self.keys = list(params.keys())
+        self.first_id = first_id
+        self.transform = transform
+        self.changed = {} # offset -> job dict edited or assigned by the parameter file
+
+        values = {key: v if isinstance(v, (list, tuple, range)) else list(v) for key, v in params.items()}
+        constraints = [c for c in constraints if c.applies_to(params)]
+        for constraint in constraints:
+            if isinstance(constraint, ValueRange):
+                values[constraint.key] = constraint.restrict(values[constraint.key])
+
+        # Dimensions: (keys, values) where a FixedSum group has several keys and tuple values
+        grouped = {}
+        checks = []
+        for constraint in constraints:
+            if isinstance(constraint, FixedSum):
+                start = self.keys.index(constraint.keys[0])
+                if self.keys[start:start + len(constraint.keys)] == constraint.keys:
+                    grouped[constraint.keys[0]] = constraint
+                else:
+                    checks.append(constraint.accepts)
+        if checks:
+            user_where = where
+            where = lambda job: all(check(job) for check in checks) and (user_where is None or user_where(job))
+        skipped = {key for c in grouped.values() for key in c.keys[1:]}
+        self.dims = []
+        for key in self.keys:
+            if key in grouped:
+                group = grouped[key]
+                self.dims.append((tuple(group.keys), group.enumerate([values[k] for k in group.keys])))
+            elif key not in skipped:
+                self.dims.append(((key,), values[key]))
+
+        self.positions = None
+        if where is not None:
+            self.positions = self._scan(where)
+        self.size = len(self.positions) if self.positions is not None else math.prod(len(v) for _, v in self.dims)
+
+    def __len__(self):
+        return self.size
+
+    def _fill(self, job, combo, dims=None):
+        for (keys, _), value in zip(self.dims if dims is None else dims, combo):
+            if len(keys) == 1:
+                job[keys[0]] = value
             else:
-                relevant_logs = experimenter.logs[last_log+1:last_log+5]
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(relevant_logs).encode())
-            return
-            
-        if self.path == "/status":
-            last_log = int(self.headers.get('lastLog', len(experimenter.logs) - 6))
-            relevant_logs = experimenter.stateLogs[last_log+1:]
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(relevant_logs).encode())
+                job.update(zip(keys, value))
+        return job
+
+    def _decode(self, position):
+        combo = []
+        for _, values in reversed(self.dims):
+            position, digit = divmod(position, len(values))
+            combo.append(values[digit])
+        return self._fill({}, reversed(combo))
+
+    def _scan(self, where):
+        """Positions accepted by `where`. One dict is reused for every candidate, so do not keep it."""
+        positions = array.array('q')
+        job = {}
+        for position, combo in enumerate(itertools.product(*(v for _, v in self.dims))):
+            candidate = self._fill(job, combo)
+            if where(candidate):
+                positions.append(position)
+        return np.frombuffer(positions, dtype=np.int64) if positions else np.zeros(0, dtype=np.int64)
+
+    def _finish(self, job, offset):
+        job['id'] = self.first_id + offset
+        if self.transform is not None:
+            job = self.transform(job) or job
+        job = ParameterJob(job)
+        job.branch, job.offset = self, offset
+        return job
+
+    def __getitem__(self, offset):
+        job = self.changed.get(offset)
+        if job is not None:
+            return job
+        position = int(self.positions[offset]) if self.positions is not None else offset
+        return self._finish(self._decode(position), offset)
+
+    def __setitem__(self, offset, job):
+        if not 0 <= offset < self.size:
+            raise IndexError("data_array index out of range")
+        self.changed[offset] = job
+
+    def __iter__(self):
+        changed = self.changed
+        if self.positions is not None:
+            for offset, position in enumerate(self.positions.tolist()):
+                job = changed.get(offset)
+                yield job if job is not None else self._finish(self._decode(position), offset)
             return
-            
-        if self.path == "/info":
-            index = int(self.headers.get('index', 0)) - 1
-            response = experimenter.data_array[index] if 0 <= index < len(experimenter.data_array) else {"text": "Invalid ID"}
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(response, indent=2).encode())
+        for offset, combo in enumerate(itertools.product(*(v for _, v in self.dims))):
+            job = changed.get(offset)
+            yield job if job is not None else self._finish(self._fill({}, combo), offset)
+
+    def evaluate(self, code):
+        """A compiled expression over the parameters for every job of the branch, without building the jobs.
+
+        The expression is evaluated once per combination of the values of the
+        keys it uses (so once for the whole branch if it only uses keys with a
+        single value) and spread to the jobs by their mixed-radix digits. An
+        expression using "id" is instead evaluated once, elementwise, with the
+        keys bound to numpy arrays. Jobs in `changed` are evaluated one by
+        one. Returns a float array.
+        """
+        names = set(code.co_names)
+        offsets = np.arange(self.size, dtype=np.int64)
+        positions = self.positions if self.positions is not None else offsets
+        used = [] # (dim, digit of every job) of the dims the expression uses
+        stride = 1
+        for keys, values in reversed(self.dims):
+            if names.intersection(keys):
+                used.append(((keys, values), positions // stride % len(values)))
+            stride *= len(values)
+
+        if "id" in names:
+            namespace = {"id": self.first_id + offsets}
+            for (keys, values), digits in used:
+                for column, key in enumerate(keys):
+                    namespace[key] = np.asarray([value[column] for value in values] if len(keys) > 1 else values)[digits]
+            result = np.asarray(eval(code, dict(EXPRESSION_GLOBALS), namespace), dtype=np.float64)
+            return self._evaluate_changed(code, np.broadcast_to(result, (self.size,)).copy())
+
+        combination = np.zeros(self.size, dtype=np.int64)
+        radix = 1
+        for (keys, values), digits in used:
+            combination += digits * radix
+            radix *= len(values)
+        results = np.empty(radix, dtype=np.float64)
+        for index, combo in enumerate(itertools.product(*(values for (_, values), _ in reversed(used)))):
+            results[index] = eval(code, dict(EXPRESSION_GLOBALS), self._fill({}, combo, [dim for dim, _ in reversed(used)]))
+        return self._evaluate_changed(code, results[combination])
+
+    def _evaluate_changed(self, code, values):
+        for offset, job in self.changed.items():
+            values[offset] = eval(code, dict(EXPRESSION_GLOBALS), job)
+        return values
+
+
+class ParameterSpace:
+    """Lazy stand-in for the data_array list built by generate_combined_data.
+
+    Holds the branches (and any plain lists it was concatenated with) and
+    builds the parameter dict of a job only when it is indexed or iterated,
+    so len(), indexing, slicing, iteration, `+`, item assignment, append and
+    extend behave like the old list without materialising every combination
+    up front.
+    """
+
+    def __init__(self, parts=()):
+        self.parts = []
+        self.offsets = [] # Position of the first job of each part
+        self.size = 0
+        for part in parts:
+            self._append(part)
+
+    def _append(self, part):
+        if isinstance(part, ParameterSpace):
+            for inner in part.parts:
+                self._append(inner)
             return
-            
-        if self.path == "/reset":
-            index = int(self.headers.get('index', 0)) - 1
-            response = {"text": "Reset Success"} if 0 <= index < len(experimenter.data_array) else {"text": "Invalid ID"}
-            
-            # Use the thread-safe reset method instead of direct access
-            if 0 <= index < len(experimenter.data_array):
-                print(f"Resetting data {index + 1} because of webpage.")
-                log(f"Reset index {index + 1} from webpage")
-                experimenter.reset(index)
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(response, indent=2).encode())
+        if len(part) == 0:
             return
+        if isinstance(part, list):
+            part = list(part) # Assigning into data_array must not change the caller's list, as with `+` on lists
+        self.parts.append(part)
+        self.offsets.append(self.size)
+        self.size += len(part)
 
-        
-        computer_name = self.headers.get('ComputerName', 'Admin')
-        ID = self.headers.get('ID', '-1')
-        
-        response_data = experimenter.getExperiment(ID, computer_name)
-        
-        response_json = json.dumps(response_data)
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(response_json.encode('utf-8'))
-
-    def do_POST(self):
-        # try:
-            computer_name = self.headers.get('ComputerName', 'Null')
-            ID = self.headers.get('ID', '-1')
-            if(ID != '-1'):
-                experimenter.complete(ID, computer_name)
-                
-            content_length = int(self.headers['Content-Length'])
-            if content_length <= 0:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"No content received.")
-                return
+    def __len__(self):
+        return self.size
 
-            post_data = self.rfile.read(content_length).decode('utf-8')
-            json_data = json.loads(post_data)
+    def _locate(self, index):
+        """(part, offset in it) of job `index`."""
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("data_array index out of range")
+        part = bisect.bisect_right(self.offsets, index) - 1
+        return self.parts[part], index - self.offsets[part]
 
-            file_name = json_data.get('file_name')
-            file_content_base64 = json_data.get('file')
-            
-            if not os.path.exists("data"):
-                os.makedirs("data")
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        part, offset = self._locate(index)
+        return part[offset]
 
-            if not file_name or not file_content_base64:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Missing 'file_name' or 'file' in JSON payload")
-                return
+    def __setitem__(self, index, job):
+        part, offset = self._locate(index)
+        part[offset] = job
 
-            try:
-                file_content = base64.b64decode(file_content_base64)
-            except Exception as e:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Invalid Base64 content in 'file'")
-                return
+    def append(self, job):
+        self._append([job])
 
-            with open("data/" + file_name, 'wb') as f:
-                f.write(file_content)
+    def extend(self, jobs):
+        self._append(list(jobs))
 
-            display_colored_array(experimenter.data_array)
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"File uploaded and saved successfully")
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
 
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, lastLog, index')
-        super().end_headers()
+    def __add__(self, other):
+        if not isinstance(other, (ParameterSpace, list)):
+            return NotImplemented
+        return ParameterSpace([self, other])
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.end_headers()
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return ParameterSpace([other, self])
 
 
 # ChatGPT generated this. When an input object with arrays for parameters is given in,
@@ -438,18 +4070,25 @@ def merge_objects(dict1, dict2):
     return merged
     
 
-def generate_combined_data(shared_params, id_counter, *param_sets):
-    combined_data_array = []
+def generate_combined_data(shared_params, id_counter, *param_sets, constraints=(), where=None, transform=None):
+    """Returns a lazy ParameterSpace over every branch, plus the next free id.
+
+    constraints: FixedSum / ValueRange objects, enumerated directly.
+    where: predicate on a job's raw parameters; rejected jobs get no id.
+    transform: called on each job as it is built; may edit it in place or return a new dict.
+    """
+    branches = []
 
     for params in param_sets:
-        temp_data_array, id_counter = generate_combinations(merge_objects(shared_params, params), id_counter)
-        combined_data_array += temp_data_array
+        branch = ParameterBranch(merge_objects(shared_params, params), id_counter, constraints, where, transform)
+        id_counter += len(branch)
+        branches.append(branch)
 
-    return combined_data_array, id_counter
+    return ParameterSpace(branches), id_counter
 
 
 def print_list_as_json(lst):
-    json_str = json.dumps(lst, indent=4)
+    json_str = json.dumps(list(lst), indent=4)
     with open("listJson.json", "w") as file:
         file.write(json_str)
    
@@ -458,44 +4097,144 @@ def display_colored_array(data_array):
     # Visualization logic omitted for brevity as per original file
    
 def start_server(server, port):
-    log("Server Started")
+    for campaign in campaigns:
+        campaign.experimenter.log("Server Started")
     print(f"Server running on {server.server_address[0]}:{port}")
     server.serve_forever()
 
-def check_missing_files(directory, max_number):
-    missing_count = 0
-    lastNonMissing = -1
-    for i in range(1, max_number + 1):
-        file_name = f"exp-{i}.mat"
-        file_path = os.path.join(directory, file_name)
-        if not os.path.isfile(file_path):
-            missing_count += 1
-        else:
-            lastNonMissing = i
+def parse_campaign(spec):
+    """NAME=FILE[:WEIGHT] from --campaign, as (name, file, weight)."""
+    name, _, data_file = spec.partition("=")
+    weight = 1.0
+    head, _, tail = data_file.rpartition(":")
+    if head and re.fullmatch(r'\d+(\.\d*)?', tail):
+        data_file, weight = head, float(tail)
+    if not re.fullmatch(r'\w[\w.-]*', name) or not data_file or weight <= 0:
+        raise ValueError(f"--campaign {spec!r} is not NAME=FILE[:WEIGHT]")
+    return name, data_file, weight
+
+def apply_dispatch_options(experimenter, args):
+    experimenter.lease_target = args.lease_target
+    experimenter.max_lease = args.max_lease
+    experimenter.lease_timeout = args.lease_timeout
+    experimenter.speculate = args.speculate
+
+def start_campaign(campaign, data_file, args):
+    """Open the campaign's stores, run its parameter file and queue its jobs as the command line says."""
+    experimenter = campaign.experimenter
+    apply_dispatch_options(experimenter, args)
+    data_dir = campaign.data_dir
+
+    campaign.shard_size = read_layout(data_dir)
+    if args.shard_size is not None and args.shard_size != campaign.shard_size:
+        if os.path.isdir(data_dir) and any(not entry.name.startswith('.') for entry in os.scandir(data_dir)):
+            print(f"{data_dir}/ already holds results stored with shard size {campaign.shard_size}. "
+                  f"Convert it with: python ../utility/migrate_layout.py --data-dir {data_dir} --shard-size {args.shard_size}")
+            exit()
+        write_layout(data_dir, args.shard_size)
+        campaign.shard_size = args.shard_size
+
+    # Results packed earlier stay visible to --cont even when writing files now
+    if RESULT_STORE == "packed" or os.path.isdir(campaign.segment_store.directory):
+        campaign.segment_store.open()
+    os.makedirs(data_dir, exist_ok=True)
+    campaign.completion_index.open(campaign.segment_store)
+
+    # The dashboard state log is rebuilt from the job states, text logs carry on with --cont
+    experimenter.logs.start(resume=args.cont)
+    experimenter.stateLogs.start(resume=False)
+    campaign.upload_sessions.purge(UPLOAD_SESSION_TTL)
+
+    # Execute the parameter file; it needs access to the global helper functions defined above
+    with open(data_file, "r") as f:
+        code = f.read()
+    namespace = dict(globals(), id_counter=1)
+    exec(code, namespace)
+    data_array = namespace["data_array"]
+    experimenter.load_data(data_array)
+
+    # State Initialization Logic
+    loaded = False
+    if args.cont:
+        # Try loading from JSON first
+        loaded = experimenter.load_state()
+        if not loaded:
+            print(f"No state file found. Checking '{data_dir}/' directory for existing results...")
+            check_missing_files(campaign, len(data_array) + 1)
+    else:
+        # Manual Index Start
+        index = args.index
+        if index < 0: index = 0
+        
+        # Mark previous as done implicitly
+        experimenter.jobs.mark_pre(0, index)
+        for i in range(1, index + 1):
+            experimenter.stateLog("Finished", i, "PRE")
+
+    # Each node starts with its own slice of the ids; a saved state already records who owns what
+    if node is not None:
+        try:
+            node.claim(campaign.directory)
+        except ValueError as e:
+            print(e)
+            exit()
+    if node is not None and not loaded:
+        start, stop = node.id_range(len(data_array))
+        experimenter.claim_range(start, stop)
+        print(f"Node {node.index} of {len(node.urls)}: ids {start + 1} to {stop}")
+
+    # Queue everything that is left, in the order of the scheduler
+    cost = args.cost or namespace.get("job_cost")
+    if cost is None and len(data_array) and "cost" in data_array[0]:
+        cost = "cost"
+    try:
+        costs = job_costs(data_array, cost) if cost is not None else None
+    except Exception as e:
+        print(f"Cannot compute job costs from {cost!r}: {e}")
+        exit()
+    make_scheduler = lambda: SCHEDULERS[args.schedule](costs)
+
+    # Jobs with resource requirements only go to runners that can take them
+    requirements = namespace.get("job_requirements")
+    if requirements is None and len(data_array) and "requirements" in data_array[0]:
+        requirements = lambda job: job["requirements"]
+    if requirements is not None:
+        try:
+            job_class, classes = requirement_classes(data_array, requirements)
+        except Exception as e:
+            print(f"Cannot compute job requirements: {e}")
+            exit()
+        experimenter.scheduler = RoutedScheduler(make_scheduler, job_class, classes)
+        print(f"Routing {len(classes)} requirement classes by runner capabilities")
+    else:
+        experimenter.scheduler = make_scheduler()
+    experimenter.start_queue()
+    if costs is not None:
+        print(f"Scheduling by {cost!r} ({args.schedule}), total cost {costs.sum():g}")
+
+    # Start the journal from a fresh checkpoint of the initial state
+    experimenter.save_state()
+
+def check_missing_files(campaign, max_number):
+    experimenter = campaign.experimenter
+    # Which ids have results comes from the completion index, not from a lookup per file
+    found = campaign.completion_index.completed(max_number)
+    found_ids = np.flatnonzero(found[1:]) + 1
+    lastNonMissing = int(found_ids[-1]) if len(found_ids) else -1
        
     print(f"Last Index found on disk: {lastNonMissing}")
     
-    experimenter.data_index.append(lastNonMissing)
-    if(experimenter.data_index[-1] < 0):
-        experimenter.data_index[-1] = 0
+    lastNonMissing = max(lastNonMissing, 0)
     
     # Mark everything up to last found file as complete
     # Using direct access here for bulk initialization before server start
-    while len(experimenter.completed_array) < experimenter.data_index[-1]:
-        experimenter.completed_array.append(True)
-        experimenter.givenToPC.append("PRE")
-        
-    for i in range(0, experimenter.data_index[-1]):
-        experimenter.completed_array[i] = True
-        experimenter.givenToPC[i] = "PRE"
+    experimenter.jobs.mark_pre(0, lastNonMissing)
+    for i in range(0, lastNonMissing):
         experimenter.stateLog("Finished", i + 1, "PRE")
 
     # Double check gaps
-    for i in range(1, lastNonMissing):
-        file_name = f"exp-{i}.mat"
-        file_path = os.path.join(directory, file_name)
-        if not os.path.isfile(file_path):
-            experimenter.reset(i-1) # reset uses 0-based index
+    for i in np.flatnonzero(~found[1:max(lastNonMissing, 1)]) + 1:
+        experimenter.reset(int(i) - 1) # reset uses 0-based index
 
 if __name__ == "__main__":
     print("\033[2J\033[H", end="")
@@ -503,9 +4242,25 @@ if __name__ == "__main__":
     # Argparse Setup
     parser = argparse.ArgumentParser(description="Distributed Experiment Server")
     parser.add_argument("--file", type=str, help="The python file containing parameter definitions (e.g., parameters_msga.py)")
+    parser.add_argument("--nodes", type=str, help="Share the campaign between several servers: their base URLs (http://host:port), comma-separated, in the same order on every node")
+    parser.add_argument("--node-index", type=int, default=0, help="Position of this server in --nodes (default: 0)")
+    parser.add_argument("--relay", type=str, metavar="URL", help="Serve the runners of this site from jobs leased in batches from the server at URL (http://host:port), forwarding their results in bulk; replaces --file")
+    parser.add_argument("--relay-batch", type=int, default=RELAY_BATCH, help=f"Jobs a relay keeps queued for its runners (default: {RELAY_BATCH})")
+    parser.add_argument("--campaign", action="append", metavar="NAME=FILE[:WEIGHT]", help=f"Run several parameter files at once, each in {CAMPAIGN_DIR}/NAME, sharing the runners in proportion to WEIGHT (default 1). Repeat for each campaign; replaces --file")
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to run the server on (default: {DEFAULT_PORT})")
     parser.add_argument("--cont", action="store_true", help="Continue from previous state (Load JSON state or check existing files)")
     parser.add_argument("--index", type=int, default=0, help="Start from a specific index (if not using --cont)")
+    parser.add_argument("--lease-target", type=float, default=LEASE_TARGET_SECONDS, help=f"Seconds of work a /lease batch should cover (default: {LEASE_TARGET_SECONDS})")
+    parser.add_argument("--max-lease", type=int, default=MAX_LEASE_SIZE, help=f"Upper bound on jobs per /lease batch (default: {MAX_LEASE_SIZE})")
+    parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT, help="Requeue a job if its runner sends no /heartbeat for this many seconds (default: 0, never)")
+    parser.add_argument("--shard-size", type=int, help="Store results in data/ in subdirectories of this many ids (0 = flat). Existing results must be converted with utility/migrate_layout.py first")
+    parser.add_argument("--store", choices=["files", "packed"], default="files", help="Write each result to its own file in data/ (default), or append them to segment files in data/.packed")
+    parser.add_argument("--schedule", choices=list(SCHEDULERS), default="lpt", help="Order of handing out jobs: lpt = most expensive first (default), fifo = by id. Both go by id when jobs have no cost")
+    parser.add_argument("--cost", type=str, help="Cost of a job as an expression over its parameters, e.g. \"maxFE * repeat\" (default: job_cost from the parameter file, else the job's 'cost' field)")
+    parser.add_argument("--speculate", action="store_true", help=f"Once nothing is queued, give idle runners backup copies of jobs running over {SPECULATE_FACTOR:g}x the median duration; the first result counts")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help=f"Close a kept-alive connection after this many seconds without a request (default: {IDLE_TIMEOUT})")
+    parser.add_argument("--backend", choices=["threaded", "asyncio"], default="threaded", help="HTTP server: a thread per connection (default), or one asyncio event loop for many concurrent runners")
+    parser.add_argument("--compress-results", choices=["gzip", "zstd"], help="Store results in data/ compressed (.gz / .zst); read them with utility/result_io.py")
     
     # Print help if no args provided
     if len(sys.argv) == 1:
@@ -516,72 +4271,106 @@ if __name__ == "__main__":
     
     data_file = args.file
     should_load = False
+    if args.compress_results == "zstd" and zstandard is None:
+        print("--compress-results zstd needs the 'zstandard' package.")
+        exit()
+    RESULT_COMPRESSION = args.compress_results
+    IDLE_TIMEOUT = HTTPHandler.timeout = args.idle_timeout
+    RESULT_STORE = args.store
 
-    # File Selection Logic (Interactive Fallback)
-    if not data_file:
-        id_counter = 1
-        py_files = [f for f in os.listdir('.') if os.path.isfile(f) and f.endswith('.py') and f != os.path.basename(__file__)]
+    if args.nodes:
+        if args.campaign:
+            print("--nodes shares a single campaign, it cannot be combined with --campaign.")
+            exit()
+        urls = [url.strip().rstrip('/') for url in args.nodes.split(',') if url.strip()]
+        if not 0 <= args.node_index < len(urls):
+            print(f"--node-index must be between 0 and {len(urls) - 1}.")
+            exit()
+        node = Node(None, args.node_index, urls)
 
-        if not py_files:
-            print("No Python files found, starting with empty data.")
-        else:
-            if len(py_files) == 1:
-                data_file = py_files[0]
-                print(f"Found only one Python file: {data_file}")
-                should_load = input(f"Do you want to load data from {data_file}? (Y/n): ").strip().lower()
-                should_load = should_load in ("", "yes", "y")
-            else:
-                print("Multiple Python files found:")
-                for idx, file in enumerate(py_files, start=1):
-                    print(f"{idx}. {file}")
-                while True:
-                    try:
-                        choice = int(input("Choose a file to load (enter the number): ").strip())
-                        if 1 <= choice <= len(py_files):
-                            data_file = py_files[choice - 1]
-                            should_load = input(f"Do you want to load data from {data_file}? (Y/n): ").strip().lower()
-                            should_load = should_load in ("", "yes", "y")
-                            break
-                        else:
-                            print("Invalid selection.")
-                    except ValueError:
-                        print("Invalid input. Please enter a number.")
+    if args.relay:
+        if args.file or args.campaign or args.nodes or args.cont or args.index:
+            print("--relay takes its jobs from upstream, it cannot be combined with --file, --campaign, --nodes, --cont or --index.")
+            exit()
+        if RESULT_STORE == "packed":
+            print("A relay forwards results as files, --store packed does not apply.")
+            exit()
+        relay = Relay(args.relay.strip().rstrip('/'), f"relay@{socket.gethostname()}", max(2, args.relay_batch))
+        try:
+            for campaign in relay.mirror():
+                apply_dispatch_options(campaign.experimenter, args)
+                campaigns.add(campaign)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot reach the upstream server at {relay.upstream}: {e}")
+            exit()
+        campaign = campaigns.get()
+        print(f"Relaying {len(campaigns)} campaign(s) from {relay.upstream} as {relay.name}")
+        relay.start()
+    elif args.campaign:
+        # Several campaigns, each in its own directory, sharing the runners
+        for spec in args.campaign:
+            try:
+                name, campaign_file, weight = parse_campaign(spec)
+            except ValueError as e:
+                print(e)
+                exit()
+            if campaigns.get(name) is not None:
+                print(f"Campaign {name} is given twice.")
+                exit()
+            print(f"Campaign {name}: {campaign_file} (weight {weight:g})")
+            campaign = Campaign(name, os.path.join(CAMPAIGN_DIR, name), weight)
+            start_campaign(campaign, campaign_file, args)
+            campaigns.add(campaign)
+        campaign = campaigns.get()
     else:
-        should_load = True
+        # File Selection Logic (Interactive Fallback)
+        if not data_file:
+            id_counter = 1
+            py_files = [f for f in os.listdir('.') if os.path.isfile(f) and f.endswith('.py') and f != os.path.basename(__file__)]
 
-    if not should_load:
-        print("No parameters. No experiments.")
-        exit()
-        
-    # Execute the parameter file
-    id_counter = 1
-    with open(data_file, "r") as f:
-        code = f.read()
-    
-    # 'exec' needs access to the global helper functions defined above
-    exec(code)
-    experimenter.data_array = data_array
+            if not py_files:
+                print("No Python files found, starting with empty data.")
+            else:
+                if len(py_files) == 1:
+                    data_file = py_files[0]
+                    print(f"Found only one Python file: {data_file}")
+                    should_load = input(f"Do you want to load data from {data_file}? (Y/n): ").strip().lower()
+                    should_load = should_load in ("", "yes", "y")
+                else:
+                    print("Multiple Python files found:")
+                    for idx, file in enumerate(py_files, start=1):
+                        print(f"{idx}. {file}")
+                    while True:
+                        try:
+                            choice = int(input("Choose a file to load (enter the number): ").strip())
+                            if 1 <= choice <= len(py_files):
+                                data_file = py_files[choice - 1]
+                                should_load = input(f"Do you want to load data from {data_file}? (Y/n): ").strip().lower()
+                                should_load = should_load in ("", "yes", "y")
+                                break
+                            else:
+                                print("Invalid selection.")
+                        except ValueError:
+                            print("Invalid input. Please enter a number.")
+        else:
+            should_load = True
 
-    # State Initialization Logic
-    if args.cont:
-        # Try loading from JSON first
-        loaded = experimenter.load_state()
-        if not loaded:
-            print("No state file found. Checking 'data/' directory for existing results...")
-            check_missing_files("./data/", len(data_array) + 1)
-    else:
-        # Manual Index Start
-        index = args.index
-        if index < 0: index = 0
-        experimenter.data_index.append(index)
-        
-        # Mark previous as done implicitly
-        for i in range(1, index + 1):
-            experimenter.stateLog("Finished", i, "PRE")
-            experimenter.givenToPC.append("PRE")
-            experimenter.completed_array.append(True)
+        if not should_load:
+            print("No parameters. No experiments.")
+            exit()
+
+        campaign = Campaign()
+        if node is not None:
+            node.campaign = campaign
+        start_campaign(campaign, data_file, args)
+        campaigns.add(campaign)
+        if node is not None:
+            node.start()
 
-    server = ThreadingHTTPServer((DEFAULT_HOST, args.port), HTTPHandler)
+    if args.backend == "asyncio":
+        server = AsyncServer((DEFAULT_HOST, args.port))
+    else:
+        server = ThreadingHTTPServer((DEFAULT_HOST, args.port), HTTPHandler)
 
     server_thread = threading.Thread(target=start_server, args=(server, args.port), daemon=True)
     server_thread.start()
@@ -589,14 +4378,26 @@ if __name__ == "__main__":
     try:
         while True:
             user_input = input()
+            # Commands act on the campaign chosen with `use <name>`, the first one to begin with
+            experimenter = campaign.experimenter
             if user_input.lower() == 'quit':
                 print("Shutting down the server...")
                 break
+            elif user_input == 'campaigns':
+                for status in (c.status() for c in campaigns):
+                    print(f"{status['name'] or '(default)'}: weight {status['weight']:g}, {status['finished']}/{status['total']} finished, {status['running']} running")
+            elif user_input.startswith('use '):
+                chosen = campaigns.get(user_input.split()[1])
+                if chosen is None:
+                    print("Unknown campaign.")
+                else:
+                    campaign = chosen
+                    print(f"Commands now apply to campaign {campaign.name}.")
             elif user_input.startswith('print '):
                 try:
                     index = int(user_input.split()[1]) - 1
                     if 0 <= index < len(experimenter.data_array):
-                        print(json.dumps(experimenter.data_array[index], indent=2))
+                        print(json.dumps(experimenter.job_info(index), indent=2))
                     else:
                         print(f"Index {index+1} is out of bounds.")
                 except Exception:
@@ -613,6 +4414,12 @@ if __name__ == "__main__":
                         experimenter.reset(int(indices) - 1)
                 except Exception:
                     print("Invalid command.")
+            elif user_input == 'compact':
+                if not campaign.segment_store.is_open:
+                    print("No segment store (start with --store packed).")
+                else:
+                    before, after = campaign.segment_store.compact()
+                    print(f"Compacted segments from {before} to {after} bytes.")
             elif user_input.startswith('complete '):
                 try:
                     indices_str = user_input.split()[1]
@@ -629,7 +4436,15 @@ if __name__ == "__main__":
         print("\nKeyboardInterrupt detected. Shutting down the server...")
         
     finally:
-        experimenter.save_state() # Final save on exit
+        if relay is not None:
+            try:
+                relay.forward() # Whatever finished since the last round
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Forwarding to {relay.upstream} failed: {e}")
+        for campaign in campaigns:
+            campaign.experimenter.save_state() # Final save on exit
+            campaign.segment_store.close()
+            campaign.completion_index.close()
         server.shutdown()
         server.server_close()
         server_thread.join()
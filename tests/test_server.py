@@ -0,0 +1,175 @@
+"""
+Checks for server.py: the lazy parameter space against the eager generator
+it replaced, and recovery of the job states from checkpoint and journal.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import contextlib
+import importlib.util
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+PARAMETER_FILES = ["example_parameters.py", "parameters_bbbc.py", "parameters_msga.py", "parameters_rs.py"]
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location("server", os.path.join(SERVER_DIR, "server.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+server = load_server()
+
+
+def eager_combined_data(shared_params, id_counter, *param_sets, constraints=(), where=None, transform=None):
+    """generate_combined_data as it was before ParameterSpace: every combination built up front
+    with generate_combinations, then filtered, numbered and transformed one by one."""
+    combined_data_array = []
+    for params in param_sets:
+        merged = server.merge_objects(shared_params, params)
+        checks = [constraint.accepts for constraint in constraints if constraint.applies_to(merged)]
+        temp_data_array, _ = server.generate_combinations(merged, 0)
+        for job in temp_data_array:
+            del job['id']
+            if not all(check(job) for check in checks) or (where is not None and not where(job)):
+                continue
+            job['id'] = id_counter
+            id_counter += 1
+            if transform is not None:
+                job = transform(job) or job
+            combined_data_array.append(job)
+    return combined_data_array, id_counter
+
+
+def run_parameter_file(name, **overrides):
+    """The namespace a parameter file leaves behind when run as start_campaign runs it."""
+    with open(os.path.join(SERVER_DIR, name), "r") as f:
+        code = f.read()
+    namespace = dict(vars(server), id_counter=1, **overrides)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exec(code, namespace)
+    return namespace
+
+
+@pytest.mark.parametrize("name", PARAMETER_FILES)
+def test_parameter_space_matches_eager_generator(name):
+    lazy = run_parameter_file(name)
+    eager = run_parameter_file(name, generate_combined_data=eager_combined_data)
+    data_array, expected = lazy["data_array"], eager["data_array"]
+
+    assert isinstance(data_array, server.ParameterSpace)
+    assert lazy["id_counter"] == eager["id_counter"]
+    assert len(data_array) == len(expected)
+    assert [dict(job) for job in data_array] == expected
+    for index in (0, len(expected) // 2, len(expected) - 1, -1):
+        assert data_array[index] == expected[index]
+    assert data_array[1:7:2] == expected[1:7:2]
+
+
+def test_parameter_space_keeps_changes():
+    data_array, _ = server.generate_combined_data({"a": [1, 2], "b": [3, 4]}, 1, {}, {"c": [5]})
+    data_array[1]["b"] = 10
+    data_array[-1] = {"a": 0, "id": 99}
+    data_array.append({"a": 7, "id": 100})
+
+    assert [dict(job) for job in data_array] == [
+        {"a": 1, "b": 3, "id": 1}, {"a": 1, "b": 10, "id": 2}, {"a": 2, "b": 3, "id": 3},
+        {"a": 2, "b": 4, "id": 4}, {"a": 1, "b": 3, "c": 5, "id": 5}, {"a": 1, "b": 4, "c": 5, "id": 6},
+        {"a": 2, "b": 3, "c": 5, "id": 7}, {"a": 0, "id": 99}, {"a": 7, "id": 100},
+    ]
+
+
+JOBS = 20
+
+
+def experimenter(directory):
+    """An Experimenter over JOBS jobs with its logs running, as the server sets one up."""
+    experimenter = server.Experimenter(str(directory))
+    experimenter.lease_timeout = 60
+    experimenter.load_data([{"id": i + 1} for i in range(JOBS)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        experimenter.logs.start()
+        experimenter.stateLogs.start()
+    return experimenter
+
+
+def run_jobs(experimenter, count, finish, computer_name):
+    """Take `count` jobs and complete the first `finish` of them."""
+    IDs = [experimenter.getExperiment('-1', computer_name)["id"] for _ in range(count)]
+    for ID in IDs[:finish]:
+        experimenter.complete(str(ID), computer_name)
+
+
+def flush_journal(experimenter):
+    """What the auto-save thread would have written by the time the process dies."""
+    with experimenter.journal_lock:
+        experimenter._write_journal([])
+
+
+def job_states(experimenter):
+    jobs = experimenter.jobs
+    return jobs.status[:JOBS].copy(), [jobs.owner(i) for i in range(JOBS)], jobs.running, jobs.done
+
+
+def recovered(directory):
+    """A fresh Experimenter that loads the state a crashed one left in `directory`."""
+    restarted = experimenter(directory)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert restarted.load_state()
+    return restarted
+
+
+def assert_same_states(actual, expected):
+    status, owners, running, done = actual
+    assert np.array_equal(status, expected[0])
+    assert owners == expected[1]
+    assert (running, done) == expected[2:]
+
+
+def test_journal_replays_after_crash(tmp_path):
+    crashed = experimenter(tmp_path)
+    crashed.start_queue()
+    run_jobs(crashed, 8, 5, "pc-a")
+    with crashed.lock:
+        crashed.reap_expired(time.time() + 3600) # The three unfinished leases run out
+    run_jobs(crashed, 2, 1, "pc-b")
+    flush_journal(crashed)
+    expected = job_states(crashed)
+
+    assert not os.path.exists(crashed.state_file) # No checkpoint: everything comes from the journal
+    assert_same_states(job_states(recovered(tmp_path)), expected)
+    assert expected[2:] == (1, 6)
+    assert (expected[0] == server.JOB_RESET).sum() >= 1
+
+
+def test_journal_replays_on_top_of_checkpoint(tmp_path):
+    crashed = experimenter(tmp_path)
+    crashed.start_queue()
+    run_jobs(crashed, 6, 4, "pc-a")
+    crashed.save_state()
+    run_jobs(crashed, 5, 3, "pc-b")
+    flush_journal(crashed)
+    expected = job_states(crashed)
+
+    assert os.path.exists(crashed.state_file)
+    assert_same_states(job_states(recovered(tmp_path)), expected)
+
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    crashed = experimenter(tmp_path)
+    crashed.start_queue()
+    run_jobs(crashed, 4, 2, "pc-a")
+    flush_journal(crashed)
+    expected = job_states(crashed)
+    with open(crashed.journal_file, "a") as f:
+        f.write('{"index": 2, "op": "fini') # The process died halfway through this line
+
+    assert_same_states(job_states(recovered(tmp_path)), expected)
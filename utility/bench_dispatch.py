@@ -0,0 +1,172 @@
+"""
+Measure how many jobs the server's dispatch path hands out per second as the
+number of concurrent requests grows, without HTTP in the way.
+
+Loads server.py, gives its Experimenter a synthetic parameter space and lets
+1, 2, 4, ... threads loop over getExperiment and complete, the two calls
+every runner makes per job. Next to the rate it shows how long the jobs
+lock was held and waited for per acquisition (from the /metrics
+histograms). Server output goes to a file in a temporary directory so the
+terminal does not become the bottleneck.
+
+Each thread count is measured --repeat times, taking the counts in turn so
+that drift on the machine spreads over all rows, and every column shows the
+mean ± sample standard deviation. Treat differences within a couple of
+standard deviations as noise; on a machine with few cores they often are.
+
+It needs the lock histograms of /metrics, so it only runs against a
+server.py from commit 847ae74 ("Add a /metrics endpoint") onward. To compare
+with the dispatch path before I/O moved out of the jobs lock, benchmark that
+commit against the current tree:
+
+Usage:
+    python bench_dispatch.py [--threads 1,2,4,8,16,32] [--seconds 3] [--repeat 5] [--jobs 2000000]
+    git show 847ae74:server/server.py > /tmp/server_847ae74.py
+    python bench_dispatch.py --server /tmp/server_847ae74.py
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+
+def load_server(path):
+    spec = importlib.util.spec_from_file_location("bench_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def experimenter(server, directory, jobs):
+    """An Experimenter with `jobs` queued jobs and its logs running, as the server sets one up."""
+    experimenter = server.Experimenter(directory)
+    experimenter.load_data([{"id": i + 1} for i in range(jobs)])
+    experimenter.logs.start()
+    experimenter.stateLogs.start()
+    experimenter.start_queue()
+    return experimenter
+
+
+def lock_totals(histogram):
+    """(Acquisitions, total seconds) of the jobs lock recorded in one of the server's lock histograms."""
+    with histogram.lock:
+        counts = histogram.values.get(("jobs", ""))
+        return (sum(counts[:-1]), counts[-1]) if counts else (0, 0.0)
+
+
+def mean_micros(before, after):
+    count = after[0] - before[0]
+    return (after[1] - before[1]) / count * 1e6 if count else 0.0
+
+
+def spread(values):
+    """Mean and sample standard deviation, 0 for a single value."""
+    return statistics.mean(values), statistics.stdev(values) if len(values) > 1 else 0.0
+
+
+def cell(values, digits):
+    mean, deviation = spread(values)
+    return f"{mean:.{digits}f} ± {deviation:.{digits}f}"
+
+
+def run(server, experimenter, threads, seconds):
+    """Dispatches per second, dispatches, and mean µs the jobs lock was held and waited for per acquisition."""
+    hold, wait = lock_totals(server.LOCK_HOLD_SECONDS), lock_totals(server.LOCK_WAIT_SECONDS)
+    counts = [0] * threads
+    finished = [0.0] * threads
+
+    def worker(slot):
+        # Each worker watches the clock itself, a sleeping main thread can be starved of the GIL
+        name = f"bench-{slot}"
+        while time.perf_counter() < end:
+            job = experimenter.getExperiment('-1', name)
+            if "id" not in job:
+                break # Ran out of jobs, --jobs is too small for --seconds
+            experimenter.complete(str(job["id"]), name)
+            counts[slot] += 1
+        finished[slot] = time.perf_counter()
+
+    workers = [threading.Thread(target=worker, args=(slot,), daemon=True) for slot in range(threads)]
+    start = time.perf_counter()
+    end = start + seconds
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = max(finished) - start
+    return (sum(counts) / elapsed, sum(counts),
+            mean_micros(hold, lock_totals(server.LOCK_HOLD_SECONDS)),
+            mean_micros(wait, lock_totals(server.LOCK_WAIT_SECONDS)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server's dispatch path")
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="Path to server.py (default: ../server/server.py)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=str,
+        default="1,2,4,8,16,32",
+        help="Comma separated thread counts (default: 1,2,4,8,16,32)",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=3,
+        help="Seconds per thread count and repetition (default: 3)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Measurements per thread count (default: 5)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2_000_000,
+        help="Jobs in the synthetic parameter space, shared by all runs (default: 500000)",
+    )
+    args = parser.parse_args()
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    server_path = os.path.abspath(args.server or os.path.join(script_dir, "..", "server", "server.py"))
+    if not os.path.isfile(server_path):
+        print(f"No server at {server_path}")
+        sys.exit(1)
+    thread_counts = [int(count) for count in args.threads.split(",")]
+    repeat = max(1, args.repeat)
+
+    print(f"Dispatch benchmark of {server_path}, {repeat} x {args.seconds:g} s per thread count")
+    server = load_server(server_path)
+    directory = tempfile.mkdtemp(prefix="bench_dispatch_")
+    # Line buffered, like the terminal the server normally prints to
+    with open(os.path.join(directory, "stdout.txt"), "w", buffering=1) as out:
+        with contextlib.redirect_stdout(out):
+            bench = experimenter(server, directory, args.jobs)
+        results = {threads: [] for threads in thread_counts}
+        for turn in range(repeat):
+            print(f"Round {turn + 1} of {repeat}", file=sys.stderr)
+            for threads in thread_counts:
+                with contextlib.redirect_stdout(out):
+                    results[threads].append(run(server, bench, threads, args.seconds))
+    print(f"{'threads':>8} {'jobs/s':>18} {'held µs':>14} {'waited µs':>14}")
+    for threads in thread_counts:
+        rates, totals, held, waited = zip(*results[threads])
+        print(f"{threads:>8} {cell(rates, 0):>18} {cell(held, 1):>14} {cell(waited, 1):>14}")
+    # The server's background threads keep writing here until the process exits
+    print(f"Server output and logs are in {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ Experiment Completion Checker — Textual TUI
 
 Scans a data directory for missing exp-N.mat files based on
 the total experiment count derived from a selected parameter file.
+Found results come from the server's completion index (data/.completed),
+or one pass over the directory if there is none or the server has it open
+(or crashed with it open), so compressed, sharded and packed results all count.
 
 Usage:
     python check.py [--data-dir PATH]
@@ -14,6 +17,8 @@ import os
 import sys
 import time as _time
 
+from result_io import completed_ids
+
 from textual.app import App, ComposeResult
 from textual.containers import Horizontal, Vertical, Center
 from textual.widgets import (
@@ -59,13 +64,52 @@ def generate_combinations(input_obj, id_counter):
     return [result, id_counter]
 
 
-def generate_combined_data(shared_params, id_counter, *param_sets):
+class FixedSum:
+    def __init__(self, keys, total):
+        self.keys = list(keys)
+        self.total = total
+
+    def applies_to(self, params):
+        return all(key in params for key in self.keys)
+
+    def accepts(self, job):
+        return sum(job[key] for key in self.keys) == self.total
+
+
+class ValueRange:
+    def __init__(self, key, low=None, high=None):
+        self.key = key
+        self.low = low
+        self.high = high
+
+    def applies_to(self, params):
+        return self.key in params
+
+    def accepts(self, job):
+        value = job[self.key]
+        return (self.low is None or value >= self.low) and (
+            self.high is None or value <= self.high
+        )
+
+
+def generate_combined_data(
+    shared_params, id_counter, *param_sets, constraints=(), where=None, transform=None
+):
     combined = []
     for params in param_sets:
-        arr, id_counter = generate_combinations(
-            merge_objects(shared_params, params), id_counter
-        )
-        combined += arr
+        params = merge_objects(shared_params, params)
+        checks = [c.accepts for c in constraints if c.applies_to(params)]
+        arr, _ = generate_combinations(params, 0)
+        for job in arr:
+            if not all(check(job) for check in checks):
+                continue
+            if where is not None and not where(job):
+                continue
+            job["id"] = id_counter
+            id_counter += 1
+            if transform is not None:
+                job = transform(job) or job
+            combined.append(job)
     return combined, id_counter
 
 
@@ -176,6 +220,8 @@ class CheckingScreen(Screen):
             "generate_combinations": generate_combinations,
             "generate_combined_data": generate_combined_data,
             "merge_objects": merge_objects,
+            "FixedSum": FixedSum,
+            "ValueRange": ValueRange,
             "print_list_as_json": print_list_as_json,
         }
         if np is not None:
@@ -215,13 +261,13 @@ class CheckingScreen(Screen):
         update_every = max(1, total // 800)
         batch_lines = []
         advanced = 0
+        done = completed_ids(data_dir)
 
         for i in range(total):
             exp_id = i + 1
             fname = f"exp-{exp_id}.mat"
-            fpath = os.path.join(data_dir, fname)
 
-            exists = os.path.isfile(fpath)
+            exists = exp_id in done
             if exists:
                 found += 1
                 batch_lines.append(f"[green]  ✓  {fname}[/]")
@@ -2,10 +2,12 @@ import scipy.io
 import pandas as pd
 import os
 from collections import defaultdict
+from result_io import iter_results, open_result
 
 def extract_data_from_mat(file_path):
     import numpy as np
-    mat_data = scipy.io.loadmat(file_path, squeeze_me=True, struct_as_record=False)
+    with open_result(file_path) as f:
+        mat_data = scipy.io.loadmat(f, squeeze_me=True, struct_as_record=False)
     data = mat_data['data']
 
     func = int(data.func)
@@ -51,14 +53,13 @@ def process_all_mat_files(folder_path):
     from collections import defaultdict
     results = defaultdict(list)
 
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.mat'):
-            file_path = os.path.join(folder_path, filename)
-            try:
-                key, min_fitnesses = extract_data_from_mat(file_path)
-                results[key].extend(min_fitnesses)
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
+    # Also picks up results the server stored compressed (exp-1.mat.gz)
+    for filename, file_path in iter_results(folder_path, '.mat'):
+        try:
+            key, min_fitnesses = extract_data_from_mat(file_path)
+            results[key].extend(min_fitnesses)
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
 
     # Convert grouped data into a DataFrame
     rows = []
@@ -0,0 +1,79 @@
+"""
+Convert a results directory between the flat layout and the sharded one
+(server.py --shard-size). Stop the server before running it.
+
+Every result is moved (renamed, nothing is copied) into the directory its
+id belongs in, then data/.layout.json is updated. Running it again after an
+interruption picks up where it stopped.
+
+Usage:
+    python migrate_layout.py --shard-size 1000 [--data-dir ../server/data]
+    python migrate_layout.py --shard-size 0     # back to a flat directory
+"""
+
+import argparse
+import os
+import sys
+
+from result_io import iter_results, read_layout, result_dir, write_layout
+
+
+def migrate(data_dir, shard_size):
+    moved = 0
+    # Materialise the listing first, the loop creates and empties directories
+    for _, path in list(iter_results(data_dir)):
+        file_name = os.path.basename(path)
+        target_dir = result_dir(data_dir, file_name, shard_size)
+        target = os.path.join(target_dir, file_name)
+        if os.path.abspath(path) == os.path.abspath(target):
+            continue
+        os.makedirs(target_dir, exist_ok=True)
+        os.replace(path, target)
+        moved += 1
+        if moved % 10_000 == 0:
+            print(f"  moved {moved} files...")
+
+    # Drop shard directories left empty (all of them when flattening)
+    for entry in os.scandir(data_dir):
+        if entry.is_dir() and not entry.name.startswith(".") and not os.listdir(entry.path):
+            os.rmdir(entry.path)
+
+    write_layout(data_dir, shard_size)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert server/data between flat and sharded layouts")
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        required=True,
+        help="Ids per subdirectory, 0 for a flat directory",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=None,
+        help="Path to the data directory (default: ../server/data)",
+    )
+    args = parser.parse_args()
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir or os.path.join(script_dir, "..", "server", "data")
+    data_dir = os.path.abspath(data_dir)
+
+    if args.shard_size < 0:
+        print("--shard-size must be 0 or more")
+        sys.exit(1)
+    if not os.path.isdir(data_dir):
+        print(f"No data directory at {data_dir}")
+        sys.exit(1)
+
+    old = read_layout(data_dir)
+    print(f"Converting {data_dir} from shard size {old} to {args.shard_size}")
+    moved = migrate(data_dir, args.shard_size)
+    print(f"Done, moved {moved} files.")
+
+
+if __name__ == "__main__":
+    main()
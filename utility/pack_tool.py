@@ -0,0 +1,98 @@
+"""
+Inspect and export the packed result store (server.py --store packed).
+
+Usage:
+    python pack_tool.py list                    # every result with its size
+    python pack_tool.py get 123 > exp-123.mat   # one result by job id, decompressed
+    python pack_tool.py export --tar results.tar   # everything, "-" for stdout
+    python pack_tool.py export --dir results/
+
+export also includes results stored as plain files, so it turns any data
+directory into one flat set of files. Compaction runs inside the server:
+type `compact` at its prompt.
+"""
+
+import argparse
+import io
+import os
+import sys
+import tarfile
+import time
+
+from result_io import iter_results, packed_store, read_result
+
+
+def cmd_list(data_dir, args):
+    store = packed_store(data_dir)
+    if store is None:
+        print(f"No packed store in {data_dir}")
+        return 1
+    for packed in store:
+        print(f"{packed.length:>12}  {packed.name}")
+    print(f"{len(store)} results")
+    return 0
+
+
+def cmd_get(data_dir, args):
+    store = packed_store(data_dir)
+    packed = store.get(args.id) if store is not None else None
+    if packed is None:
+        print(f"No packed result for job {args.id}", file=sys.stderr)
+        return 1
+    sys.stdout.buffer.write(read_result(packed))
+    return 0
+
+
+def cmd_export(data_dir, args):
+    count = 0
+    if args.tar:
+        out = sys.stdout.buffer if args.tar == "-" else open(args.tar, "wb")
+        # "w|" writes a plain stream, nothing is buffered beyond the current result
+        with tarfile.open(fileobj=out, mode="w|") as tar:
+            for name, path in iter_results(data_dir):
+                data = read_result(path)
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+                count += 1
+        if out is not sys.stdout.buffer:
+            out.close()
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        for name, path in iter_results(data_dir):
+            with open(os.path.join(args.dir, name), "wb") as f:
+                f.write(read_result(path))
+            count += 1
+    print(f"Exported {count} results", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed result store tool")
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=None,
+        help="Path to the data directory (default: ../server/data)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List packed results")
+    get = commands.add_parser("get", help="Write one result to stdout")
+    get.add_argument("id", type=int, help="Job id")
+    export = commands.add_parser("export", help="Export every result")
+    target = export.add_mutually_exclusive_group(required=True)
+    target.add_argument("--tar", help="Tar file to write, - for stdout")
+    target.add_argument("--dir", help="Directory to write the files to")
+    args = parser.parse_args()
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir or os.path.join(script_dir, "..", "server", "data")
+    data_dir = os.path.abspath(data_dir)
+
+    handlers = {"list": cmd_list, "get": cmd_get, "export": cmd_export}
+    sys.exit(handlers[args.command](data_dir, args))
+
+
+if __name__ == "__main__":
+    main()
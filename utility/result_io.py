@@ -0,0 +1,280 @@
+"""
+Read results from the server's data/ directory whether they were stored
+as uploaded or compressed (server.py --compress-results gzip|zstd, which
+appends .gz / .zst to the file name), flat or sharded into subdirectories
+by id (server.py --shard-size, recorded in data/.layout.json), or packed
+into segment files (server.py --store packed, in data/.packed).
+
+    from result_io import iter_results, open_result
+
+    for name, path in iter_results("../server/data", ".mat"):
+        with open_result(path) as f:
+            ...
+"""
+
+import gzip
+import io
+import json
+import os
+import re
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+LAYOUT_FILE = ".layout.json"
+PACKED_DIR = ".packed"
+COMPLETION_FILE = ".completed"
+COMPLETION_DIRTY = ".completed.dirty" # The server has the index open, or crashed with it open
+
+
+# ── Layout (mirrored from server.py) ───────────────────────────────────
+
+
+def read_layout(data_dir):
+    """Shard size recorded in data_dir/.layout.json, 0 (flat) if there is none."""
+    try:
+        with open(os.path.join(data_dir, LAYOUT_FILE)) as f:
+            return int(json.load(f).get("shard_size", 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def write_layout(data_dir, shard_size):
+    tmp_path = os.path.join(data_dir, LAYOUT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"shard_size": shard_size}, f)
+    os.replace(tmp_path, os.path.join(data_dir, LAYOUT_FILE))
+
+
+def result_id(file_name):
+    """Job id of a result file: the last number in its name (exp-12.mat -> 12)."""
+    match = re.search(r"(\d+)\D*$", file_name)
+    return int(match.group(1)) if match else None
+
+
+def result_dir(data_dir, file_name, shard_size):
+    ident = result_id(file_name) if shard_size else None
+    if ident is None:
+        return data_dir
+    return os.path.join(data_dir, f"{ident // shard_size:06d}")
+
+
+# ── Reading ────────────────────────────────────────────────────────────
+
+
+def strip_suffix(file_name):
+    """Result name without the compression suffix added by the server."""
+    for suffix in COMPRESSED_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[: -len(suffix)]
+    return file_name
+
+
+class PackedResult:
+    """A result inside a segment file of the packed store (server.py --store packed)."""
+
+    def __init__(self, name, segment_path, offset, length):
+        self.name = name
+        self.segment_path = segment_path
+        self.offset = offset
+        self.length = length
+
+    def read_raw(self):
+        with open(self.segment_path, "rb") as f:
+            f.seek(self.offset)
+            return f.read(self.length)
+
+    def __repr__(self):
+        return f"{self.segment_path}@{self.offset}:{self.name}"
+
+
+class PackedStore:
+    """Read-only view of data/.packed: index.bin plus any records written after it (mirrored from server.py)."""
+
+    RECORD = struct.Struct("<4sHQI")
+    ENTRY = struct.Struct("<IQQH")
+    MAGIC = b"PRS1"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.by_id = {}
+        covered = {}
+
+        index_path = os.path.join(directory, "index.bin")
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                data = f.read()
+            pos = 0
+            while pos + self.ENTRY.size <= len(data):
+                segment, offset, length, name_len = self.ENTRY.unpack_from(data, pos)
+                end = pos + self.ENTRY.size + name_len
+                if end > len(data):
+                    break
+                self._remember(data[pos + self.ENTRY.size : end].decode(), segment, offset, length)
+                covered[segment] = max(covered.get(segment, 0), offset + length)
+                pos = end
+
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("seg-") and name.endswith(".pack"):
+                segment = int(name[4:10])
+                self._scan(segment, covered.get(segment, 0))
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"seg-{segment:06d}.pack")
+
+    def _remember(self, name, segment, offset, length):
+        self.entries[name] = (segment, offset, length)
+        ident = result_id(name)
+        if ident is not None:
+            self.by_id[ident] = name
+
+    def _scan(self, segment, position):
+        path = self.segment_path(segment)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            while position + self.RECORD.size <= size:
+                f.seek(position)
+                magic, name_len, length, crc = self.RECORD.unpack(f.read(self.RECORD.size))
+                offset = position + self.RECORD.size + name_len
+                if magic != self.MAGIC or offset + length > size:
+                    break
+                name = f.read(name_len).decode()
+                if zlib.crc32(f.read(length)) != crc:
+                    break
+                self._remember(name, segment, offset, length)
+                position = offset + length
+
+    def _result(self, name):
+        segment, offset, length = self.entries[name]
+        return PackedResult(name, self.segment_path(segment), offset, length)
+
+    def find(self, stored_name):
+        """PackedResult stored under exactly this name, or None."""
+        return self._result(stored_name) if stored_name in self.entries else None
+
+    def get(self, job_id):
+        """PackedResult of job `job_id`, or None."""
+        name = self.by_id.get(job_id)
+        return self._result(name) if name is not None else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """PackedResults in the order they sit on disk, so reading them all is sequential."""
+        for name, _ in sorted(self.entries.items(), key=lambda item: item[1]):
+            yield self._result(name)
+
+
+def packed_store(data_dir):
+    """PackedStore of data_dir, or None if it has none."""
+    directory = os.path.join(data_dir, PACKED_DIR)
+    return PackedStore(directory) if os.path.isdir(directory) else None
+
+
+def result_path(data_dir, file_name, shard_size=None, store=None):
+    """Where `file_name` is: a path in data_dir (plain or compressed), a PackedResult, or None.
+
+    When looking up many files, pass shard_size (from read_layout) and store
+    (from packed_store) to avoid re-reading them every call.
+    """
+    if shard_size is None:
+        shard_size = read_layout(data_dir)
+    directory = result_dir(data_dir, file_name, shard_size)
+    for suffix in ("",) + COMPRESSED_SUFFIXES:
+        path = os.path.join(directory, file_name + suffix)
+        if os.path.isfile(path):
+            return path
+    if store is None:
+        store = packed_store(data_dir)
+    if store is not None:
+        for suffix in ("",) + COMPRESSED_SUFFIXES:
+            packed = store.find(file_name + suffix)
+            if packed is not None:
+                return packed
+    return None
+
+
+def iter_results(data_dir, extension=""):
+    """Yield (file_name, path) for every result whose uncompressed name ends with `extension`.
+
+    Looks in data_dir and its shard directories, whatever the layout says,
+    then in the packed store; for those `path` is a PackedResult. Both work
+    with read_result and open_result.
+    """
+    yield from _iter_files(data_dir, extension)
+    store = packed_store(data_dir)
+    if store is not None:
+        for packed in store:
+            name = strip_suffix(packed.name)
+            if name.endswith(extension):
+                yield name, packed
+
+
+def _iter_files(directory, extension):
+    for entry in os.scandir(directory):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            yield from _iter_files(entry.path, extension)
+            continue
+        name = strip_suffix(entry.name)
+        if name.endswith(extension):
+            yield name, entry.path
+
+
+def completed_ids(data_dir):
+    """Set of job ids that have a stored result.
+
+    Read from the server's completion index (data/.completed, one bit per id)
+    once the server has closed it cleanly; without one, or while it is marked
+    dirty (the server is running or crashed), from a single pass over
+    data_dir and the packed store.
+    """
+    path = os.path.join(data_dir, COMPLETION_FILE)
+    if os.path.exists(path) and not os.path.exists(os.path.join(data_dir, COMPLETION_DIRTY)):
+        with open(path, "rb") as f:
+            bits = f.read()
+        return {
+            byte * 8 + bit
+            for byte, value in enumerate(bits)
+            if value
+            for bit in range(8)
+            if value >> bit & 1
+        }
+
+    ids = set()
+    for name, _ in iter_results(data_dir):
+        ident = result_id(name)
+        if ident is not None:
+            ids.add(ident)
+    return ids
+
+
+def read_result(path):
+    """Contents of a result (file path or PackedResult) as bytes, decompressed if needed."""
+    if isinstance(path, PackedResult):
+        data, name = path.read_raw(), path.name
+    else:
+        with open(path, "rb") as f:
+            data, name = f.read(), path
+    if name.endswith(".gz"):
+        return gzip.decompress(data)
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"Reading {name} needs the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def open_result(path):
+    """Binary, seekable file object over a result (file path or PackedResult), decompressed if needed."""
+    if isinstance(path, PackedResult) or path.endswith(COMPRESSED_SUFFIXES):
+        return io.BytesIO(read_result(path))
+    return open(path, "rb")